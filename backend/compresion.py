@@ -0,0 +1,236 @@
+import gzip
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import brotli
+except ImportError:  # Opcional: pip install brotli
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Opcional: pip install zstandard
+    zstandard = None
+
+# ==============================================
+# COMPRESIÓN DE RESPUESTAS
+# ==============================================
+# Se elige la codificación según Accept-Encoding (respetando q=0) en el orden de
+# preferencia del servidor: zstd, br y gzip; las dos primeras solo si su módulo
+# está instalado.
+#
+# Las respuestas de RUTAS_CACHE se guardan ya codificadas en una caché LRU por
+# (empresa, ruta con query, token de cambios, codificación). El token se lee
+# antes de llamar al endpoint, así un acierto se sirve sin construir ni
+# serializar el cuerpo; cualquier escritura registra un cambio, sube el token y
+# deja las entradas viejas sin uso hasta que el LRU las saque. Solo entran rutas
+# cuya respuesta depende únicamente de lo que registra el log de cambios (no el
+# dashboard, que depende del mes en curso, ni los reportes, que tienen su caché).
+#
+# El token de cada empresa se recuerda en memoria: cualquier commit de una sesión
+# de este proceso lo olvida, y a los COMPRESION_TOKEN_SEGUNDOS se vuelve a leer
+# para ver lo que escriban otros procesos. Así un acierto no abre una sesión.
+
+COMPRESION_MINIMO = int(os.getenv("COMPRESION_MINIMO", "1024"))              # Bytes
+COMPRESION_CACHE_BYTES = int(os.getenv("COMPRESION_CACHE_MB", "8")) * 1024 * 1024
+COMPRESION_HILO_BYTES = int(os.getenv("COMPRESION_HILO_KB", "256")) * 1024   # Más grande: fuera del event loop
+COMPRESION_TOKEN_SEGUNDOS = float(os.getenv("COMPRESION_TOKEN_SEGUNDOS", "1"))  # Vigencia del token recordado
+
+# Nivel de cada codificador: el punto en que más compresión ya cuesta demasiada CPU
+_NIVEL_GZIP = 6
+_NIVEL_BROTLI = 5
+_NIVEL_ZSTD = 3
+
+TIPOS_COMPRIMIBLES = ("application/json", "text/", "application/javascript")
+
+RUTAS_CACHE = re.compile(
+    r"^/api/(clientes|tipos-cotizacion|clausulas|cotizaciones|editor-cotizacion|changes)$"
+    r"|^/api/cotizaciones/\d+(/revisiones(/\d+(/cambios)?)?)?$"
+)
+
+
+def _gzip(datos: bytes) -> bytes:
+    # mtime=0: la misma entrada da siempre los mismos bytes
+    return gzip.compress(datos, compresslevel=_NIVEL_GZIP, mtime=0)
+
+
+CODIFICADORES = {"gzip": _gzip}
+if brotli is not None:
+    CODIFICADORES["br"] = lambda datos: brotli.compress(datos, quality=_NIVEL_BROTLI)
+if zstandard is not None:
+    CODIFICADORES["zstd"] = lambda datos: zstandard.ZstdCompressor(level=_NIVEL_ZSTD).compress(datos)
+
+PREFERENCIA = [c for c in ("zstd", "br", "gzip") if c in CODIFICADORES]
+
+
+def elegir_codificacion(accept_encoding: str) -> Optional[str]:
+    """La codificación preferida que el cliente acepta (None = sin comprimir)"""
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                calidad = float(parametros.strip()[2:])
+            except ValueError:
+                calidad = 0.0
+        aceptadas[nombre.strip()] = calidad
+    comodin = aceptadas.get("*", 0.0)
+    candidatas = [(aceptadas.get(c, comodin), -i, c) for i, c in enumerate(PREFERENCIA)]
+    calidad, _, codificacion = max(candidatas, default=(0.0, 0, None))
+    return codificacion if calidad > 0 else None
+
+
+def comprimible(tipo: str) -> bool:
+    return tipo.startswith(TIPOS_COMPRIMIBLES) and not tipo.startswith("text/event-stream")
+
+
+class _Estadistica:
+    def __init__(self):
+        self.respuestas = 0
+        self.desde_cache = 0
+        self.bytes_originales = 0
+        self.bytes_enviados = 0
+        self.cpu_ms = 0.0
+
+    def resumen(self) -> dict:
+        return {
+            "respuestas": self.respuestas,
+            "desde_cache": self.desde_cache,
+            "bytes_originales": self.bytes_originales,
+            "bytes_enviados": self.bytes_enviados,
+            "ratio": round(self.bytes_originales / self.bytes_enviados, 2) if self.bytes_enviados else None,
+            "cpu_ms": round(self.cpu_ms, 2),
+            "cpu_ms_por_mb": round(self.cpu_ms / (self.bytes_originales / 1e6), 2) if self.bytes_originales else None,
+        }
+
+
+_cache = OrderedDict()          # (empresa, ruta, token, codificación) -> Guardada
+_cache_bytes = 0
+_lock = threading.Lock()
+_estadisticas = {c: _Estadistica() for c in [*PREFERENCIA, "identity"]}
+
+
+class Guardada:
+    """Respuesta lista para reenviar: estado, encabezados finales y cuerpo ya codificado"""
+    __slots__ = ("estado", "encabezados", "cuerpo", "bytes_originales")
+
+    def __init__(self, estado: int, encabezados: list, cuerpo: bytes, bytes_originales: int):
+        self.estado = estado
+        self.encabezados = encabezados
+        self.cuerpo = cuerpo
+        self.bytes_originales = bytes_originales
+
+
+def etag_codificada(etag: bytes, codificacion: str) -> bytes:
+    """ETag de la variante codificada: "5" -> "5-gzip" (version_if_match quita el sufijo)
+
+    Una ETag fuerte identifica bytes exactos; la variante gzip no puede llevar la misma.
+    """
+    if not etag.endswith(b'"'):
+        return etag
+    return etag[:-1] + b"-" + codificacion.encode() + b'"'
+
+
+def cacheable(metodo: str, ruta: str) -> bool:
+    return metodo == "GET" and RUTAS_CACHE.match(ruta) is not None
+
+
+def comprimir(cuerpo: bytes, codificacion: str) -> bytes:
+    """Cuerpo comprimido (puede correr en un hilo)"""
+    inicio = time.thread_time()
+    comprimido = CODIFICADORES[codificacion](cuerpo)
+    cpu_ms = (time.thread_time() - inicio) * 1000
+    with _lock:
+        _anotar(_estadisticas[codificacion], len(cuerpo), len(comprimido), cpu_ms)
+    return comprimido
+
+
+def leer(clave: tuple) -> Optional[Guardada]:
+    with _lock:
+        guardada = _cache.get(clave)
+        if guardada is None:
+            return None
+        _cache.move_to_end(clave)
+        estadistica = _estadisticas[clave[-1] or "identity"]
+        estadistica.desde_cache += 1
+        _anotar(estadistica, guardada.bytes_originales, len(guardada.cuerpo), 0.0)
+        return guardada
+
+
+def guardar(clave: tuple, guardada: Guardada):
+    global _cache_bytes
+    with _lock:
+        if len(guardada.cuerpo) > COMPRESION_CACHE_BYTES // 8 or clave in _cache:
+            return
+        _cache[clave] = guardada
+        _cache_bytes += len(guardada.cuerpo)
+        while _cache_bytes > COMPRESION_CACHE_BYTES:
+            _, vieja = _cache.popitem(last=False)
+            _cache_bytes -= len(vieja.cuerpo)
+
+
+def _anotar(estadistica: _Estadistica, originales: int, enviados: int, cpu_ms: float):
+    estadistica.respuestas += 1
+    estadistica.bytes_originales += originales
+    estadistica.bytes_enviados += enviados
+    estadistica.cpu_ms += cpu_ms
+
+
+def anotar_sin_comprimir(cuerpo: bytes):
+    with _lock:
+        _anotar(_estadisticas["identity"], len(cuerpo), len(cuerpo), 0.0)
+
+
+# ====================== TOKEN DE CADA EMPRESA ======================
+
+_tokens = {}        # empresa -> (token, generación, time.monotonic() de la lectura)
+_generaciones = {}  # empresa -> commits vistos en este proceso
+
+
+def generacion(empresa: str) -> int:
+    """Tomarla antes de leer el token: `recordar_token` la compara"""
+    return _generaciones.get(empresa, 0)
+
+
+def token_recordado(empresa: str) -> Optional[int]:
+    recordado = _tokens.get(empresa)
+    if recordado is None:
+        return None
+    token, gen, leido = recordado
+    if gen != generacion(empresa) or time.monotonic() - leido >= COMPRESION_TOKEN_SEGUNDOS:
+        return None
+    return token
+
+
+def recordar_token(empresa: str, token: int, gen: int):
+    """Guardar el token leído, salvo que un commit haya ocurrido mientras se leía"""
+    with _lock:
+        if gen == generacion(empresa):
+            _tokens[empresa] = (token, gen, time.monotonic())
+
+
+@event.listens_for(Session, "after_commit")
+def _olvidar_token(sesion):
+    # Después del commit: una lectura que empiece ahora ya ve el token nuevo
+    empresa = sesion.info.get("tenant")
+    with _lock:
+        for codigo in [empresa] if empresa else list(_generaciones.keys() | _tokens.keys()):
+            _generaciones[codigo] = _generaciones.get(codigo, 0) + 1
+            _tokens.pop(codigo, None)
+
+
+def metricas() -> dict:
+    with _lock:
+        return {
+            "disponibles": PREFERENCIA,
+            "minimo_bytes": COMPRESION_MINIMO,
+            "cache": {"entradas": len(_cache), "bytes": _cache_bytes, "limite_bytes": COMPRESION_CACHE_BYTES},
+            "por_codificacion": {c: e.resumen() for c, e in _estadisticas.items()},
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -16,15 +16,30 @@ DB_DIR = BASE_DIR / "database"
 DB_DIR.mkdir(exist_ok=True)
 
 # Ruta completa a la base de datos
-DB_PATH = DB_DIR / "shizzo.db"
+DB_PATH = Path(os.getenv("DB_PATH", DB_DIR / "shizzo.db"))
+
+# Base de archivo: cotizaciones cerradas y antiguas (ver services/archivo_service.py)
+ARCHIVO_DB_PATH = Path(os.getenv("ARCHIVO_DB_PATH", DB_DIR / "shizzo_archivo.db"))
+
+def adjuntar_archivo(engine, ruta):
+    """Adjuntar la base de archivo como esquema `archivo` en cada conexión nueva"""
+    @event.listens_for(engine, "connect")
+    def _adjuntar(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS archivo", (str(ruta),))
+
+def crear_engine(db_path, archivo_path):
+    """Engine de SQLite con su base de archivo adjunta (uno por empresa, ver tenants.py)"""
+    nuevo = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False}
+    )
+    adjuntar_archivo(nuevo, archivo_path)
+    return nuevo
 
 # Crear engine
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+engine = crear_engine(DB_PATH, ARCHIVO_DB_PATH)
 
 # Session local para hacer consultas
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -32,7 +47,7 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base para crear modelos
 Base = declarative_base()
 
-# Función para obtener una sesión de base de datos
+# Sesión de la empresa por defecto (scripts); la API usa tenants.get_db
 def get_db():
     db = SessionLocal()
     try:
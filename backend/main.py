@@ -1,26 +1,74 @@
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import uvicorn
-from database import engine, get_db, Base
-from models import Cliente, Cotizacion, ItemCotizacion, TerminoCotizacion, TipoCotizacion
+from tenants import TENANTS, TENANT_POR_DEFECTO, Tenant, get_db, sesiones, tenant_de_peticion
+from middleware import MedidorLatencia, Perfilador, ControlAdmision, Compresion, Idempotencia
+import compresion
+import perfilado
+from models import Cliente, Cotizacion, ItemCotizacion, TipoCotizacion
 from schemas import (
-    ClienteCreate, ClienteResponse,
-    CotizacionCreate, CotizacionResponse,
-    TipoCotizacionCreate, TipoCotizacionResponse
+    ClienteCreate, ClienteResponse, ClientesLoteRequest, ClientesLoteResponse,
+    CotizacionCreate, CotizacionResponse, CambiarEstadosRequest, CambiarEstadosResponse,
+    EditorCotizacionResponse, RevisionResponse,
+    TipoCotizacionCreate, TipoCotizacionResponse, CambiarTasaItbisRequest,
+    ClausulaCreate, ClausulaResponse,
+    CambiosResponse
 )
-from services.cotizacion_service import CotizacionService
+from services.cotizacion_service import CotizacionService, ConflictoVersionError
+from services.archivo_service import ArchivoService
+from services.cambios_service import CambiosService, TokenVencidoError, ENTIDADES_CAMBIOS
+from services.clausula_service import ClausulaService
+from services.cliente_service import ClienteService, normalizar_rnc
+from services.dashboard_service import DashboardService
+from services.pdf_assets import PERFILES
+from services.reportes_service import ReportesService
+from services import respaldo_service
+from services.respaldo_service import RespaldoService, RespaldoEnCursoError
+from services.revision_service import RevisionService
+from tareas import iniciar_tareas, detener_tareas, metricas_tareas
+import asyncio
+import json
 import os
+import secrets
 from pydantic import BaseModel
 
-# Crear las tablas en la base de datos
-Base.metadata.create_all(bind=engine)
+# Crear las tablas de la empresa por defecto al arrancar (las demás, al primer uso)
+sesiones(TENANTS[TENANT_POR_DEFECTO])
+
+# Tareas periódicas (vencimientos, etc.) mientras la API está arriba
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tareas = iniciar_tareas()
+    yield
+    await detener_tareas(tareas)
 
 # Crear la aplicación
-app = FastAPI(title="SHIZZO API", version="1.0.0")
+app = FastAPI(title="SHIZZO API", version="1.0.0", lifespan=lifespan)
+app.router.route_class = perfilado.RutaPerfilable  # Endpoints perfilables bajo demanda
+
+# Perfilado opcional (apagado salvo que se configure PERFILADO_TOKEN o PERFILADO_MUESTREO)
+app.add_middleware(Perfilador)
+
+# Concurrencia por grupo de rutas (pdf, pesado, crud) con 503 + Retry-After al saturarse
+app.add_middleware(ControlAdmision)
+
+# Idempotency-Key en los POST: los reintentos reciben la respuesta guardada
+app.add_middleware(Idempotencia)
+
+# gzip (y br/zstd si están instalados) según Accept-Encoding, con caché de cuerpos comprimidos
+app.add_middleware(Compresion)
+
+# Latencia de cada petición, incluida la espera en cola y los aciertos de la caché comprimida
+# (se reporta por grupo de rutas y junto a los respaldos)
+app.add_middleware(MedidorLatencia)
 
 # CORS
 app.add_middleware(
@@ -29,8 +77,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Perfil-Id", "Retry-After", "Idempotent-Replayed"],
 )
 
+# ====================== CONCURRENCIA OPTIMISTA ======================
+
+def version_if_match(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """Extraer la versión esperada del encabezado If-Match ("3", W/"3", 3 o "3-gzip")
+
+    Las respuestas comprimidas llevan la codificación como sufijo de la ETag (ver compresion.py).
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    valor = if_match.strip()
+    if valor.startswith("W/"):
+        valor = valor[2:]
+    valor = valor.strip('"')
+    version, _, codificacion = valor.partition("-")
+    if codificacion and codificacion not in compresion.CODIFICADORES:
+        raise HTTPException(status_code=400, detail="Encabezado If-Match inválido")
+    try:
+        return int(version)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Encabezado If-Match inválido")
+
+def poner_etag(response: Response, version: int):
+    """Publicar la versión actual como ETag para futuros If-Match"""
+    response.headers["ETag"] = f'"{version}"'
+
 # ====================== RUTAS DE PRUEBA ======================
 
 @app.get("/")
@@ -39,41 +113,105 @@ def home():
 
 # ====================== CLIENTES ======================
 
+def _rnc_en_uso(existente) -> HTTPException:
+    if existente.activo:
+        return HTTPException(status_code=400, detail="Ya existe un cliente con ese RNC")
+    return HTTPException(
+        status_code=400, detail=f"El RNC pertenece a un cliente inactivo (ID {existente.id})"
+    )
+
 @app.post("/api/clientes", response_model=ClienteResponse)
 def crear_cliente(cliente: ClienteCreate, db: Session = Depends(get_db)):
-    """Crear un nuevo cliente"""
-    db_cliente = Cliente(**cliente.model_dump())
-    db.add(db_cliente)
-    db.commit()
-    db.refresh(db_cliente)
-    return db_cliente
+    """Crear un nuevo cliente (si el RNC es de un cliente desactivado, se reactiva con estos datos)"""
+    rnc_normalizado = normalizar_rnc(cliente.rnc)
+    existente = ClienteService.cliente_con_rnc(db, rnc_normalizado)
+    if existente and existente.activo:
+        raise _rnc_en_uso(existente)
+    try:
+        if existente:
+            cliente_id = existente.id
+            db.execute(
+                update(Cliente)
+                .where(Cliente.id == cliente_id)
+                .values(**cliente.model_dump(), rnc_normalizado=rnc_normalizado,
+                        activo=True, version=Cliente.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            CambiosService.registrar(db, "cliente", cliente_id, "actualizar")
+        else:
+            db_cliente = Cliente(**cliente.model_dump(), rnc_normalizado=rnc_normalizado)
+            db.add(db_cliente)
+            db.flush()
+            cliente_id = db_cliente.id
+            CambiosService.registrar(db, "cliente", cliente_id, "crear")
+        db.commit()
+    except IntegrityError:
+        # Otra petición guardó el mismo RNC entre la consulta y el commit
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Ya existe un cliente con ese RNC")
+    return db.query(Cliente).filter(Cliente.id == cliente_id).first()
+
+@app.post("/api/clientes/lote", response_model=ClientesLoteResponse)
+def importar_clientes(lote: ClientesLoteRequest, db: Session = Depends(get_db)):
+    """Crear o actualizar clientes en lote, buscándolos por RNC (o correo si no tiene RNC)"""
+    return ClienteService.importar(db, lote.clientes)
 
 @app.get("/api/clientes", response_model=List[ClienteResponse])
 def listar_clientes(db: Session = Depends(get_db)):
-    """Obtener todos los clientes activos"""
+    """Obtener todos los clientes activos, con el resumen de sus cotizaciones"""
     clientes = db.query(Cliente).filter(Cliente.activo == True).all()
     return clientes
 
 @app.get("/api/clientes/{cliente_id}", response_model=ClienteResponse)
-def obtener_cliente(cliente_id: int, db: Session = Depends(get_db)):
+def obtener_cliente(cliente_id: int, response: Response, db: Session = Depends(get_db)):
     """Obtener un cliente por ID"""
     cliente = db.query(Cliente).filter(Cliente.id == cliente_id).first()
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    poner_etag(response, cliente.version)
     return cliente
 
 @app.put("/api/clientes/{cliente_id}", response_model=ClienteResponse)
-def actualizar_cliente(cliente_id: int, cliente: ClienteCreate, db: Session = Depends(get_db)):
-    """Actualizar un cliente"""
-    db_cliente = db.query(Cliente).filter(Cliente.id == cliente_id).first()
-    if not db_cliente:
-        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+def actualizar_cliente(
+    cliente_id: int,
+    cliente: ClienteCreate,
+    response: Response,
+    version_esperada: Optional[int] = Depends(version_if_match),
+    db: Session = Depends(get_db)
+):
+    """Actualizar un cliente (409 si If-Match no coincide con la versión actual)"""
+    rnc_normalizado = normalizar_rnc(cliente.rnc)
+    existente = ClienteService.cliente_con_rnc(db, rnc_normalizado, excluir_id=cliente_id)
+    if existente:
+        raise _rnc_en_uso(existente)
+    condiciones = [Cliente.id == cliente_id]
+    if version_esperada is not None:
+        condiciones.append(Cliente.version == version_esperada)
     
-    for key, value in cliente.model_dump().items():
-        setattr(db_cliente, key, value)
+    try:
+        resultado = db.execute(
+            update(Cliente)
+            .where(*condiciones)
+            .values(**cliente.model_dump(), rnc_normalizado=rnc_normalizado, version=Cliente.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Ya existe un cliente con ese RNC")
+    if resultado.rowcount == 0:
+        db.rollback()
+        version_actual = db.query(Cliente.version).filter(Cliente.id == cliente_id).scalar()
+        if version_actual is None:
+            raise HTTPException(status_code=404, detail="Cliente no encontrado")
+        raise HTTPException(
+            status_code=409,
+            detail=f"El cliente fue modificado por otro usuario (versión actual: {version_actual})"
+        )
     
+    CambiosService.registrar(db, "cliente", cliente_id, "actualizar")
     db.commit()
-    db.refresh(db_cliente)
+    db_cliente = db.query(Cliente).filter(Cliente.id == cliente_id).first()
+    poner_etag(response, db_cliente.version)
     return db_cliente
 
 @app.delete("/api/clientes/{cliente_id}")
@@ -84,6 +222,7 @@ def eliminar_cliente(cliente_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
     
     db_cliente.activo = False
+    CambiosService.registrar(db, "cliente", cliente_id, "eliminar")
     db.commit()
     return {"mensaje": "Cliente eliminado exitosamente"}
 
@@ -100,6 +239,8 @@ def crear_tipo(tipo: TipoCotizacionCreate, db: Session = Depends(get_db)):
     db_tipo = TipoCotizacion(**tipo.model_dump())
     db_tipo.codigo = db_tipo.codigo.upper()  # Siempre en mayúsculas
     db.add(db_tipo)
+    db.flush()
+    CambiosService.registrar(db, "tipo", db_tipo.id, "crear")
     db.commit()
     db.refresh(db_tipo)
     return db_tipo
@@ -118,6 +259,52 @@ def obtener_tipo(tipo_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Tipo no encontrado")
     return tipo
 
+@app.put("/api/tipos-cotizacion/{tipo_id}/tasa-itbis")
+def cambiar_tasa_itbis(tipo_id: int, request: CambiarTasaItbisRequest, db: Session = Depends(get_db)):
+    """Cambiar la tasa de ITBIS de un tipo y re-totalizar sus cotizaciones en una pasada"""
+    tipo = db.query(TipoCotizacion).filter(TipoCotizacion.id == tipo_id).first()
+    if not tipo:
+        raise HTTPException(status_code=404, detail="Tipo no encontrado")
+    
+    tipo.tasa_itbis_bp = request.tasa_itbis_bp
+    CambiosService.registrar(db, "tipo", tipo_id, "actualizar")
+    db.commit()
+    
+    recalculadas = 0
+    if request.recalcular:
+        estados = ["pendiente"] if request.solo_pendientes else None
+        recalculadas = CotizacionService.recalcular_totales(db, tipo_id=tipo_id, estados=estados)
+    
+    return {
+        "mensaje": f"Tasa de ITBIS actualizada a {request.tasa_itbis_bp / 100}%",
+        "cotizaciones_recalculadas": recalculadas
+    }
+
+# ====================== CLÁUSULAS (TÉRMINOS) ======================
+
+@app.get("/api/clausulas", response_model=List[ClausulaResponse])
+def listar_clausulas(tipo_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Catálogo de cláusulas activas (generales y, con tipo_id, las propias del tipo)"""
+    return ClausulaService.listar(db, tipo_id)
+
+@app.post("/api/clausulas", response_model=ClausulaResponse)
+def crear_clausula(clausula: ClausulaCreate, db: Session = Depends(get_db)):
+    """Agregar una cláusula; si el mismo texto ya existe se devuelve la existente"""
+    if clausula.tipo_id is not None:
+        if not db.query(TipoCotizacion.id).filter(TipoCotizacion.id == clausula.tipo_id).first():
+            raise HTTPException(status_code=404, detail="Tipo no encontrado")
+    try:
+        return ClausulaService.crear(db, clausula.texto, clausula.tipo_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/clausulas/{clausula_id}")
+def eliminar_clausula(clausula_id: int, db: Session = Depends(get_db)):
+    """Retirar una cláusula del catálogo (soft delete; las cotizaciones existentes la conservan)"""
+    if not ClausulaService.desactivar(db, clausula_id):
+        raise HTTPException(status_code=404, detail="Cláusula no encontrada")
+    return {"mensaje": "Cláusula eliminada exitosamente"}
+
 # ====================== COTIZACIONES ======================
 
 @app.post("/api/cotizaciones", response_model=CotizacionResponse)
@@ -136,19 +323,77 @@ def listar_cotizaciones(db: Session = Depends(get_db)):
     cotizaciones = CotizacionService.listar(db)
     return cotizaciones
 
+@app.get("/api/editor-cotizacion", response_model=EditorCotizacionResponse)
+def datos_editor_cotizacion(
+    response: Response,
+    cotizacion_id: Optional[int] = None,
+    clientes_version: Optional[int] = None,
+    tipos_version: Optional[int] = None,
+    clausulas_version: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Cotización (si se indica) y catálogos del editor en una sola petición.
+    
+    Los *_version son las versiones que el frontend ya tiene en caché: los catálogos
+    que no cambiaron vuelven en null. El ETag es la versión de la cotización.
+    """
+    try:
+        datos = CotizacionService.datos_editor(db, cotizacion_id, {
+            "cliente": clientes_version, "tipo": tipos_version, "clausula": clausulas_version
+        })
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if datos["cotizacion"] is not None:
+        poner_etag(response, datos["cotizacion"].version)
+    return datos
+
 @app.get("/api/cotizaciones/{cotizacion_id}", response_model=CotizacionResponse)
-def obtener_cotizacion(cotizacion_id: int, db: Session = Depends(get_db)):
+def obtener_cotizacion(cotizacion_id: int, response: Response, db: Session = Depends(get_db)):
     """Obtener una cotización por ID"""
     cotizacion = CotizacionService.obtener_por_id(db, cotizacion_id)
     if not cotizacion:
         raise HTTPException(status_code=404, detail="Cotización no encontrada")
+    poner_etag(response, cotizacion.version)
     return cotizacion
 
+@app.get("/api/cotizaciones/numero/{numero}", response_model=CotizacionResponse)
+def obtener_cotizacion_por_numero(numero: str, response: Response, db: Session = Depends(get_db)):
+    """Obtener una cotización por su número (activa o archivada)"""
+    cotizacion = CotizacionService.obtener_por_numero(db, numero)
+    if not cotizacion:
+        raise HTTPException(status_code=404, detail="Cotización no encontrada")
+    poner_etag(response, cotizacion.version)
+    return cotizacion
+
+@app.get("/api/cotizaciones/{cotizacion_id}/revisiones", response_model=List[RevisionResponse])
+def listar_revisiones(cotizacion_id: int, db: Session = Depends(get_db)):
+    """Historial de ediciones de una cotización"""
+    return RevisionService.listar(db, cotizacion_id)
+
+@app.get("/api/cotizaciones/{cotizacion_id}/revisiones/{revision}")
+def obtener_revision(cotizacion_id: int, revision: int, db: Session = Depends(get_db)):
+    """Contenido de la cotización en una revisión"""
+    try:
+        return RevisionService.obtener(db, cotizacion_id, revision)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/api/cotizaciones/{cotizacion_id}/revisiones/{revision}/cambios")
+def comparar_revisiones(cotizacion_id: int, revision: int, contra: Optional[int] = None,
+                        db: Session = Depends(get_db)):
+    """Qué cambió de la revisión `contra` (por defecto la anterior) a `revision`"""
+    try:
+        return RevisionService.comparar(db, cotizacion_id, contra if contra is not None else revision - 1, revision)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @app.post("/api/cotizaciones/{cotizacion_id}/generar-pdf")
-def generar_pdf_cotizacion(cotizacion_id: int, db: Session = Depends(get_db)):
-    """Generar PDF de una cotización existente"""
+def generar_pdf_cotizacion(cotizacion_id: int, perfil: Optional[str] = None, db: Session = Depends(get_db)):
+    """Generar PDF de una cotización existente (perfil: screen, print o archive)"""
+    if perfil is not None and perfil not in PERFILES:
+        raise HTTPException(status_code=400, detail=f"Perfil inválido. Opciones: {', '.join(PERFILES)}")
     try:
-        pdf_path = CotizacionService.generar_pdf_cotizacion(db, cotizacion_id)
+        pdf_path = CotizacionService.generar_pdf_cotizacion(db, cotizacion_id, perfil)
         return {
             "message": "PDF generado exitosamente",
             "pdf_path": pdf_path,
@@ -165,73 +410,21 @@ def generar_pdf_cotizacion(cotizacion_id: int, db: Session = Depends(get_db)):
 def actualizar_cotizacion(
     cotizacion_id: int,
     cotizacion: CotizacionCreate,
+    response: Response,
+    version_esperada: Optional[int] = Depends(version_if_match),
     db: Session = Depends(get_db)
 ):
-    """Actualizar una cotización existente"""
-    
-    # Verificar que existe
-    db_cotizacion = db.query(Cotizacion).filter(Cotizacion.id == cotizacion_id).first()
-    if not db_cotizacion:
-        raise HTTPException(status_code=404, detail="Cotización no encontrada")
-    
-    # Verificar cliente y tipo
-    cliente = db.query(Cliente).filter(Cliente.id == cotizacion.cliente_id).first()
-    if not cliente:
-        raise HTTPException(status_code=400, detail="Cliente no encontrado")
-    
-    tipo = db.query(TipoCotizacion).filter(TipoCotizacion.id == cotizacion.tipo_id).first()
-    if not tipo:
-        raise HTTPException(status_code=400, detail="Tipo de cotización no encontrado")
-    
-    # Calcular nuevas fechas
-    from datetime import timedelta, timezone
-    fecha_emision = datetime.now(timezone.utc)
-    fecha_vencimiento = fecha_emision + timedelta(days=cotizacion.vigencia_dias)
-    
-    # Calcular totales
-    subtotal = sum(item.monto for item in cotizacion.items)
-    itbis = subtotal * 0.18
-    total = subtotal + itbis
-    
-    # Actualizar campos básicos
-    db_cotizacion.cliente_id = cotizacion.cliente_id
-    db_cotizacion.tipo_id = cotizacion.tipo_id
-    db_cotizacion.descripcion = cotizacion.descripcion
-    db_cotizacion.vigencia_dias = cotizacion.vigencia_dias
-    db_cotizacion.fecha_vencimiento = fecha_vencimiento
-    db_cotizacion.subtotal = subtotal
-    db_cotizacion.itbis = itbis
-    db_cotizacion.total = total
-    
-    # Eliminar items y términos antiguos
-    db.query(ItemCotizacion).filter(ItemCotizacion.cotizacion_id == cotizacion_id).delete()
-    db.query(TerminoCotizacion).filter(TerminoCotizacion.cotizacion_id == cotizacion_id).delete()
-    
-    # Crear nuevos items
-    for idx, item in enumerate(cotizacion.items):
-        db_item = ItemCotizacion(
-            cotizacion_id=cotizacion_id,
-            alcance=item.alcance,
-            monto=item.monto,
-            orden=idx
-        )
-        db.add(db_item)
-    
-    # Crear nuevos términos
-    for idx, termino in enumerate(cotizacion.terminos or []):
-        db_termino = TerminoCotizacion(
-            cotizacion_id=cotizacion_id,
-            texto=termino.texto,
-            orden=idx
-        )
-        db.add(db_termino)
-    
-    # Invalidar PDF si existía (porque cambió el contenido)
-    db_cotizacion.pdf_path = None
-    
-    db.commit()
-    db.refresh(db_cotizacion)
+    """Actualizar una cotización existente (409 si If-Match no coincide con la versión actual)"""
+    try:
+        db_cotizacion = CotizacionService.actualizar_cotizacion(db, cotizacion_id, cotizacion, version_esperada)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ConflictoVersionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    poner_etag(response, db_cotizacion.version)
     return db_cotizacion
 
 @app.get("/api/cotizaciones/{cotizacion_id}/pdf")
@@ -242,17 +435,18 @@ def descargar_pdf(cotizacion_id: int, db: Session = Depends(get_db)):
     if not cotizacion:
         raise HTTPException(status_code=404, detail="Cotización no encontrada")
     
-    if not cotizacion.pdf_path or not os.path.exists(cotizacion.pdf_path):
+    pdf_path = cotizacion.pdf_path
+    if not pdf_path or not os.path.exists(pdf_path):
         try:
-            CotizacionService.generar_pdf_cotizacion(db, cotizacion_id)
-            db.refresh(cotizacion)
+            # Las archivadas no guardan la ruta: se usa la que devuelve la generación
+            pdf_path = CotizacionService.generar_pdf_cotizacion(db, cotizacion_id)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error generando PDF: {str(e)}")
     
     return FileResponse(
-        cotizacion.pdf_path, 
+        pdf_path, 
         media_type='application/pdf',
-        filename=os.path.basename(cotizacion.pdf_path)
+        filename=os.path.basename(pdf_path)
     )
 # Agregar este endpoint en backend/main.py después de los otros endpoints de cotizaciones
 
@@ -261,35 +455,259 @@ def descargar_pdf(cotizacion_id: int, db: Session = Depends(get_db)):
 class CambiarEstadoRequest(BaseModel):
     estado: str  # "pendiente", "aprobada", "rechazada"
 
+@app.patch("/api/cotizaciones/estado", response_model=CambiarEstadosResponse)
+def cambiar_estados_cotizaciones(request: CambiarEstadosRequest, db: Session = Depends(get_db)):
+    """Cambiar el estado de muchas cotizaciones en una sola transacción"""
+    try:
+        resumen = CotizacionService.cambiar_estados(db, request.cambios)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if resumen["actualizadas"]:
+        DashboardService.refrescar(db)
+    return resumen
+
 @app.patch("/api/cotizaciones/{cotizacion_id}/estado")
 def cambiar_estado_cotizacion(
     cotizacion_id: int, 
     request: CambiarEstadoRequest,
+    response: Response,
+    version_esperada: Optional[int] = Depends(version_if_match),
     db: Session = Depends(get_db)
 ):
     """Cambiar el estado de una cotización"""
-    cotizacion = db.query(Cotizacion).filter(Cotizacion.id == cotizacion_id).first()
-    
-    if not cotizacion:
-        raise HTTPException(status_code=404, detail="Cotización no encontrada")
-    
-    # Validar estado
-    estados_validos = ["pendiente", "aprobada", "rechazada"]
-    if request.estado not in estados_validos:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Estado inválido. Debe ser uno de: {', '.join(estados_validos)}"
-        )
-    
-    cotizacion.estado = request.estado
-    db.commit()
-    db.refresh(cotizacion)
+    try:
+        cotizacion = CotizacionService.cambiar_estado(db, cotizacion_id, request.estado, version_esperada)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ConflictoVersionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    poner_etag(response, cotizacion.version)
     return {
         "mensaje": f"Estado actualizado a '{request.estado}'",
-        "cotizacion": cotizacion
+        # Serializado con el esquema: sin recorrer relaciones perezosas del objeto ORM
+        "cotizacion": CotizacionResponse.model_validate(cotizacion)
+    }
+
+# ====================== DASHBOARD Y MÉTRICAS ======================
+
+@app.get("/api/dashboard/stats")
+def dashboard_stats(db: Session = Depends(get_db)):
+    """Agregados del dashboard (cacheados hasta el próximo cambio)"""
+    return DashboardService.stats(db)
+
+@app.post("/api/mantenimiento/archivar")
+def archivar_cotizaciones(dias: Optional[int] = None, db: Session = Depends(get_db)):
+    """Mover al archivo las cotizaciones cerradas más antiguas que `dias` (por defecto ARCHIVO_DIAS)"""
+    if dias is not None and dias < 0:
+        raise HTTPException(status_code=400, detail="dias no puede ser negativo")
+    archivadas = ArchivoService.archivar(db, dias=dias)
+    if archivadas:
+        ArchivoService.mantenimiento(db.get_bind())
+        DashboardService.refrescar(db)
+    return {"archivadas": archivadas}
+
+@app.post("/api/mantenimiento/compactar")
+def compactar_bases(db: Session = Depends(get_db)):
+    """ANALYZE y VACUUM de la base y el archivo (la primera vez es un VACUUM completo: puede tardar)"""
+    ArchivoService.mantenimiento(db.get_bind())
+    return {"mensaje": "Bases compactadas"}
+
+@app.post("/api/mantenimiento/resumen-clientes")
+def verificar_resumen_clientes(reparar: bool = False, db: Session = Depends(get_db)):
+    """Comparar el resumen de cotizaciones de cada cliente con uno recalculado (y corregirlo si `reparar`)"""
+    return ClienteService.verificar_resumen(db, reparar=reparar)
+
+# Solo con RESPALDOS_TOKEN configurado y el mismo token en X-Respaldos-Token
+def solo_respaldos(x_respaldos_token: Optional[str] = Header(None)):
+    if not respaldo_service.RESPALDOS_TOKEN:
+        raise HTTPException(status_code=404, detail="Los respaldos por API no están habilitados")
+    if not secrets.compare_digest((x_respaldos_token or "").encode(), respaldo_service.RESPALDOS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token de respaldos inválido")
+
+@app.post("/api/respaldos", dependencies=[Depends(solo_respaldos)])
+def crear_respaldo(comprimir: bool = True, tenant: Tenant = Depends(tenant_de_peticion)):
+    """Respaldo en línea de la base (y del archivo) de la empresa sin detener la API"""
+    try:
+        return asdict(RespaldoService.crear_respaldo(tenant, comprimir=comprimir))
+    except RespaldoEnCursoError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/respaldos", dependencies=[Depends(solo_respaldos)])
+def listar_respaldos(tenant: Tenant = Depends(tenant_de_peticion)):
+    """Respaldos disponibles y métricas del último (duración, reinicios, latencia de la API)"""
+    return {"respaldos": RespaldoService.listar(tenant), **RespaldoService.metricas()}
+
+@app.get("/api/metricas/tareas")
+def obtener_metricas_tareas():
+    """Filas afectadas y duración de cada tarea periódica"""
+    return metricas_tareas()
+
+@app.get("/api/metricas/compresion")
+def obtener_metricas_compresion():
+    """Bytes originales y enviados, CPU y aciertos de caché por codificación"""
+    return compresion.metricas()
+
+@app.get("/api/metricas/latencia")
+def obtener_metricas_latencia():
+    """Percentiles de latencia de las últimas peticiones de cada grupo de rutas"""
+    return MedidorLatencia.metricas()
+
+@app.get("/api/metricas/admision")
+def obtener_metricas_admision():
+    """Cupos, cola y rechazos de cada grupo del control de admisión"""
+    return ControlAdmision.metricas()
+
+# ====================== REPORTES ======================
+# Corren sobre una instantánea en memoria por columnas (NumPy, ver reportes_service.py), no sobre la base.
+# Meses en formato AAAA-MM.
+
+@app.get("/api/reportes/resumen")
+def reporte_resumen(
+    por: str = "mes",
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    estado: Optional[str] = None,
+    tipo_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Cantidad y montos agrupados por tipo, cliente, mes o estado"""
+    try:
+        return ReportesService.resumen(db, por, desde, hasta, estado, tipo_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/reportes/top-clientes")
+def reporte_top_clientes(
+    n: int = 10,
+    estado: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Clientes con mayor monto cotizado"""
+    if not 1 <= n <= 1000:
+        raise HTTPException(status_code=400, detail="n debe estar entre 1 y 1000")
+    try:
+        return ReportesService.top_clientes(db, n, estado, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/reportes/conversion")
+def reporte_conversion(
+    por: str = "tipo",
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Cotizaciones por estado y tasa de aprobación de cada grupo"""
+    try:
+        return ReportesService.conversion(db, por, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/metricas/reportes")
+def obtener_metricas_reportes(db: Session = Depends(get_db)):
+    """Tamaño y token de la instantánea de reportes de la empresa"""
+    return ReportesService.metricas(db)
+
+# ====================== PERFILES ======================
+# Solo con PERFILADO_TOKEN configurado y el mismo token en X-Perfilar
+
+def solo_perfilado(x_perfilar: Optional[str] = Header(None)):
+    if not perfilado.PERFILADO_TOKEN:
+        raise HTTPException(status_code=404, detail="El perfilado no está habilitado")
+    if x_perfilar != perfilado.PERFILADO_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido")
+
+def _perfil_o_404(perfil_id: int):
+    perfil = perfilado.obtener(perfil_id)
+    if perfil is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado (puede haber salido del buffer)")
+    return perfil
+
+@app.get("/api/perfiles", dependencies=[Depends(solo_perfilado)])
+def listar_perfiles():
+    """Perfiles guardados, del más reciente al más antiguo"""
+    return perfilado.listar()
+
+@app.get("/api/perfiles/{perfil_id}", dependencies=[Depends(solo_perfilado)])
+def obtener_perfil_guardado(perfil_id: int, orden: str = "cumulative"):
+    """Resumen de CPU (top de pstats) y secciones de memoria de un perfil"""
+    if orden not in ("cumulative", "tottime", "calls"):
+        raise HTTPException(status_code=400, detail="Orden inválido. Opciones: cumulative, tottime, calls")
+    perfil = _perfil_o_404(perfil_id)
+    return {
+        **perfil.resumen(),
+        "cpu": perfilado.texto_cpu(perfil, orden) if perfil.stats else None,
+        "memoria": perfil.secciones,
     }
 
+@app.get("/api/perfiles/{perfil_id}/descargar", dependencies=[Depends(solo_perfilado)])
+def descargar_perfil(perfil_id: int):
+    """Archivo .prof para snakeviz o `python -m pstats`"""
+    perfil = _perfil_o_404(perfil_id)
+    if not perfil.stats:
+        raise HTTPException(status_code=404, detail="El perfil no tiene datos de CPU")
+    return Response(
+        perfilado.archivo_pstats(perfil),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="perfil-{perfil.id}.prof"'}
+    )
+
+# ====================== SINCRONIZACIÓN ======================
+
+@app.get("/api/changes", response_model=CambiosResponse)
+def obtener_cambios(since: int = 0, limite: int = 500, entidades: Optional[str] = None,
+                    db: Session = Depends(get_db)):
+    """Entidades que cambiaron después del token `since` (0 = carga inicial completa).
+
+    `entidades` filtra por tipo de entidad (cliente,tipo,cotizacion,clausula). Un
+    token que esta base no emitió (p. ej. tras restaurar un respaldo) responde 410:
+    recargar con since=0.
+    """
+    limite = max(1, min(limite, 2000))
+    filtro = None
+    if entidades:
+        filtro = [e.strip() for e in entidades.split(",") if e.strip()]
+        invalidas = [e for e in filtro if e not in ENTIDADES_CAMBIOS]
+        if invalidas:
+            raise HTTPException(status_code=400, detail=f"Entidad inválida: {', '.join(invalidas)}")
+    try:
+        return CambiosService.obtener_desde(db, since, limite, filtro)
+    except TokenVencidoError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+
+def _token_actual(tenant: Tenant) -> int:
+    db = sesiones(tenant)()
+    try:
+        return CambiosService.token_actual(db)
+    finally:
+        db.close()
+
+async def eventos_cambios(tenant: Tenant, since: int, pausa: float = 1):
+    """Eventos SSE: el nuevo token cada vez que hay cambios y un keep-alive cada 15 s"""
+    token = since
+    segundos_inactivo = 0
+    while True:
+        actual = await asyncio.to_thread(_token_actual, tenant)
+        if actual > token:
+            token = actual
+            segundos_inactivo = 0
+            yield f"event: cambios\ndata: {json.dumps({'token': token})}\n\n"
+        elif segundos_inactivo >= 15:
+            segundos_inactivo = 0
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(pausa)
+        segundos_inactivo += pausa
+
+@app.get("/api/changes/stream")
+async def stream_cambios(since: int = 0, tenant: Tenant = Depends(tenant_de_peticion)):
+    """Server-Sent Events: avisa con el nuevo token cada vez que hay cambios"""
+    return StreamingResponse(eventos_cambios(tenant, since), media_type="text/event-stream")
+
 # Para correr el servidor
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
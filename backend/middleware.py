@@ -0,0 +1,523 @@
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+import compresion
+import perfilado
+from fastapi import HTTPException
+from services.cambios_service import CambiosService
+from services.idempotencia_service import IdempotenciaService, IDEMPOTENCIA_ESPERA_S, IDEMPOTENCIA_MAX_BYTES, huella
+from services.respaldo_service import RespaldoService, resumen_latencias
+from tenants import resolver_tenant, sesiones
+
+# Middlewares ASGI puros (sin BaseHTTPMiddleware: no envuelven el cuerpo de la
+# respuesta, así que no afectan al stream SSE de /api/changes/stream).
+
+
+LATENCIA_MUESTRAS = int(os.getenv("LATENCIA_MUESTRAS", "1000"))  # Últimas peticiones por grupo
+
+
+class MedidorLatencia:
+    """Registrar el tiempo hasta el inicio de cada respuesta HTTP, por grupo de admisión"""
+
+    _latencias = {}  # grupo -> deque con las últimas LATENCIA_MUESTRAS (ms)
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def registrar(grupo: str, ms: float):
+        muestras = MedidorLatencia._latencias.get(grupo)
+        if muestras is None:
+            muestras = MedidorLatencia._latencias[grupo] = deque(maxlen=LATENCIA_MUESTRAS)
+        muestras.append(ms)
+
+    @staticmethod
+    def metricas() -> dict:
+        # list(): una copia antes de ordenar, el event loop sigue agregando muestras
+        return {grupo: resumen_latencias(list(m)) for grupo, m in sorted(MedidorLatencia._latencias.items())}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Las rutas sin límite de admisión (y las que no son de la API) van a "otras"
+        grupo = grupo_de(scope["method"], scope["path"]) or "otras"
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                ms = (time.perf_counter() - inicio) * 1000
+                RespaldoService.registrar_latencia(ms)
+                MedidorLatencia.registrar(grupo, ms)
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+
+class Perfilador:
+    """Perfilar las peticiones que lo piden (X-Perfilar) o salen en el muestreo (ver perfilado.py)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not perfilado.HABILITADO or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encabezados = dict(scope["headers"])
+        perfil, token = perfilado.iniciar(
+            scope["method"], scope["path"],
+            encabezados.get(b"x-perfilar", b"").decode("latin-1"),
+            encabezados.get(b"x-perfilar-memoria") == b"1",
+        )
+        if perfil is None:
+            return await self.app(scope, receive, send)
+
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                duracion = (time.perf_counter() - inicio) * 1000
+                if perfilado.terminar(perfil, duracion, mensaje["status"]):
+                    mensaje["headers"] = [*mensaje.get("headers", []), (b"x-perfil-id", str(perfil.id).encode())]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            perfilado.soltar(token)
+
+
+# ====================== CONTROL DE ADMISIÓN ======================
+# Cada grupo de rutas tiene su presupuesto: cuántas peticiones corren a la vez y
+# cuántas esperan turno. Si la cola está llena (o la espera pasa de
+# ADMISION_ESPERA_S) se responde 503 con Retry-After sin tocar el threadpool, así
+# una ráfaga de PDFs no deja sin hilos a las consultas baratas.
+#
+# La suma de las concurrencias debe quedar por debajo del threadpool de AnyIO
+# (40 hilos por defecto), que también ejecuta las dependencias síncronas como get_db.
+
+def _entero(nombre: str, defecto: int) -> int:
+    return int(os.getenv(nombre, str(defecto)))
+
+ADMISION_ESPERA_S = float(os.getenv("ADMISION_ESPERA_S", "10"))
+
+# (grupo, método, patrón de ruta); la primera coincidencia gana
+RUTAS_ADMISION = [
+    ("respaldo", "POST", re.compile(r"^/api/respaldos$")),
+    ("pdf", "GET", re.compile(r"^/api/cotizaciones/\d+/pdf$")),
+    ("pdf", "POST", re.compile(r"^/api/cotizaciones/\d+/generar-pdf$")),
+    ("pesado", "GET", re.compile(r"^/api/cotizaciones$")),
+    ("pesado", "GET", re.compile(r"^/api/reportes/")),
+    ("pesado", "POST", re.compile(r"^/api/clientes/lote$")),
+    ("pesado", "PATCH", re.compile(r"^/api/cotizaciones/estado$")),
+    ("pesado", "POST", re.compile(r"^/api/mantenimiento/")),
+]
+# Sin límite: el stream SSE dura lo que la conexión y las métricas deben responder siempre
+SIN_ADMISION = re.compile(r"^/api/(changes/stream|metricas/)")
+
+
+class Presupuesto:
+    """Semáforo con cola acotada y métricas (vive en el event loop, sin locks)"""
+
+    def __init__(self, nombre: str, concurrencia: int, cola: int):
+        self.nombre = nombre
+        self.concurrencia = concurrencia
+        self.cola = cola
+        self.activas = 0
+        self.esperando = []             # Futures en orden de llegada
+        self.admitidas = 0
+        self.rechazadas = 0
+        self.pico_cola = 0
+        self.duracion_ms = 0.0          # Media móvil de lo que tarda cada petición
+
+    async def entrar(self) -> bool:
+        if self.activas < self.concurrencia and not self.esperando:
+            self.activas += 1
+            self.admitidas += 1
+            return True
+        if len(self.esperando) >= self.cola:
+            self.rechazadas += 1
+            return False
+        turno = asyncio.get_running_loop().create_future()
+        self.esperando.append(turno)
+        self.pico_cola = max(self.pico_cola, len(self.esperando))
+        try:
+            await asyncio.wait_for(turno, ADMISION_ESPERA_S)
+        except asyncio.TimeoutError:
+            self.rechazadas += 1
+            return False
+        except BaseException:
+            # Cliente desconectado justo cuando le tocaba: el cupo pasa al siguiente
+            if turno.done() and not turno.cancelled():
+                self._ceder()
+            raise
+        finally:
+            if turno in self.esperando:
+                self.esperando.remove(turno)
+        self.admitidas += 1
+        return True
+
+    def salir(self, duracion_ms: float):
+        self.duracion_ms = duracion_ms if not self.duracion_ms else 0.9 * self.duracion_ms + 0.1 * duracion_ms
+        self._ceder()
+
+    def _ceder(self):
+        # El cupo pasa directo al siguiente en la cola (activas no cambia)
+        while self.esperando:
+            turno = self.esperando.pop(0)
+            if not turno.done():
+                turno.set_result(None)
+                return
+        self.activas -= 1
+
+    def reintentar_en(self) -> int:
+        """Segundos estimados hasta que se vacíe la cola actual"""
+        tandas = (len(self.esperando) + self.concurrencia) / self.concurrencia
+        return max(1, math.ceil(tandas * (self.duracion_ms or 1000) / 1000))
+
+    def metricas(self) -> dict:
+        return {
+            "concurrencia": self.concurrencia, "cola": self.cola,
+            "activas": self.activas, "en_cola": len(self.esperando), "pico_cola": self.pico_cola,
+            "admitidas": self.admitidas, "rechazadas": self.rechazadas,
+            "duracion_media_ms": round(self.duracion_ms, 2),
+        }
+
+
+PRESUPUESTOS = {
+    "pdf": Presupuesto("pdf", _entero("ADMISION_PDF_CONCURRENCIA", 4), _entero("ADMISION_PDF_COLA", 8)),
+    "pesado": Presupuesto("pesado", _entero("ADMISION_PESADO_CONCURRENCIA", 6), _entero("ADMISION_PESADO_COLA", 12)),
+    # Un respaldo dura lo que la copia: no ocupa cupos de pesado ni de crud mientras corre
+    "respaldo": Presupuesto("respaldo", _entero("ADMISION_RESPALDO_CONCURRENCIA", 1), _entero("ADMISION_RESPALDO_COLA", 1)),
+    "crud": Presupuesto("crud", _entero("ADMISION_CRUD_CONCURRENCIA", 24), _entero("ADMISION_CRUD_COLA", 100)),
+}
+
+
+def grupo_de(metodo: str, ruta: str):
+    """Grupo de admisión de una petición (None = sin límite)"""
+    if not ruta.startswith("/api/") or SIN_ADMISION.match(ruta):
+        return None
+    for grupo, metodo_ruta, patron in RUTAS_ADMISION:
+        if metodo == metodo_ruta and patron.match(ruta):
+            return grupo
+    return "crud"
+
+
+class ControlAdmision:
+    """Limitar la concurrencia por grupo de rutas y rechazar con 503 lo que no cabe en cola"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def metricas() -> dict:
+        return {nombre: p.metricas() for nombre, p in PRESUPUESTOS.items()}
+
+    async def __call__(self, scope, receive, send):
+        grupo = grupo_de(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if grupo is None:
+            return await self.app(scope, receive, send)
+
+        presupuesto = PRESUPUESTOS[grupo]
+        if not await presupuesto.entrar():
+            return await self._rechazar(send, presupuesto)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            presupuesto.salir((time.perf_counter() - inicio) * 1000)
+
+    @staticmethod
+    async def _rechazar(send, presupuesto: Presupuesto):
+        cuerpo = json.dumps({"detail": f"Servidor ocupado ({presupuesto.nombre}), intente de nuevo"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(cuerpo)).encode()),
+                (b"retry-after", str(presupuesto.reintentar_en()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": cuerpo})
+
+
+# ====================== COMPRESIÓN ======================
+
+class Compresion:
+    """Comprimir las respuestas JSON/texto según Accept-Encoding (ver compresion.py).
+
+    Solo se comprimen los cuerpos de un único mensaje (lo normal en los endpoints
+    JSON); los streams (SSE, archivos) y lo que ya trae Content-Encoding pasan tal cual.
+    Los GET de compresion.RUTAS_CACHE se sirven desde la caché mientras no cambie
+    el token de la empresa, sin llamar al endpoint.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encabezados_peticion = dict(scope["headers"])
+        aceptadas = encabezados_peticion.get(b"accept-encoding", b"").decode("latin-1")
+        codificacion = compresion.elegir_codificacion(aceptadas) if aceptadas else None
+        clave = await self._clave_cache(scope, encabezados_peticion, codificacion)
+        if clave is not None:
+            guardada = compresion.leer(clave)
+            if guardada is not None:
+                await send({"type": "http.response.start", "status": guardada.estado, "headers": guardada.encabezados})
+                return await send({"type": "http.response.body", "body": guardada.cuerpo})
+        estado = {"inicio": None, "pasar": False}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                encabezados = {k.lower(): v for k, v in mensaje.get("headers", [])}
+                tipo = encabezados.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in encabezados or not compresion.comprimible(tipo):
+                    estado["pasar"] = True
+                    return await send(mensaje)
+                estado["inicio"] = mensaje  # Se envía junto con el cuerpo
+                return
+            if estado["pasar"] or mensaje["type"] != "http.response.body":
+                return await send(mensaje)
+
+            inicio, estado["inicio"] = estado["inicio"], None
+            if inicio is None:
+                return await send(mensaje)
+            cuerpo = mensaje.get("body", b"")
+            if mensaje.get("more_body", False):
+                # Cuerpo en varias partes: se deja sin comprimir
+                estado["pasar"] = True
+                await send(inicio)
+                return await send(mensaje)
+
+            encabezados = [(k, v) for k, v in inicio.get("headers", []) if k.lower() != b"vary"]
+            encabezados.append((b"vary", b"Accept-Encoding"))
+            if codificacion is None or len(cuerpo) < compresion.COMPRESION_MINIMO:
+                compresion.anotar_sin_comprimir(cuerpo)
+                enviado = cuerpo
+            else:
+                if len(cuerpo) >= compresion.COMPRESION_HILO_BYTES:
+                    enviado = await asyncio.to_thread(compresion.comprimir, cuerpo, codificacion)
+                else:
+                    enviado = compresion.comprimir(cuerpo, codificacion)
+                encabezados = [
+                    (k, compresion.etag_codificada(v, codificacion) if k.lower() == b"etag" else v)
+                    for k, v in encabezados if k.lower() != b"content-length"
+                ]
+                encabezados += [
+                    (b"content-encoding", codificacion.encode()),
+                    (b"content-length", str(len(enviado)).encode()),
+                ]
+            if clave is not None and inicio["status"] == 200:
+                compresion.guardar(clave, compresion.Guardada(200, encabezados, enviado, len(cuerpo)))
+            await send({**inicio, "headers": encabezados})
+            await send({"type": "http.response.body", "body": enviado})
+
+        await self.app(scope, receive, enviar)
+
+    @staticmethod
+    async def _clave_cache(scope, encabezados: dict, codificacion):
+        """(empresa, ruta, token, codificación) o None si la petición no usa la caché"""
+        if not compresion.cacheable(scope["method"], scope["path"]):
+            return None
+        if b"if-none-match" in encabezados or b"authorization" in encabezados:
+            return None
+        try:
+            tenant = resolver_tenant(
+                encabezados.get(b"x-tenant", b"").decode("latin-1") or None,
+                encabezados.get(b"host", b"").decode("latin-1") or None,
+            )
+        except HTTPException:
+            return None  # La API responde el 404 de la empresa
+        # Antes del endpoint: lo que este lea es al menos tan nuevo como el token
+        token = compresion.token_recordado(tenant.codigo)
+        if token is None:
+            gen = compresion.generacion(tenant.codigo)
+            token = await asyncio.to_thread(_en_sesion, tenant, CambiosService.token_actual)
+            compresion.recordar_token(tenant.codigo, token, gen)
+        ruta = scope["path"] + "?" + scope.get("query_string", b"").decode("latin-1")
+        return (tenant.codigo, ruta, token, codificacion)
+
+
+# ====================== IDEMPOTENCY-KEY ======================
+
+async def _responder_json(send, estado: int, detalle: str):
+    cuerpo = json.dumps({"detail": detalle}).encode()
+    await send({
+        "type": "http.response.start", "status": estado,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+def _en_sesion(tenant, funcion, *args):
+    db = sesiones(tenant)()
+    try:
+        return funcion(db, *args)
+    finally:
+        db.close()
+
+
+class Idempotencia:
+    """POST con Idempotency-Key: los reintentos reciben la respuesta de la primera ejecución.
+
+    Los duplicados simultáneos en este proceso esperan a la primera ejecución; los
+    de otro proceso consultan la tabla hasta que termine. Unos y otros esperan como
+    mucho IDEMPOTENCIA_ESPERA_S y después responden 409.
+    Las respuestas 5xx no se guardan: el reintento vuelve a ejecutar. El cuerpo
+    de la petición se lee completo para la huella, hasta IDEMPOTENCIA_MAX_BYTES (413).
+    """
+
+    _en_vuelo = {}  # (empresa, clave) -> Future con (huella, estado, tipo_contenido, cuerpo) o None
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        encabezados = dict(scope["headers"])
+        clave = encabezados.get(b"idempotency-key", b"").decode("latin-1").strip()
+        if not clave:
+            return await self.app(scope, receive, send)
+        if len(clave) > 255:
+            return await _responder_json(send, 400, "Idempotency-Key demasiado larga (máximo 255)")
+        try:
+            tenant = resolver_tenant(
+                encabezados.get(b"x-tenant", b"").decode("latin-1") or None,
+                encabezados.get(b"host", b"").decode("latin-1") or None,
+            )
+        except HTTPException:
+            return await self.app(scope, receive, send)  # La API responde el 404 de la empresa
+
+        # El cuerpo se lee completo para la huella y se le vuelve a entregar a la app
+        try:
+            declarado = int(encabezados.get(b"content-length", b"0"))
+        except ValueError:
+            return await _responder_json(send, 400, "Content-Length inválido")
+        if declarado > IDEMPOTENCIA_MAX_BYTES:
+            return await self._demasiado_grande(send)
+        partes, leidos = [], 0
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "http.disconnect":
+                return
+            partes.append(mensaje.get("body", b""))
+            leidos += len(partes[-1])
+            if leidos > IDEMPOTENCIA_MAX_BYTES:
+                return await self._demasiado_grande(send)
+            if not mensaje.get("more_body", False):
+                break
+        cuerpo = b"".join(partes)
+        huella_peticion = huella(scope["method"], scope["path"], cuerpo)
+        entregado = False
+
+        async def recibir():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {"type": "http.request", "body": cuerpo, "more_body": False}
+            return await receive()
+
+        llave = (tenant.codigo, clave)
+        limite = time.monotonic() + IDEMPOTENCIA_ESPERA_S
+        while True:
+            primera = Idempotencia._en_vuelo.get(llave)
+            if primera is not None:
+                try:
+                    resultado = await asyncio.wait_for(asyncio.shield(primera), max(0.0, limite - time.monotonic()))
+                except asyncio.TimeoutError:
+                    return await self._en_curso(send)
+                if resultado is None:
+                    continue  # La primera falló sin guardar: se vuelve a intentar
+                if resultado[0] != huella_peticion:
+                    return await _responder_json(send, 422, "Idempotency-Key ya usada con otra petición")
+                return await self._repetir(send, *resultado[1:])
+
+            propia = asyncio.get_running_loop().create_future()
+            Idempotencia._en_vuelo[llave] = propia
+            dueno = IdempotenciaService.nuevo_dueno()
+            try:
+                estado, fila = await asyncio.to_thread(
+                    _en_sesion, tenant, IdempotenciaService.reclamar, clave, huella_peticion, dueno
+                )
+            except BaseException:
+                Idempotencia._en_vuelo.pop(llave, None)
+                propia.set_result(None)
+                raise
+            if estado == "nueva":
+                return await self._ejecutar(scope, recibir, send, tenant, clave, dueno, huella_peticion, propia, llave)
+
+            Idempotencia._en_vuelo.pop(llave, None)
+            if estado == "repetida":
+                resultado = (fila.estado_http, fila.tipo_contenido, fila.cuerpo)
+                propia.set_result((huella_peticion, *resultado))
+                return await self._repetir(send, *resultado)
+            propia.set_result(None)
+            if estado == "distinta":
+                return await _responder_json(send, 422, "Idempotency-Key ya usada con otra petición")
+            # En curso en otro proceso
+            if time.monotonic() > limite:
+                return await self._en_curso(send)
+            await asyncio.sleep(0.1)
+
+    async def _ejecutar(self, scope, recibir, send, tenant, clave, dueno, huella_peticion, propia, llave):
+        respuesta = {"estado": None, "tipo": None, "cuerpo": b""}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                respuesta["estado"] = mensaje["status"]
+                tipo = {k.lower(): v for k, v in mensaje.get("headers", [])}.get(b"content-type")
+                respuesta["tipo"] = tipo.decode("latin-1") if tipo is not None else None
+            elif mensaje["type"] == "http.response.body":
+                respuesta["cuerpo"] += mensaje.get("body", b"")
+            await send(mensaje)
+
+        resultado = None
+        try:
+            try:
+                await self.app(scope, recibir, enviar)
+                if respuesta["estado"] is not None and respuesta["estado"] < 500:
+                    guardada = await asyncio.to_thread(
+                        _en_sesion, tenant, IdempotenciaService.guardar,
+                        clave, dueno, respuesta["estado"], respuesta["tipo"], respuesta["cuerpo"]
+                    )
+                    if guardada:
+                        resultado = (huella_peticion, respuesta["estado"], respuesta["tipo"], respuesta["cuerpo"])
+            finally:
+                # Primero los que esperan en este proceso: ni una cancelación (cliente que
+                # se desconecta, apagado) ni un error al soltar los puede dejar colgados
+                Idempotencia._en_vuelo.pop(llave, None)
+                if not propia.done():
+                    propia.set_result(resultado)
+        finally:
+            if resultado is None:
+                await asyncio.to_thread(_en_sesion, tenant, IdempotenciaService.soltar, clave, dueno)
+
+    @staticmethod
+    async def _repetir(send, estado: int, tipo_contenido, cuerpo: bytes):
+        # Content-Length sale del cuerpo guardado; Compresion agrega Vary y, si comprime,
+        # su propio Content-Length
+        encabezados = [(b"content-length", str(len(cuerpo)).encode()), (b"idempotent-replayed", b"true")]
+        if tipo_contenido is not None:
+            encabezados.insert(0, (b"content-type", tipo_contenido.encode("latin-1")))
+        await send({"type": "http.response.start", "status": estado, "headers": encabezados})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+    @staticmethod
+    async def _en_curso(send):
+        await _responder_json(send, 409, "Hay una petición con esa Idempotency-Key en curso")
+
+    @staticmethod
+    async def _demasiado_grande(send):
+        await _responder_json(
+            send, 413, f"Cuerpo demasiado grande para Idempotency-Key (máximo {IDEMPOTENCIA_MAX_BYTES // 1024} KB)"
+        )
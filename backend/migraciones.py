@@ -0,0 +1,196 @@
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from models import Cotizacion, TerminoCotizacion
+from services.clausula_service import hash_texto
+from services.cliente_service import normalizar_rnc, ClienteService
+
+logger = logging.getLogger(__name__)
+
+# `Base.metadata.create_all` solo crea tablas nuevas. Las columnas que se agregan
+# a tablas existentes se aplican aquí, de forma idempotente, al iniciar la API.
+
+# (tabla, columna, definición SQL, relleno opcional que corre solo al crear la columna:
+#  SQL o una función que recibe la conexión)
+# Las copias en la base de archivo (models.Archivo*) se crean completas con create_all;
+# una columna nueva en cotizaciones, items o términos necesita también su entrada
+# para archivo.<tabla>.
+COLUMNAS = [
+    ("clientes", "version", "INTEGER NOT NULL DEFAULT 1", None),
+    ("cotizaciones", "version", "INTEGER NOT NULL DEFAULT 1", None),
+    # Montos en centavos: se rellenan desde las columnas Float existentes
+    ("tipos_cotizacion", "tasa_itbis_bp", "INTEGER NOT NULL DEFAULT 1800", None),
+    ("items_cotizacion", "monto_centavos", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE items_cotizacion SET monto_centavos = CAST(ROUND(monto * 100) AS INTEGER)"),
+    ("items_cotizacion", "descuento_centavos", "INTEGER NOT NULL DEFAULT 0", None),
+    ("cotizaciones", "subtotal_centavos", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE cotizaciones SET subtotal_centavos = CAST(ROUND(COALESCE(subtotal, 0) * 100) AS INTEGER)"),
+    ("cotizaciones", "descuento_centavos", "INTEGER NOT NULL DEFAULT 0", None),
+    ("cotizaciones", "itbis_centavos", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE cotizaciones SET itbis_centavos = CAST(ROUND(COALESCE(itbis, 0) * 100) AS INTEGER)"),
+    ("cotizaciones", "total_centavos", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE cotizaciones SET total_centavos = CAST(ROUND(COALESCE(total, 0) * 100) AS INTEGER)"),
+    # Al final, los Float quedan como espejo exacto de los centavos ya rellenados
+    ("cotizaciones", "tasa_itbis_bp", "INTEGER NOT NULL DEFAULT 1800",
+     "UPDATE cotizaciones SET subtotal = subtotal_centavos / 100.0, "
+     "itbis = itbis_centavos / 100.0, total = total_centavos / 100.0"),
+    ("clientes", "rnc_normalizado", "VARCHAR(20)", lambda conn: _rellenar_rnc_normalizado(conn)),
+    ("clientes", "total_cotizaciones", "INTEGER NOT NULL DEFAULT 0", None),
+    ("clientes", "aprobado_centavos", "INTEGER NOT NULL DEFAULT 0", None),
+    ("clientes", "ultima_cotizacion", "DATETIME", lambda conn: conn.execute(ClienteService.sql_resumen())),
+]
+
+# Índices declarados en los modelos después de que la tabla ya existía
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS ix_items_cotizacion_cotizacion_id ON items_cotizacion (cotizacion_id)",
+    "CREATE INDEX IF NOT EXISTS ix_cotizaciones_estado_vencimiento ON cotizaciones (estado, fecha_vencimiento)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_clientes_rnc_normalizado ON clientes (rnc_normalizado) "
+    "WHERE rnc_normalizado IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_clientes_correo_lower ON clientes (lower(correo))",
+    "CREATE INDEX IF NOT EXISTS ix_cotizaciones_cliente_estado ON cotizaciones (cliente_id, estado)",
+    "CREATE INDEX IF NOT EXISTS archivo.ix_cotizaciones_cliente_estado ON cotizaciones (cliente_id, estado)",
+    "CREATE INDEX IF NOT EXISTS ix_cambios_entidad_id ON cambios (entidad, id)",
+]
+
+
+def aplicar_migraciones(engine):
+    """Agregar columnas e índices faltantes a tablas existentes"""
+    reconstruidas = False
+    with engine.begin() as conn:
+        # El inspector lee por la misma conexión: la reconstrucción de tablas deja
+        # la base bloqueada para cualquier otra conexión hasta el commit
+        inspector = inspect(conn)
+        if "clausula_id" not in {c["name"] for c in inspector.get_columns("terminos_cotizacion")}:
+            _terminos_a_clausulas(conn)
+            reconstruidas = True
+        for tabla, columna, definicion, relleno in COLUMNAS:
+            existentes = {c["name"] for c in inspector.get_columns(tabla)}
+            if columna not in existentes:
+                conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}"))
+                if callable(relleno):
+                    relleno(conn)
+                elif relleno:
+                    conn.execute(text(relleno))
+        definicion = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cotizaciones'"
+        )).scalar()
+        if "AUTOINCREMENT" not in definicion.upper():
+            _cotizaciones_autoincrement(conn)
+            reconstruidas = True
+        _secuencia_cotizaciones(conn)
+        for indice in INDICES:
+            conn.execute(text(indice))
+    if reconstruidas:
+        # Un VACUUM aquí bloquearía el arranque (o la primera petición de la empresa)
+        # durante minutos en una base grande: el espacio se libera con el mantenimiento
+        logger.info("Tablas reconstruidas: POST /api/mantenimiento/compactar libera el espacio")
+
+
+def _terminos_a_clausulas(conn):
+    """Mover el texto repetido de terminos_cotizacion al catálogo compartido, deduplicado por hash.
+
+    Un texto que usan varias cotizaciones entra al catálogo (con el formato de su
+    primera aparición) y los términos pasan a referenciarlo; el que difiere de esa
+    forma solo en espacios o saltos de línea conserva su texto como personalización.
+    Un texto que usa una sola cotización queda en ella, sin cláusula. SQLite no
+    permite quitar el NOT NULL de `texto`, así que la tabla se reconstruye.
+    """
+    # Un texto usado por un solo tipo queda asociado a ese tipo; si no, es general
+    tipos_por_hash, usos_por_hash, texto_por_hash = {}, {}, {}
+    for texto, tipo_id, usos in conn.execute(text(
+        "SELECT t.texto, c.tipo_id, COUNT(DISTINCT t.cotizacion_id) FROM terminos_cotizacion t "
+        "LEFT JOIN cotizaciones c ON c.id = t.cotizacion_id GROUP BY t.texto, c.tipo_id ORDER BY MIN(t.id)"
+    )):
+        h = hash_texto(texto)
+        texto_por_hash.setdefault(h, texto)
+        tipos_por_hash.setdefault(h, set()).add(tipo_id)
+        usos_por_hash[h] = usos_por_hash.get(h, 0) + usos
+    compartidos = {h for h, usos in usos_por_hash.items() if usos > 1}
+
+    if compartidos:
+        conn.execute(
+            text("INSERT OR IGNORE INTO clausulas_termino (texto, hash, tipo_id, activo, created_at) "
+                 "VALUES (:texto, :hash, :tipo_id, 1, CURRENT_TIMESTAMP)"),
+            [{"texto": texto_por_hash[h], "hash": h,
+              "tipo_id": next(iter(tipos_por_hash[h])) if len(tipos_por_hash[h]) == 1 else None}
+             for h in compartidos]
+        )
+    ids = dict(conn.execute(text("SELECT hash, id FROM clausulas_termino")).all())
+
+    conn.execute(text("CREATE TEMP TABLE mapa_clausulas (texto TEXT PRIMARY KEY, clausula_id INTEGER NOT NULL)"))
+    mapa = [
+        {"texto": t, "clausula_id": ids[hash_texto(t)]}
+        for (t,) in conn.execute(text("SELECT DISTINCT texto FROM terminos_cotizacion"))
+        if hash_texto(t) in ids
+    ]
+    if mapa:
+        conn.execute(text("INSERT INTO mapa_clausulas (texto, clausula_id) VALUES (:texto, :clausula_id)"), mapa)
+
+    conn.execute(text("ALTER TABLE terminos_cotizacion RENAME TO terminos_cotizacion_anterior"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_terminos_cotizacion_id"))
+    TerminoCotizacion.__table__.create(conn)
+    # El texto solo se deja en NULL cuando es idéntico al de la cláusula
+    conn.execute(text(
+        "INSERT INTO terminos_cotizacion (id, cotizacion_id, clausula_id, texto, orden) "
+        "SELECT t.id, t.cotizacion_id, m.clausula_id, "
+        "CASE WHEN c.texto = t.texto THEN NULL ELSE t.texto END, t.orden "
+        "FROM terminos_cotizacion_anterior t LEFT JOIN mapa_clausulas m ON m.texto = t.texto "
+        "LEFT JOIN clausulas_termino c ON c.id = m.clausula_id"
+    ))
+    conn.execute(text("DROP TABLE terminos_cotizacion_anterior"))
+    conn.execute(text("DROP TABLE mapa_clausulas"))
+
+
+def _cotizaciones_autoincrement(conn):
+    """Reconstruir cotizaciones con AUTOINCREMENT (SQLite no lo agrega con ALTER TABLE).
+
+    Sin AUTOINCREMENT, SQLite entrega de nuevo el ID más alto si esa fila deja la
+    tabla, y ese ID puede existir ya en archivo.cotizaciones. La tabla nueva se
+    crea con otro nombre y se renombra al final: así las claves foráneas de items,
+    términos y revisiones siguen apuntando a `cotizaciones`.
+    """
+    tabla = Cotizacion.__table__
+    ddl = str(CreateTable(tabla).compile(dialect=conn.dialect))
+    conn.execute(text(ddl.replace("CREATE TABLE cotizaciones ", "CREATE TABLE cotizaciones_nueva ", 1)))
+    columnas = ", ".join(c.name for c in tabla.c)
+    conn.execute(text(f"INSERT INTO cotizaciones_nueva ({columnas}) SELECT {columnas} FROM cotizaciones"))
+    conn.execute(text("DROP TABLE cotizaciones"))
+    conn.execute(text("ALTER TABLE cotizaciones_nueva RENAME TO cotizaciones"))
+    for indice in tabla.indexes:
+        indice.create(conn)
+
+
+def _secuencia_cotizaciones(conn):
+    """Que el próximo ID de cotización quede por encima de todos los archivados"""
+    maximo = conn.execute(text("SELECT MAX(id) FROM archivo.cotizaciones")).scalar()
+    if maximo is None:
+        return
+    actualizada = conn.execute(
+        text("UPDATE sqlite_sequence SET seq = MAX(seq, :maximo) WHERE name = 'cotizaciones'"), {"maximo": maximo}
+    ).rowcount
+    if not actualizada:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('cotizaciones', :maximo)"),
+                     {"maximo": maximo})
+
+
+def _rellenar_rnc_normalizado(conn):
+    """Normalizar el RNC de los clientes existentes.
+
+    Si ya hay duplicados, solo el cliente más antiguo queda con la clave; los demás
+    quedan en NULL (siguen funcionando, pero la importación no los encuentra por
+    RNC). Se registran en el log y los lista /api/mantenimiento/resumen-clientes.
+    """
+    vistos = {}
+    filas = []
+    for id_cliente, rnc in conn.execute(text("SELECT id, rnc FROM clientes WHERE rnc IS NOT NULL ORDER BY id")):
+        normalizado = normalizar_rnc(rnc)
+        if not normalizado:
+            continue
+        if normalizado in vistos:
+            logger.warning("Cliente %s sin rnc_normalizado: el RNC %s ya es del cliente %s",
+                           id_cliente, rnc, vistos[normalizado])
+            continue
+        vistos[normalizado] = id_cliente
+        filas.append({"id": id_cliente, "rnc": normalizado})
+    if filas:
+        conn.execute(text("UPDATE clientes SET rnc_normalizado = :rnc WHERE id = :id"), filas)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, LargeBinary, ForeignKey, Index, func, text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from database import Base
@@ -9,16 +9,37 @@ class Cliente(Base):
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String(200), nullable=False)
     rnc = Column(String(50))
+    rnc_normalizado = Column(String(20))  # Solo dígitos; clave para deduplicar clientes
     correo = Column(String(100))
     telefono = Column(String(20))
     direccion = Column(String(300))
     activo = Column(Boolean, default=True)
+    version = Column(Integer, nullable=False, default=1)  # Control de concurrencia optimista
+    
+    # Resumen de sus cotizaciones (incluidas las archivadas), mantenido por ClienteService.actualizar_resumen
+    total_cotizaciones = Column(Integer, nullable=False, default=0)
+    aprobado_centavos = Column(Integer, nullable=False, default=0)
+    ultima_cotizacion = Column(DateTime)
+    
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     # Relación: Un cliente puede tener muchas cotizaciones
     cotizaciones = relationship("Cotizacion", back_populates="cliente")
 
+    __table_args__ = (
+        # Un RNC por cliente; los clientes sin RNC no participan
+        Index("ux_clientes_rnc_normalizado", "rnc_normalizado", unique=True,
+              sqlite_where=text("rnc_normalizado IS NOT NULL")),
+    )
+
+    @property
+    def monto_aprobado(self):
+        return self.aprobado_centavos / 100
+
+# Búsqueda por correo sin distinguir mayúsculas (importación de clientes sin RNC)
+Index("ix_clientes_correo_lower", func.lower(Cliente.correo))
+
 
 class TipoCotizacion(Base):
     __tablename__ = "tipos_cotizacion"
@@ -27,6 +48,7 @@ class TipoCotizacion(Base):
     nombre = Column(String(100), nullable=False)  # Ej: "Estructural", "Eléctrico"
     codigo = Column(String(10), unique=True, nullable=False)  # Ej: "EST", "ELC"
     descripcion = Column(Text)
+    tasa_itbis_bp = Column(Integer, nullable=False, default=1800)  # Puntos básicos: 1800 = 18%
     activo = Column(Boolean, default=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
@@ -36,6 +58,14 @@ class TipoCotizacion(Base):
 
 class Cotizacion(Base):
     __tablename__ = "cotizaciones"
+    __table_args__ = (
+        # El barrido de vencimientos filtra por estado y fecha de vencimiento
+        Index("ix_cotizaciones_estado_vencimiento", "estado", "fecha_vencimiento"),
+        # Resumen por cliente (cantidad y monto aprobado)
+        Index("ix_cotizaciones_cliente_estado", "cliente_id", "estado"),
+        # Un ID no se reutiliza nunca: puede seguir existiendo en archivo.cotizaciones
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     numero = Column(String(50), unique=True, nullable=False)  # EST-1125-0001, ELC-1125-0002
@@ -56,7 +86,12 @@ class Cotizacion(Base):
     # Información
     descripcion = Column(Text)
     
-    # Montos
+    # Montos: la fuente de verdad son los centavos; los Float se mantienen para la API y el PDF
+    subtotal_centavos = Column(Integer, nullable=False, default=0)
+    descuento_centavos = Column(Integer, nullable=False, default=0)
+    itbis_centavos = Column(Integer, nullable=False, default=0)
+    total_centavos = Column(Integer, nullable=False, default=0)
+    tasa_itbis_bp = Column(Integer, nullable=False, default=1800)  # Tasa aplicada al calcular
     subtotal = Column(Float, default=0.0)
     itbis = Column(Float, default=0.0)
     total = Column(Float, default=0.0)
@@ -65,7 +100,10 @@ class Cotizacion(Base):
     pdf_path = Column(String(500))
     
     # Estado
-    estado = Column(String(50), default="pendiente")  # pendiente, aprobada, rechazada
+    estado = Column(String(50), default="pendiente")  # pendiente, aprobada, rechazada, vencida
+    
+    # Control de concurrencia optimista: cada escritura incrementa la versión
+    version = Column(Integer, nullable=False, default=1)
     
     # Timestamps
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -74,28 +112,150 @@ class Cotizacion(Base):
     # Relaciones: Una cotización tiene muchos items y términos
     items = relationship("ItemCotizacion", back_populates="cotizacion", cascade="all, delete-orphan")
     terminos = relationship("TerminoCotizacion", back_populates="cotizacion", cascade="all, delete-orphan")
+    
+    archivada = False  # Ver ArchivoCotizacion
+    
+    @property
+    def descuento(self):
+        return self.descuento_centavos / 100
 
 
 class ItemCotizacion(Base):
     __tablename__ = "items_cotizacion"
     
     id = Column(Integer, primary_key=True, index=True)
-    cotizacion_id = Column(Integer, ForeignKey("cotizaciones.id"), nullable=False)
+    cotizacion_id = Column(Integer, ForeignKey("cotizaciones.id"), nullable=False, index=True)
     alcance = Column(Text, nullable=False)
-    monto = Column(Float, nullable=False)
+    monto = Column(Float, nullable=False)  # Espejo de monto_centavos para la API
+    monto_centavos = Column(Integer, nullable=False, default=0)
+    descuento_centavos = Column(Integer, nullable=False, default=0)
     orden = Column(Integer, default=0)
     
     # Relación: Muchos items pertenecen a una cotización
     cotizacion = relationship("Cotizacion", back_populates="items")
+    
+    @property
+    def descuento(self):
+        return self.descuento_centavos / 100
+
+
+class ClausulaTermino(Base):
+    """Cláusula reutilizable del catálogo de términos y condiciones"""
+    __tablename__ = "clausulas_termino"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    texto = Column(Text, nullable=False)
+    hash = Column(String(64), unique=True, nullable=False)  # SHA-256 del texto normalizado
+    tipo_id = Column(Integer, ForeignKey("tipos_cotizacion.id"), index=True)  # NULL = cláusula general
+    activo = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
 
 class TerminoCotizacion(Base):
     __tablename__ = "terminos_cotizacion"
     
     id = Column(Integer, primary_key=True, index=True)
-    cotizacion_id = Column(Integer, ForeignKey("cotizaciones.id"), nullable=False)
-    texto = Column(Text, nullable=False)
+    cotizacion_id = Column(Integer, ForeignKey("cotizaciones.id"), nullable=False, index=True)
+    clausula_id = Column(Integer, ForeignKey("clausulas_termino.id"), index=True)
+    texto_propio = Column("texto", Text)  # Personalización para esta cotización; NULL = texto de la cláusula
     orden = Column(Integer, default=0)
     
     # Relación: Muchos términos pertenecen a una cotización
-    cotizacion = relationship("Cotizacion", back_populates="terminos")
\ No newline at end of file
+    cotizacion = relationship("Cotizacion", back_populates="terminos")
+    clausula = relationship("ClausulaTermino", lazy="joined")
+    
+    @property
+    def texto(self):
+        if self.texto_propio is not None:
+            return self.texto_propio
+        return self.clausula.texto if self.clausula else ""
+
+class Cambio(Base):
+    __tablename__ = "cambios"
+    __table_args__ = (
+        # Versión de cada catálogo: MAX(id) por entidad sin recorrer la tabla
+        Index("ix_cambios_entidad_id", "entidad", "id"),
+        {"sqlite_autoincrement": True},  # El ID es el token de sincronización: nunca se reutiliza
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    entidad = Column(String(30), nullable=False)  # cliente, tipo, cotizacion, clausula
+    entidad_id = Column(Integer, nullable=False)
+    operacion = Column(String(20), nullable=False)  # crear, actualizar, eliminar, estado
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class RevisionCotizacion(Base):
+    """Historial de ediciones de una cotización (ver services/revision_service.py).
+
+    Cada fila es un JSON comprimido con zlib: la cotización completa cada
+    REVISION_COMPLETA_CADA revisiones y, entre medio, solo el delta contra la
+    anterior. Sin FK a cotizaciones: el historial queda en la base principal
+    aunque la cotización se archive.
+    """
+    __tablename__ = "revisiones_cotizacion"
+    __table_args__ = (
+        Index("ux_revisiones_cotizacion", "cotizacion_id", "revision", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cotizacion_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False)     # 1, 2, 3... por cotización
+    version = Column(Integer, nullable=False)      # Versión de la cotización que quedó guardada
+    completa = Column(Boolean, nullable=False, default=False)
+    datos = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class ClaveIdempotencia(Base):
+    """Respuesta guardada de un POST con Idempotency-Key (ver services/idempotencia_service.py)"""
+    __tablename__ = "claves_idempotencia"
+    
+    clave = Column(String(255), primary_key=True)
+    huella = Column(String(64), nullable=False)     # SHA-256 de método, ruta y cuerpo
+    estado_http = Column(Integer)                   # NULL = la primera ejecución sigue en curso
+    dueno = Column(String(32))                      # Ejecución que tiene el reclamo: solo ella guarda o suelta
+    tipo_contenido = Column(String(255))            # Content-Type; el resto de encabezados se rearma al repetir
+    cuerpo = Column(LargeBinary)
+    expira = Column(DateTime, nullable=False, index=True)
+
+
+# ====================== ARCHIVO ======================
+# Copias de las tablas de cotizaciones en la base adjunta `archivo` (ver database.py).
+# Las relaciones con clientes, tipos y cláusulas apuntan a la base principal.
+
+def _esquema_referido(tabla, esquema_destino, restriccion, esquema_referido):
+    if restriccion.elements[0].target_fullname.startswith("cotizaciones."):
+        return esquema_destino
+    return None
+
+
+def _tabla_archivo(tabla):
+    return tabla.to_metadata(Base.metadata, schema="archivo", referred_schema_fn=_esquema_referido)
+
+
+class ArchivoCotizacion(Base):
+    __table__ = _tabla_archivo(Cotizacion.__table__)
+    archivada = True  # Solo lectura
+    
+    cliente = relationship("Cliente")
+    tipo = relationship("TipoCotizacion")
+    items = relationship("ArchivoItemCotizacion", order_by="ArchivoItemCotizacion.orden")
+    terminos = relationship("ArchivoTerminoCotizacion", order_by="ArchivoTerminoCotizacion.orden")
+    
+    descuento = Cotizacion.descuento
+
+
+class ArchivoItemCotizacion(Base):
+    __table__ = _tabla_archivo(ItemCotizacion.__table__)
+    
+    descuento = ItemCotizacion.descuento
+
+
+class ArchivoTerminoCotizacion(Base):
+    __table__ = _tabla_archivo(TerminoCotizacion.__table__)
+    texto_propio = __table__.c.texto
+    
+    clausula = relationship("ClausulaTermino", lazy="joined")
+    
+    texto = TerminoCotizacion.texto
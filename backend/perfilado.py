@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi.routing import APIRoute
+
+# ==============================================
+# PERFILADO BAJO DEMANDA
+# ==============================================
+# Apagado por defecto. Con PERFILADO_TOKEN definido, una petición con el encabezado
+# `X-Perfilar: <token>` se perfila con cProfile (y con `X-Perfilar-Memoria: 1`
+# también con tracemalloc alrededor del PDF y de CotizacionService). Con
+# PERFILADO_MUESTREO > 0 se perfila además esa fracción de peticiones al azar y se
+# guardan solo las que tardan más de PERFILADO_UMBRAL_MS.
+#
+# Los perfiles quedan en memoria (los últimos PERFILADO_MAXIMO) y se descargan
+# desde /api/perfiles en formato pstats (snakeviz, `python -m pstats`).
+#
+# Apagado, el costo es una comparación en el middleware y una lectura de
+# contextvar por endpoint y por sección medida.
+
+PERFILADO_TOKEN = os.getenv("PERFILADO_TOKEN", "")
+PERFILADO_MUESTREO = float(os.getenv("PERFILADO_MUESTREO", "0"))     # 0.01 = 1% de las peticiones
+PERFILADO_UMBRAL_MS = float(os.getenv("PERFILADO_UMBRAL_MS", "500"))  # Solo para las de muestreo
+PERFILADO_MAXIMO = int(os.getenv("PERFILADO_MAXIMO", "50"))
+
+HABILITADO = bool(PERFILADO_TOKEN) or PERFILADO_MUESTREO > 0
+LINEAS_RESUMEN = 30
+
+
+@dataclass
+class Perfil:
+    id: int
+    metodo: str
+    ruta: str
+    origen: str                      # encabezado | muestreo
+    memoria: bool = False
+    fecha: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    duracion_ms: float = 0.0
+    estado_http: int = 0
+    stats: Optional[bytes] = None    # pstats serializado (marshal)
+    secciones: list = field(default_factory=list)  # Mediciones de memoria
+
+    def resumen(self) -> dict:
+        return {
+            "id": self.id, "metodo": self.metodo, "ruta": self.ruta, "origen": self.origen,
+            "fecha": self.fecha, "duracion_ms": self.duracion_ms, "estado_http": self.estado_http,
+            "con_cpu": self.stats is not None, "secciones_memoria": len(self.secciones),
+        }
+
+
+_actual: contextvars.ContextVar[Optional[Perfil]] = contextvars.ContextVar("perfil_actual", default=None)
+_perfiles = deque(maxlen=PERFILADO_MAXIMO)
+_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+# ====================== INICIO Y CIERRE (LOS LLAMA EL MIDDLEWARE) ======================
+
+def iniciar(metodo: str, ruta: str, encabezado: Optional[str], memoria: bool):
+    """Perfil para esta petición si corresponde (o None) y el token para `soltar`"""
+    if PERFILADO_TOKEN and encabezado == PERFILADO_TOKEN:
+        origen = "encabezado"
+    elif PERFILADO_MUESTREO > 0 and random.random() < PERFILADO_MUESTREO:
+        origen, memoria = "muestreo", False
+    else:
+        return None, None
+    perfil = Perfil(id=next(_ids), metodo=metodo, ruta=ruta, origen=origen, memoria=memoria)
+    return perfil, _actual.set(perfil)
+
+
+def terminar(perfil: Perfil, duracion_ms: float, estado_http: int) -> bool:
+    """Guardar el perfil en el buffer si lo pidió el encabezado o superó el umbral"""
+    perfil.duracion_ms = round(duracion_ms, 2)
+    perfil.estado_http = estado_http
+    if perfil.origen == "muestreo" and duracion_ms < PERFILADO_UMBRAL_MS:
+        return False
+    with _lock:
+        _perfiles.append(perfil)
+    return True
+
+
+def soltar(token):
+    _actual.reset(token)
+
+
+# ====================== CPU: ENVOLTURA DE ENDPOINTS ======================
+
+def _perfilar_cpu(funcion):
+    """cProfile alrededor del endpoint, en el mismo hilo donde corre.
+
+    Los endpoints síncronos corren en el threadpool y cProfile solo ve el hilo en
+    el que se activa; el contextvar del middleware llega a ese hilo. Los endpoints
+    async no se perfilan por CPU: en el event loop se mezclarían con otras peticiones.
+    """
+    if asyncio.iscoroutinefunction(funcion):
+        return funcion
+
+    @functools.wraps(funcion)
+    def envuelta(*args, **kwargs):
+        perfil = _actual.get()
+        if perfil is None:
+            return funcion(*args, **kwargs)
+        perfilador = cProfile.Profile()
+        perfilador.enable()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            perfilador.disable()
+            perfilador.create_stats()
+            perfil.stats = marshal.dumps(perfilador.stats)
+    return envuelta
+
+
+class RutaPerfilable(APIRoute):
+    """APIRoute cuyo endpoint se puede perfilar (ver `app.router.route_class` en main.py)"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _perfilar_cpu(endpoint), **kwargs)
+
+
+# ====================== MEMORIA: SECCIONES MEDIDAS ======================
+
+_usuarios_tracemalloc = 0
+_lock_tracemalloc = threading.Lock()
+
+
+@contextmanager
+def _trazando():
+    """tracemalloc es global al proceso: se activa con el primer usuario y se apaga con el último"""
+    global _usuarios_tracemalloc
+    with _lock_tracemalloc:
+        if _usuarios_tracemalloc == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _usuarios_tracemalloc += 1
+    try:
+        yield
+    finally:
+        with _lock_tracemalloc:
+            _usuarios_tracemalloc -= 1
+            if _usuarios_tracemalloc == 0:
+                tracemalloc.stop()
+
+
+def medir_memoria(nombre: str):
+    """Decorador: con un perfil de memoria activo, anota las asignaciones de la llamada.
+
+    Con varias peticiones perfiladas a la vez las cifras se mezclan (tracemalloc es global).
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envuelta(*args, **kwargs):
+            perfil = _actual.get()
+            if perfil is None or not perfil.memoria:
+                return funcion(*args, **kwargs)
+            with _trazando():
+                anidadas = len(perfil.secciones)
+                antes = tracemalloc.take_snapshot()
+                tracemalloc.reset_peak()
+                inicio = time.perf_counter()
+                try:
+                    return funcion(*args, **kwargs)
+                finally:
+                    _, pico = tracemalloc.get_traced_memory()
+                    # Una sección anidada reinició el pico: se toma el mayor de todos
+                    pico = max([pico] + [sec["pico_bytes"] for sec in perfil.secciones[anidadas:]])
+                    despues = tracemalloc.take_snapshot()
+                    diferencias = despues.compare_to(antes, "lineno")
+                    perfil.secciones.append({
+                        "seccion": nombre,
+                        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+                        "pico_bytes": pico,
+                        "neto_bytes": sum(d.size_diff for d in diferencias),
+                        "principales": [
+                            {"linea": str(d.traceback[0]), "bytes": d.size_diff, "bloques": d.count_diff}
+                            for d in diferencias[:10]
+                        ],
+                    })
+        return envuelta
+    return decorador
+
+
+# ====================== CONSULTA ======================
+
+def listar() -> list:
+    with _lock:
+        return [p.resumen() for p in reversed(_perfiles)]
+
+
+def obtener(perfil_id: int) -> Optional[Perfil]:
+    with _lock:
+        return next((p for p in _perfiles if p.id == perfil_id), None)
+
+
+def texto_cpu(perfil: Perfil, orden: str = "cumulative") -> str:
+    """Las funciones más costosas, como las imprime pstats"""
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(_StatsGuardadas(perfil), stream=salida)
+    estadisticas.strip_dirs().sort_stats(orden).print_stats(LINEAS_RESUMEN)
+    return salida.getvalue()
+
+
+def archivo_pstats(perfil: Perfil) -> bytes:
+    """Contenido de un archivo .prof (el mismo formato que escribe cProfile)"""
+    return perfil.stats
+
+
+class _StatsGuardadas:
+    """pstats.Stats acepta cualquier objeto con create_stats() y .stats"""
+
+    def __init__(self, perfil: Perfil):
+        self.stats = marshal.loads(perfil.stats)
+
+    def create_stats(self):
+        pass
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # ====================== CLIENTES ======================
@@ -17,12 +17,32 @@ class ClienteCreate(ClienteBase):
 class ClienteResponse(ClienteBase):
     id: int
     activo: bool
+    version: int
+    total_cotizaciones: int = 0                 # Incluye las archivadas
+    monto_aprobado: float = 0.0
+    ultima_cotizacion: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime  
     
     class Config:
         from_attributes = True
 
+class ClientesLoteRequest(BaseModel):
+    clientes: List[ClienteCreate] = Field(..., max_length=100000)
+
+class ResultadoFilaCliente(BaseModel):
+    indice: int                       # Posición de la fila en la petición
+    id: Optional[int] = None
+    resultado: str                    # creado | actualizado | sin_cambios | duplicado
+    fila_final: Optional[int] = None  # Para duplicados: la fila que se aplicó
+
+class ClientesLoteResponse(BaseModel):
+    creados: int
+    actualizados: int
+    sin_cambios: int
+    duplicados: int
+    resultados: List[ResultadoFilaCliente]
+
 
 # ====================== TIPOS DE COTIZACIÓN ======================
 
@@ -30,6 +50,7 @@ class TipoCotizacionBase(BaseModel):
     nombre: str
     codigo: str
     descripcion: Optional[str] = None
+    tasa_itbis_bp: int = Field(1800, ge=0, le=10000)  # Puntos básicos: 1800 = 18%
 
 class TipoCotizacionCreate(TipoCotizacionBase):
     pass
@@ -42,12 +63,18 @@ class TipoCotizacionResponse(TipoCotizacionBase):
     class Config:
         from_attributes = True
 
+class CambiarTasaItbisRequest(BaseModel):
+    tasa_itbis_bp: int = Field(..., ge=0, le=10000)
+    recalcular: bool = True        # Re-totalizar las cotizaciones de este tipo
+    solo_pendientes: bool = True   # No tocar cotizaciones aprobadas/rechazadas
+
 
 # ====================== ITEMS ======================
 
 class ItemCreate(BaseModel):
     alcance: str
     monto: float
+    descuento: float = 0.0  # Monto descontado de este item (DOP)
 
 class ItemResponse(ItemCreate):
     id: int
@@ -60,15 +87,36 @@ class ItemResponse(ItemCreate):
 # ====================== TÉRMINOS ======================
 
 class TerminoCreate(BaseModel):
-    texto: str
+    clausula_id: Optional[int] = None  # Cláusula del catálogo
+    texto: Optional[str] = None        # Texto libre, o personalización de la cláusula indicada
+    
+    @model_validator(mode="after")
+    def requiere_clausula_o_texto(self):
+        if self.clausula_id is None and not (self.texto or "").strip():
+            raise ValueError("Cada término necesita clausula_id o texto")
+        return self
 
 class TerminoResponse(TerminoCreate):
     id: int
+    texto: str
     orden: int
     
     class Config:
         from_attributes = True
 
+class ClausulaCreate(BaseModel):
+    texto: str
+    tipo_id: Optional[int] = None  # NULL = disponible para todos los tipos
+
+class ClausulaResponse(ClausulaCreate):
+    id: int
+    hash: str
+    activo: bool
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 
 # ====================== COTIZACIONES ======================
 
@@ -88,9 +136,13 @@ class CotizacionResponse(CotizacionBase):
     fecha_emision: datetime
     fecha_vencimiento: datetime
     subtotal: float
+    descuento: float
     itbis: float
     total: float
+    tasa_itbis_bp: int
     estado: str
+    version: int
+    archivada: bool = False  # En la base de archivo: solo lectura
     pdf_path: Optional[str]
     created_at: datetime
     updated_at: datetime
@@ -102,4 +154,49 @@ class CotizacionResponse(CotizacionBase):
     terminos: List[TerminoResponse]
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class CambioEstado(BaseModel):
+    cotizacion_id: int
+    estado: str
+    version: Optional[int] = None  # Como If-Match: solo se aplica si coincide
+
+class CambiarEstadosRequest(BaseModel):
+    cambios: List[CambioEstado] = Field(..., min_length=1, max_length=5000)
+
+class ErrorCambioEstado(BaseModel):
+    id: int
+    motivo: str  # no_encontrada | archivada | transicion_invalida | conflicto_version
+    estado_actual: Optional[str] = None
+
+class CambiarEstadosResponse(BaseModel):
+    actualizadas: int
+    sin_cambios: int
+    por_estado: Dict[str, int]
+    errores: List[ErrorCambioEstado]
+
+
+class EditorCotizacionResponse(BaseModel):
+    """Cotización y catálogos del editor; un catálogo en None no cambió desde la versión enviada"""
+    cotizacion: Optional[CotizacionResponse] = None
+    clientes: Optional[List[ClienteResponse]] = None
+    tipos: Optional[List[TipoCotizacionResponse]] = None
+    clausulas: Optional[List[ClausulaResponse]] = None
+    versiones: Dict[str, int]
+
+class RevisionResponse(BaseModel):
+    revision: int
+    version: int       # Versión de la cotización (ETag) que quedó guardada
+    completa: bool     # False = guardada como delta contra la anterior
+    bytes: int
+    fecha: Optional[datetime] = None
+
+# ====================== CAMBIOS (SINCRONIZACIÓN) ======================
+
+class CambiosResponse(BaseModel):
+    token: int  # Enviar como ?since= en la próxima consulta
+    hay_mas: bool
+    clientes: List[ClienteResponse] = []
+    tipos: List[TipoCotizacionResponse] = []
+    cotizaciones: List[CotizacionResponse] = []
+    eliminados: Dict[str, List[int]] = {}
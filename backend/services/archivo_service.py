@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, insert, delete
+from models import (
+    Cotizacion, ItemCotizacion, TerminoCotizacion,
+    ArchivoCotizacion, ArchivoItemCotizacion, ArchivoTerminoCotizacion
+)
+from services.cambios_service import CambiosService
+
+# Cotizaciones cerradas y antiguas se mueven a la base adjunta `archivo` para que
+# las tablas calientes (y sus índices) solo crezcan con el trabajo en curso.
+
+ESTADOS_FINALES = ["aprobada", "rechazada", "vencida"]
+ARCHIVO_DIAS = int(os.getenv("ARCHIVO_DIAS", "365"))
+ARCHIVO_LOTE = int(os.getenv("ARCHIVO_LOTE", "500"))
+
+# (tabla caliente, tabla de archivo, columna que la une a la cotización)
+_TABLAS_HIJAS = [
+    (ItemCotizacion.__table__, ArchivoItemCotizacion.__table__, "cotizacion_id"),
+    (TerminoCotizacion.__table__, ArchivoTerminoCotizacion.__table__, "cotizacion_id"),
+]
+
+
+class ArchivoService:
+
+    @staticmethod
+    def archivar(db: Session, dias: int = None, lote: int = None, ahora: datetime = None) -> int:
+        """Mover al archivo las cotizaciones en estado final emitidas hace más de `dias`.
+
+        Cada lote es una transacción: se copia con INSERT ... SELECT y se borra de
+        las tablas calientes. Devuelve cuántas cotizaciones se archivaron.
+        """
+        dias = ARCHIVO_DIAS if dias is None else dias
+        lote = lote or ARCHIVO_LOTE
+        corte = (ahora or datetime.now(timezone.utc)) - timedelta(days=dias)
+
+        archivadas = 0
+        while True:
+            ids = db.scalars(
+                select(Cotizacion.id)
+                .where(
+                    Cotizacion.estado.in_(ESTADOS_FINALES),
+                    Cotizacion.fecha_emision < corte
+                )
+                .order_by(Cotizacion.id)
+                .limit(lote)
+            ).all()
+            if not ids:
+                break
+            ArchivoService._mover_lote(db, ids)
+            CambiosService.registrar_varios(db, "cotizacion", ids, "archivar")
+            db.commit()
+            archivadas += len(ids)
+        return archivadas
+
+    @staticmethod
+    def _mover_lote(db: Session, ids: list):
+        caliente, archivo = Cotizacion.__table__, ArchivoCotizacion.__table__
+        columnas = [c.name for c in caliente.c]
+        db.execute(insert(archivo).from_select(
+            columnas, select(*[caliente.c[n] for n in columnas]).where(caliente.c.id.in_(ids))
+        ))
+        for tabla, tabla_archivo, union in _TABLAS_HIJAS:
+            # Items y términos reciben IDs nuevos en el archivo (nadie los referencia)
+            columnas = [c.name for c in tabla.c if c.name != "id"]
+            db.execute(insert(tabla_archivo).from_select(
+                columnas,
+                select(*[tabla.c[n] for n in columnas]).where(tabla.c[union].in_(ids)).order_by(tabla.c.id)
+            ))
+            db.execute(delete(tabla).where(tabla.c[union].in_(ids)))
+        db.execute(delete(caliente).where(caliente.c.id.in_(ids)))
+
+    @staticmethod
+    def contar(db: Session) -> int:
+        return db.query(func.count(ArchivoCotizacion.id)).scalar()
+
+    @staticmethod
+    def mantenimiento(engine):
+        """ANALYZE y VACUUM incremental de la base principal y la de archivo.
+
+        La primera vez que una base no está en modo auto_vacuum incremental se
+        convierte con un VACUUM completo; las siguientes solo liberan páginas libres.
+        """
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for esquema in ("main", "archivo"):
+                if conn.exec_driver_sql(f"PRAGMA {esquema}.auto_vacuum").scalar() != 2:
+                    conn.exec_driver_sql(f"PRAGMA {esquema}.auto_vacuum = INCREMENTAL")
+                    conn.exec_driver_sql(f"VACUUM {esquema}")
+                else:
+                    # executescript recorre la pragma hasta el final; execute libera una sola página
+                    conn.connection.dbapi_connection.executescript(f"PRAGMA {esquema}.incremental_vacuum;")
+            conn.exec_driver_sql("ANALYZE")
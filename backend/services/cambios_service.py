@@ -0,0 +1,122 @@
+import os
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import delete, func, insert, select
+from models import Cambio, Cliente, Cotizacion, TipoCotizacion
+from datetime import datetime, timedelta, timezone
+
+# Pasados estos días, un cambio se borra si la misma fila tiene otro más nuevo
+CAMBIOS_RETENCION_DIAS = int(os.getenv("CAMBIOS_RETENCION_DIAS", "90"))
+
+ENTIDADES_CAMBIOS = ("cliente", "tipo", "cotizacion", "clausula")
+
+
+class TokenVencidoError(Exception):
+    """El token no salió de esta base (es posterior al último cambio): hay que recargar todo"""
+
+
+class CambiosService:
+    """Registro de cambios para que el frontend sincronice solo los deltas"""
+
+    @staticmethod
+    def registrar(db: Session, entidad: str, entidad_id: int, operacion: str):
+        """Registrar un cambio dentro de la transacción en curso"""
+        db.add(Cambio(entidad=entidad, entidad_id=entidad_id, operacion=operacion))
+
+    @staticmethod
+    def registrar_varios(db: Session, entidad: str, entidad_ids, operacion: str):
+        """Registrar el mismo cambio para muchas filas con un solo INSERT"""
+        ahora = datetime.now(timezone.utc)
+        filas = [
+            {"entidad": entidad, "entidad_id": entidad_id, "operacion": operacion, "created_at": ahora}
+            for entidad_id in entidad_ids
+        ]
+        if filas:
+            db.execute(insert(Cambio), filas)
+
+    @staticmethod
+    def token_actual(db: Session) -> int:
+        """Último token emitido (0 si no hay cambios)"""
+        return db.query(func.max(Cambio.id)).scalar() or 0
+
+    @staticmethod
+    def versiones(db: Session, entidades) -> dict:
+        """Último token de cada entidad (0 si nunca cambió): sirve como versión de su catálogo"""
+        versiones = dict.fromkeys(entidades, 0)
+        versiones.update(
+            db.query(Cambio.entidad, func.max(Cambio.id))
+            .filter(Cambio.entidad.in_(list(versiones)))
+            .group_by(Cambio.entidad)
+            .all()
+        )
+        return versiones
+
+    @staticmethod
+    def compactar(db: Session, dias: int = None) -> int:
+        """Borrar los cambios de más de `dias` (CAMBIOS_RETENCION_DIAS) que ya tienen uno más nuevo.
+
+        Cada fila conserva su último cambio: quien tenga un token anterior igual
+        recibe el estado actual de todo lo que cambió después, y since=0 sigue
+        siendo la carga completa. Las versiones de los catálogos tampoco cambian.
+        """
+        limite = datetime.now(timezone.utc) - timedelta(days=CAMBIOS_RETENCION_DIAS if dias is None else dias)
+        ultimos = select(func.max(Cambio.id)).group_by(Cambio.entidad, Cambio.entidad_id)
+        borrados = db.execute(
+            delete(Cambio).where(Cambio.created_at < limite, Cambio.id.not_in(ultimos))
+        ).rowcount
+        db.commit()
+        return borrados
+
+    @staticmethod
+    def obtener_desde(db: Session, since: int, limite: int = 500, entidades=None) -> dict:
+        """Estado actual de las entidades que cambiaron después del token `since`.
+
+        `entidades` limita la respuesta a esas entidades; el token avanza igual
+        sobre todos los cambios revisados. TokenVencidoError si `since` es posterior
+        al último cambio (un token de otra base o de antes de restaurar un respaldo).
+        """
+        ultimo = CambiosService.token_actual(db)
+        if since > ultimo:
+            raise TokenVencidoError(f"Token {since} desconocido: hace falta una carga completa (since=0)")
+
+        # Hasta `ultimo`: un cambio que se confirme mientras tanto queda para la próxima consulta
+        consulta = db.query(Cambio.id, Cambio.entidad, Cambio.entidad_id).filter(
+            Cambio.id > since, Cambio.id <= ultimo
+        )
+        if entidades:
+            consulta = consulta.filter(Cambio.entidad.in_(list(entidades)))
+        cambios = consulta.order_by(Cambio.id).limit(limite + 1).all()
+
+        hay_mas = len(cambios) > limite
+        cambios = cambios[:limite]
+        # Sin más páginas ya se revisó todo hasta `ultimo` (también lo que el filtro dejó fuera)
+        token = cambios[-1].id if hay_mas else ultimo
+
+        # Varios cambios sobre la misma fila se resuelven con su estado actual
+        ids = {"cliente": set(), "tipo": set(), "cotizacion": set()}
+        for cambio in cambios:
+            ids.setdefault(cambio.entidad, set()).add(cambio.entidad_id)
+
+        clientes = db.query(Cliente).filter(Cliente.id.in_(ids["cliente"])).all() if ids["cliente"] else []
+        tipos = db.query(TipoCotizacion).filter(TipoCotizacion.id.in_(ids["tipo"])).all() if ids["tipo"] else []
+        cotizaciones = db.query(Cotizacion).options(
+            joinedload(Cotizacion.cliente),
+            joinedload(Cotizacion.tipo),
+            selectinload(Cotizacion.items),
+            selectinload(Cotizacion.terminos)
+        ).filter(Cotizacion.id.in_(ids["cotizacion"])).all() if ids["cotizacion"] else []
+
+        # Clientes desactivados y filas que ya no existen se informan como eliminados
+        encontradas = {c.id for c in cotizaciones}
+        eliminados = {
+            "clientes": sorted(c.id for c in clientes if not c.activo),
+            "cotizaciones": sorted(ids["cotizacion"] - encontradas),
+        }
+
+        return {
+            "token": token,
+            "hay_mas": hay_mas,
+            "clientes": [c for c in clientes if c.activo],
+            "tipos": tipos,
+            "cotizaciones": cotizaciones,
+            "eliminados": eliminados,
+        }
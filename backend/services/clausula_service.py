@@ -0,0 +1,137 @@
+import hashlib
+from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert
+from models import ClausulaTermino, TerminoCotizacion
+from services.cambios_service import CambiosService
+
+
+def normalizar_texto(texto: str) -> str:
+    """Forma canónica para comparar cláusulas (sin espacios repetidos ni en los extremos).
+
+    Solo sirve para el hash: el texto se guarda tal como se escribió, con sus saltos de línea.
+    """
+    return " ".join(texto.split())
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(normalizar_texto(texto).encode("utf-8")).hexdigest()
+
+
+class ClausulaService:
+    """Catálogo compartido de términos y condiciones.
+
+    Cada texto se guarda una sola vez (único por hash); las cotizaciones solo
+    referencian la cláusula por ID y opcionalmente la personalizan. Al catálogo
+    solo entra lo que se agrega explícitamente (POST /api/clausulas): el texto
+    libre de una cotización que no coincide con ninguna cláusula queda en la cotización.
+    """
+
+    @staticmethod
+    def listar(db: Session, tipo_id: int = None):
+        """Cláusulas activas generales y, si se indica, las propias del tipo"""
+        query = db.query(ClausulaTermino).filter(ClausulaTermino.activo == True)
+        if tipo_id is not None:
+            query = query.filter(or_(ClausulaTermino.tipo_id == None, ClausulaTermino.tipo_id == tipo_id))
+        return query.order_by(ClausulaTermino.id).all()
+
+    @staticmethod
+    def obtener_o_crear(db: Session, textos, tipo_id: int = None) -> dict:
+        """Mapa {hash: id} para los textos dados, insertando solo los que no existen"""
+        filas = {}
+        for texto in textos:
+            filas.setdefault(hash_texto(texto), texto)
+        if not filas:
+            return {}
+
+        # Un texto que ya existe (en cualquier tipo) se reutiliza tal cual; RETURNING
+        # solo trae las insertadas, que son las que cambian el catálogo
+        nuevas = db.execute(
+            insert(ClausulaTermino).on_conflict_do_nothing(index_elements=["hash"]).returning(ClausulaTermino.id),
+            [{"texto": texto, "hash": h, "tipo_id": tipo_id, "activo": True} for h, texto in filas.items()]
+        ).scalars().all()
+        CambiosService.registrar_varios(db, "clausula", nuevas, "crear")
+        return {h: id_ for h, (id_, _) in ClausulaService.buscar(db, filas).items()}
+
+    @staticmethod
+    def buscar(db: Session, hashes) -> dict:
+        """Mapa {hash: (id, texto)} de las cláusulas del catálogo con esos hashes"""
+        hashes = list(hashes)
+        if not hashes:
+            return {}
+        return {
+            h: (id_, texto) for h, id_, texto in
+            db.query(ClausulaTermino.hash, ClausulaTermino.id, ClausulaTermino.texto)
+            .filter(ClausulaTermino.hash.in_(hashes)).all()
+        }
+
+    @staticmethod
+    def crear(db: Session, texto: str, tipo_id: int = None) -> ClausulaTermino:
+        """Agregar una cláusula al catálogo (devuelve la existente si el texto ya estaba)"""
+        if not normalizar_texto(texto):
+            raise ValueError("El texto de la cláusula no puede estar vacío")
+        ids = ClausulaService.obtener_o_crear(db, [texto], tipo_id)
+        db.commit()
+        return db.query(ClausulaTermino).filter(ClausulaTermino.id == next(iter(ids.values()))).first()
+
+    @staticmethod
+    def desactivar(db: Session, clausula_id: int) -> bool:
+        """Ocultar una cláusula del catálogo; las cotizaciones que la usan no cambian"""
+        actualizadas = db.query(ClausulaTermino).filter(ClausulaTermino.id == clausula_id).update(
+            {"activo": False}, synchronize_session=False
+        )
+        if actualizadas:
+            CambiosService.registrar(db, "clausula", clausula_id, "eliminar")
+        db.commit()
+        return actualizadas > 0
+
+    @staticmethod
+    def resolver_terminos(db: Session, terminos) -> list:
+        """Convertir los términos recibidos en filas (clausula_id, texto_propio).
+
+        - Solo `clausula_id`: referencia directa al catálogo.
+        - Solo `texto`: si coincide (por hash) con una cláusula se referencia; si no,
+          queda como texto propio de la cotización, sin cláusula ni entrada en el catálogo.
+        - Ambos: referencia a la cláusula con el texto personalizado para esta cotización.
+        El texto propio se guarda tal cual; no se guarda si es idéntico al de la cláusula.
+        """
+        terminos = list(terminos or [])
+        ids = {t.clausula_id for t in terminos if t.clausula_id is not None}
+        textos = {}
+        if ids:
+            textos = dict(
+                db.query(ClausulaTermino.id, ClausulaTermino.texto).filter(ClausulaTermino.id.in_(ids)).all()
+            )
+            faltantes = sorted(ids - set(textos))
+            if faltantes:
+                raise ValueError(f"Cláusula no encontrada: {', '.join(map(str, faltantes))}")
+
+        libres = ClausulaService.buscar(db, {hash_texto(t.texto) for t in terminos if t.clausula_id is None})
+
+        filas = []
+        for t in terminos:
+            if t.clausula_id is None:
+                clausula_id, texto = libres.get(hash_texto(t.texto), (None, None))
+                filas.append((clausula_id, None if t.texto == texto else t.texto))
+                continue
+            propio = t.texto if t.texto and t.texto.strip() else None
+            if propio == textos[t.clausula_id]:
+                propio = None
+            filas.append((t.clausula_id, propio))
+        return filas
+
+    @staticmethod
+    def reemplazar_terminos(db: Session, cotizacion_id: int, filas: list) -> bool:
+        """Dejar los términos de la cotización iguales a `filas`; no escribe si no cambiaron"""
+        actuales = db.query(TerminoCotizacion.clausula_id, TerminoCotizacion.texto_propio).filter(
+            TerminoCotizacion.cotizacion_id == cotizacion_id
+        ).order_by(TerminoCotizacion.orden).all()
+        if [tuple(f) for f in actuales] == filas:
+            return False
+
+        db.query(TerminoCotizacion).filter(TerminoCotizacion.cotizacion_id == cotizacion_id).delete()
+        db.add_all(
+            TerminoCotizacion(cotizacion_id=cotizacion_id, clausula_id=clausula_id, texto_propio=propio, orden=idx)
+            for idx, (clausula_id, propio) in enumerate(filas)
+        )
+        return True
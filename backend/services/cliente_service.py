@@ -0,0 +1,333 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, update, select, union_all, case, or_
+from sqlalchemy.dialects.sqlite import insert
+from models import Cliente, Cotizacion, ArchivoCotizacion
+from schemas import ClienteCreate
+from services.cambios_service import CambiosService
+
+# Filas por sentencia: 7 parámetros por fila, muy por debajo del límite de SQLite
+TAMANO_LOTE = 500
+
+CAMPOS = ["nombre", "rnc", "correo", "telefono", "direccion"]
+
+# Columnas del resumen de cotizaciones de cada cliente
+RESUMEN = ["total_cotizaciones", "aprobado_centavos", "ultima_cotizacion"]
+
+
+def normalizar_rnc(rnc: Optional[str]) -> Optional[str]:
+    """Solo los dígitos del RNC/cédula ("1-33-34455-6" -> "133344556"); None si no hay"""
+    digitos = "".join(c for c in (rnc or "") if c.isdigit())
+    return digitos or None
+
+
+def normalizar_correo(correo: Optional[str]) -> Optional[str]:
+    correo = (correo or "").strip().lower()
+    return correo or None
+
+
+class ClienteService:
+
+    @staticmethod
+    def cliente_con_rnc(db: Session, rnc_normalizado: Optional[str], excluir_id: int = None):
+        """(id, activo) del cliente que ya usa ese RNC, activo o no, si existe"""
+        if not rnc_normalizado:
+            return None
+        query = db.query(Cliente.id, Cliente.activo).filter(Cliente.rnc_normalizado == rnc_normalizado)
+        if excluir_id is not None:
+            query = query.filter(Cliente.id != excluir_id)
+        return query.first()
+
+    # ====================== RESUMEN DE COTIZACIONES ======================
+
+    @staticmethod
+    def _agregados(ids=None):
+        """Resumen calculado desde las cotizaciones (principal + archivo), una fila por cliente"""
+        partes = []
+        for modelo in (Cotizacion, ArchivoCotizacion):
+            parte = select(
+                modelo.cliente_id.label("cliente_id"),
+                func.count().label("total"),
+                func.sum(case((modelo.estado == "aprobada", modelo.total_centavos), else_=0)).label("aprobado"),
+                func.max(modelo.fecha_emision).label("ultima"),
+            ).group_by(modelo.cliente_id)
+            if ids is not None:
+                parte = parte.where(modelo.cliente_id.in_(ids))
+            partes.append(parte)
+        cotizaciones = union_all(*partes).subquery()
+
+        # Los clientes sin cotizaciones también aparecen (con ceros)
+        clientes = Cliente.__table__.alias("c")
+        agregados = select(
+            clientes.c.id.label("id"),
+            func.coalesce(func.sum(cotizaciones.c.total), 0).label("total_cotizaciones"),
+            func.coalesce(func.sum(cotizaciones.c.aprobado), 0).label("aprobado_centavos"),
+            func.max(cotizaciones.c.ultima).label("ultima_cotizacion"),
+        ).select_from(
+            clientes.outerjoin(cotizaciones, cotizaciones.c.cliente_id == clientes.c.id)
+        ).group_by(clientes.c.id)
+        if ids is not None:
+            agregados = agregados.where(clientes.c.id.in_(ids))
+        return agregados.subquery()
+
+    @staticmethod
+    def sql_resumen(ids=None):
+        """UPDATE ... FROM que deja el resumen de los clientes `ids` (o de todos) igual al calculado.
+
+        Solo escribe las filas que difieren; no cambia `version` ni `updated_at`
+        porque el resumen no es una edición del cliente.
+        """
+        agregados = ClienteService._agregados(ids)
+        return (
+            update(Cliente)
+            .where(
+                Cliente.id == agregados.c.id,
+                or_(*[Cliente.__table__.c[col].is_distinct_from(agregados.c[col]) for col in RESUMEN])
+            )
+            .values(**{col: agregados.c[col] for col in RESUMEN}, updated_at=Cliente.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def _reescribir_resumen(db: Session, ids=None) -> list:
+        """Aplicar sql_resumen y registrar en el registro de cambios los clientes que cambiaron.
+
+        El resumen es parte de lo que devuelve /api/clientes: sin el cambio, ni el
+        delta de /api/changes ni la caché comprimida verían los totales nuevos.
+        """
+        cambiados = db.execute(ClienteService.sql_resumen(ids).returning(Cliente.id)).scalars().all()
+        CambiosService.registrar_varios(db, "cliente", sorted(cambiados), "actualizar")
+        return cambiados
+
+    @staticmethod
+    def actualizar_resumen(db: Session, cliente_ids):
+        """Recalcular el resumen de los clientes afectados (dentro de la transacción en curso)"""
+        ids = sorted({i for i in cliente_ids if i is not None})
+        if ids:
+            ClienteService._reescribir_resumen(db, ids)
+
+    @staticmethod
+    def sumar_cotizacion(db: Session, cliente_id: int, fecha_emision: datetime):
+        """Ajuste incremental al crear una cotización (siempre nace pendiente y es la más reciente)"""
+        db.execute(
+            update(Cliente)
+            .where(Cliente.id == cliente_id)
+            .values(
+                total_cotizaciones=Cliente.total_cotizaciones + 1,
+                ultima_cotizacion=fecha_emision,
+                updated_at=Cliente.updated_at
+            )
+            .execution_options(synchronize_session=False)
+        )
+        CambiosService.registrar(db, "cliente", cliente_id, "actualizar")
+
+    @staticmethod
+    def verificar_resumen(db: Session, reparar: bool = False, limite: int = 100) -> dict:
+        """Comparar el resumen guardado con uno recalculado desde cero; opcionalmente corregirlo"""
+        agregados = ClienteService._agregados()
+        diferencias = db.execute(
+            select(Cliente.id, *[Cliente.__table__.c[col] for col in RESUMEN], *[agregados.c[col] for col in RESUMEN])
+            .join(agregados, agregados.c.id == Cliente.id)
+            .where(or_(*[Cliente.__table__.c[col].is_distinct_from(agregados.c[col]) for col in RESUMEN]))
+        ).all()
+
+        reparados = 0
+        if reparar and diferencias:
+            reparados = len(ClienteService._reescribir_resumen(db))
+            db.commit()
+        rnc_duplicados = ClienteService.rnc_duplicados(db)
+        return {
+            "clientes": db.query(func.count(Cliente.id)).scalar(),
+            "con_diferencias": len(diferencias),
+            "reparados": reparados,
+            # No se reparan solos: hay que decidir a mano qué cliente conserva el RNC
+            "con_rnc_duplicado": len(rnc_duplicados),
+            "rnc_duplicados": rnc_duplicados[:limite],
+            "diferencias": [
+                {
+                    "cliente_id": fila[0],
+                    "guardado": dict(zip(RESUMEN, fila[1:1 + len(RESUMEN)])),
+                    "calculado": dict(zip(RESUMEN, fila[1 + len(RESUMEN):])),
+                }
+                for fila in diferencias[:limite]
+            ],
+        }
+
+    @staticmethod
+    def rnc_duplicados(db: Session) -> list:
+        """Clientes que comparten RNC con otro anterior y por eso quedaron sin rnc_normalizado.
+
+        Vienen de antes del índice único (ver migraciones._rellenar_rnc_normalizado):
+        la importación no los encuentra por RNC hasta que se corrijan o se fusionen.
+        """
+        sin_clave = [
+            (id_cliente, rnc, normalizar_rnc(rnc))
+            for id_cliente, rnc in db.query(Cliente.id, Cliente.rnc).filter(
+                Cliente.rnc.isnot(None), Cliente.rnc_normalizado.is_(None)
+            ).order_by(Cliente.id)
+            if normalizar_rnc(rnc)
+        ]
+        if not sin_clave:
+            return []
+        duenos = dict(db.query(Cliente.rnc_normalizado, Cliente.id).filter(
+            Cliente.rnc_normalizado.in_({normalizado for _, _, normalizado in sin_clave})
+        ).all())
+        return [
+            {"cliente_id": id_cliente, "rnc": rnc, "en_uso_por": duenos.get(normalizado)}
+            for id_cliente, rnc, normalizado in sin_clave
+        ]
+
+    # ====================== IMPORTACIÓN ======================
+
+    @staticmethod
+    def importar(db: Session, clientes: List[ClienteCreate]) -> dict:
+        """Crear o actualizar clientes en lote.
+
+        Se busca el cliente existente por RNC normalizado y, si la fila no trae RNC,
+        por correo. Las filas con RNC van en un INSERT ... ON CONFLICT por lote; las
+        de correo, en un upsert por ID para las encontradas y un INSERT para el
+        resto. Si el mismo cliente viene repetido, gana la última fila.
+        Un cliente desactivado que vuelve a llegar se reactiva.
+        """
+        resultados = [None] * len(clientes)
+        por_rnc, por_correo, sin_clave = {}, {}, []
+        for indice, cliente in enumerate(clientes):
+            fila = cliente.model_dump()
+            rnc = normalizar_rnc(fila["rnc"])
+            correo = normalizar_correo(fila["correo"])
+            if rnc:
+                destino, clave = por_rnc, rnc
+            elif correo:
+                destino, clave = por_correo, correo
+            else:
+                sin_clave.append((indice, fila))
+                continue
+            if clave in destino:
+                repetido = destino[clave][0]
+                resultados[repetido] = {"indice": repetido, "resultado": "duplicado", "fila_final": indice}
+            destino[clave] = (indice, {**fila, "rnc_normalizado": rnc})
+
+        ahora = datetime.now(timezone.utc)
+        creados, actualizados = [], []
+        filas_rnc = list(por_rnc.values())
+        for i in range(0, len(filas_rnc), TAMANO_LOTE):
+            ClienteService._upsert_rnc(db, filas_rnc[i:i + TAMANO_LOTE], ahora, resultados, creados, actualizados)
+        filas_correo = list(por_correo.items())
+        for i in range(0, len(filas_correo), TAMANO_LOTE):
+            ClienteService._upsert_correo(db, filas_correo[i:i + TAMANO_LOTE], ahora, resultados, creados, actualizados)
+        for i in range(0, len(sin_clave), TAMANO_LOTE):
+            ClienteService._insertar(db, sin_clave[i:i + TAMANO_LOTE], ahora, resultados, creados)
+
+        CambiosService.registrar_varios(db, "cliente", creados, "crear")
+        CambiosService.registrar_varios(db, "cliente", actualizados, "actualizar")
+        db.commit()
+
+        conteo = {"creado": 0, "actualizado": 0, "sin_cambios": 0, "duplicado": 0}
+        for r in resultados:
+            conteo[r["resultado"]] += 1
+        return {
+            "creados": conteo["creado"],
+            "actualizados": conteo["actualizado"],
+            "sin_cambios": conteo["sin_cambios"],
+            "duplicados": conteo["duplicado"],
+            "resultados": resultados,
+        }
+
+    @staticmethod
+    def _cambio(tabla, nuevos):
+        """Condición de UPDATE: algún campo recibido distinto del guardado, o cliente inactivo"""
+        return or_(
+            tabla.c.activo == False,
+            *[func.coalesce(nuevos[campo], tabla.c[campo]).is_distinct_from(tabla.c[campo]) for campo in CAMPOS]
+        )
+
+    @staticmethod
+    def _upsert(ahora, **conflicto):
+        """INSERT ... ON CONFLICT DO UPDATE que solo escribe los clientes con algún cambio"""
+        sentencia = insert(Cliente)
+        tabla = Cliente.__table__
+        # Los campos que no vienen en la fila no borran lo que ya está guardado
+        return sentencia.on_conflict_do_update(
+            **conflicto,
+            set_={
+                **{campo: func.coalesce(sentencia.excluded[campo], tabla.c[campo]) for campo in CAMPOS},
+                "activo": True,
+                "version": tabla.c.version + 1,
+                "updated_at": ahora,
+            },
+            where=ClienteService._cambio(tabla, sentencia.excluded),
+        )
+
+    @staticmethod
+    def _upsert_rnc(db: Session, lote, ahora, resultados, creados, actualizados):
+        claves = [fila["rnc_normalizado"] for _, fila in lote]
+        existentes = dict(
+            db.query(Cliente.rnc_normalizado, Cliente.id).filter(Cliente.rnc_normalizado.in_(claves)).all()
+        )
+
+        sentencia = ClienteService._upsert(
+            ahora, index_elements=["rnc_normalizado"], index_where=Cliente.rnc_normalizado.isnot(None)
+        ).returning(Cliente.id, Cliente.rnc_normalizado)
+
+        filas = [
+            {**fila, "activo": True, "version": 1, "created_at": ahora, "updated_at": ahora}
+            for _, fila in lote
+        ]
+        tocados = dict((rnc, id_) for id_, rnc in db.execute(sentencia, filas).all()) if filas else {}
+        for indice, fila in lote:
+            rnc = fila["rnc_normalizado"]
+            if rnc in existentes:
+                resultado = "actualizado" if rnc in tocados else "sin_cambios"
+                id_cliente = existentes[rnc]
+                if rnc in tocados:
+                    actualizados.append(id_cliente)
+            else:
+                resultado, id_cliente = "creado", tocados[rnc]
+                creados.append(id_cliente)
+            resultados[indice] = {"indice": indice, "id": id_cliente, "resultado": resultado}
+
+    @staticmethod
+    def _upsert_correo(db: Session, lote, ahora, resultados, creados, actualizados):
+        # Si hay varios clientes con el mismo correo, se toma el más antiguo
+        existentes = dict(
+            db.query(func.lower(Cliente.correo), func.min(Cliente.id))
+            .filter(func.lower(Cliente.correo).in_([correo for correo, _ in lote]))
+            .group_by(func.lower(Cliente.correo))
+            .all()
+        )
+        nuevos = [(indice, fila) for correo, (indice, fila) in lote if correo not in existentes]
+        encontrados = [(existentes[correo], indice, fila) for correo, (indice, fila) in lote if correo in existentes]
+
+        if encontrados:
+            # Upsert por ID: la fila existe, así que siempre cae en DO UPDATE y
+            # RETURNING trae solo los clientes que cambiaron
+            sentencia = ClienteService._upsert(ahora, index_elements=["id"]).returning(Cliente.id)
+            tocados = set(db.execute(sentencia, [
+                {"id": id_cliente, **{campo: fila[campo] for campo in CAMPOS}, "rnc_normalizado": None,
+                 "activo": True, "version": 1, "created_at": ahora, "updated_at": ahora}
+                for id_cliente, _, fila in encontrados
+            ]).scalars().all())
+            for id_cliente, indice, _ in encontrados:
+                cambio = id_cliente in tocados
+                if cambio:
+                    actualizados.append(id_cliente)
+                resultados[indice] = {"indice": indice, "id": id_cliente,
+                                      "resultado": "actualizado" if cambio else "sin_cambios"}
+
+        ClienteService._insertar(db, nuevos, ahora, resultados, creados)
+
+    @staticmethod
+    def _insertar(db: Session, lote, ahora, resultados, creados):
+        if not lote:
+            return
+        filas = [
+            {**{campo: fila[campo] for campo in CAMPOS}, "rnc_normalizado": None,
+             "activo": True, "version": 1, "created_at": ahora, "updated_at": ahora}
+            for _, fila in lote
+        ]
+        # RETURNING de un INSERT de varias filas conserva el orden de VALUES en SQLite
+        ids = db.execute(insert(Cliente).values(filas).returning(Cliente.id)).scalars().all()
+        for (indice, _), id_cliente in zip(lote, ids):
+            creados.append(id_cliente)
+            resultados[indice] = {"indice": indice, "id": id_cliente, "resultado": "creado"}
@@ -1,9 +1,36 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, extract
-from models import Cotizacion, ItemCotizacion, TerminoCotizacion, Cliente, TipoCotizacion
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, extract, update, select, or_, tuple_
+from models import Cotizacion, ItemCotizacion, Cliente, TipoCotizacion, ArchivoCotizacion, ClausulaTermino
 from schemas import CotizacionCreate
+from services.cambios_service import CambiosService
+from services.clausula_service import ClausulaService
+from services.cliente_service import ClienteService
+from services.revision_service import RevisionService
+from perfilado import medir_memoria
+from services.totales import linea_en_centavos, calcular_totales, sql_calcular_itbis, a_monto, formatear_tasa
 from datetime import datetime, timedelta, timezone
 
+
+class ConflictoVersionError(Exception):
+    """La versión esperada por el cliente ya no coincide con la almacenada"""
+
+
+ESTADOS_VALIDOS = ["pendiente", "aprobada", "rechazada", "vencida"]
+
+# Estado actual -> estados a los que puede pasar
+TRANSICIONES = {
+    "pendiente": ["aprobada", "rechazada", "vencida"],
+    "vencida": ["pendiente", "aprobada", "rechazada"],  # Renovada o aceptada tarde
+    "aprobada": ["pendiente"],                          # Deshacer
+    "rechazada": ["pendiente"],
+}
+
+
+def estados_de_origen(estado: str) -> list:
+    """Estados desde los que se puede llegar a `estado`"""
+    return [origen for origen, destinos in TRANSICIONES.items() if estado in destinos]
+
+
 class CotizacionService:
     
     @staticmethod
@@ -18,9 +45,11 @@ class CotizacionService:
         mes = datetime.now().strftime("%m")
         anio = datetime.now().strftime("%y")
         
-        # Contar cotizaciones del mismo tipo
+        # Contar cotizaciones del mismo tipo (incluidas las archivadas)
         contador = db.query(Cotizacion).filter(
             Cotizacion.tipo_id == tipo_id
+        ).count() + db.query(ArchivoCotizacion).filter(
+            ArchivoCotizacion.tipo_id == tipo_id
         ).count() + 1
         
         # Formato: CODIGO-MMYY-0001
@@ -28,6 +57,7 @@ class CotizacionService:
         return numero
     
     @staticmethod
+    @medir_memoria("CotizacionService.crear_cotizacion")
     def crear_cotizacion(db: Session, cotizacion_data: CotizacionCreate):
         """Crear cotización SIN generar PDF"""
         
@@ -49,9 +79,7 @@ class CotizacionService:
         fecha_vencimiento = fecha_emision + timedelta(days=cotizacion_data.vigencia_dias)
         
         # Calcular totales
-        subtotal = sum(item.monto for item in cotizacion_data.items)
-        itbis = subtotal * 0.18
-        total = subtotal + itbis
+        lineas, montos = CotizacionService._calcular_montos(cotizacion_data, tipo)
         
         # Crear cotización
         db_cotizacion = Cotizacion(
@@ -62,45 +90,348 @@ class CotizacionService:
             fecha_emision=fecha_emision,
             fecha_vencimiento=fecha_vencimiento,
             vigencia_dias=cotizacion_data.vigencia_dias,
-            subtotal=subtotal,
-            itbis=itbis,
-            total=total,
-            pdf_path=None
+            pdf_path=None,
+            **montos
         )
         db.add(db_cotizacion)
         db.flush()
         
         # Crear items
-        for idx, item in enumerate(cotizacion_data.items):
+        for idx, (item, (monto_c, descuento_c)) in enumerate(zip(cotizacion_data.items, lineas)):
             db_item = ItemCotizacion(
                 cotizacion_id=db_cotizacion.id,
                 alcance=item.alcance,
-                monto=item.monto,
+                monto=a_monto(monto_c),
+                monto_centavos=monto_c,
+                descuento_centavos=descuento_c,
                 orden=idx
             )
             db.add(db_item)
         
-        # Crear términos
-        for idx, termino in enumerate(cotizacion_data.terminos or []):
-            db_termino = TerminoCotizacion(
-                cotizacion_id=db_cotizacion.id,
-                texto=termino.texto,
-                orden=idx
-            )
-            db.add(db_termino)
+        # Crear términos: referencias al catálogo de cláusulas
+        terminos = ClausulaService.resolver_terminos(db, cotizacion_data.terminos)
+        ClausulaService.reemplazar_terminos(db, db_cotizacion.id, terminos)
         
+        ClienteService.sumar_cotizacion(db, db_cotizacion.cliente_id, fecha_emision)
+        RevisionService.registrar(db, db_cotizacion.id)
+        CambiosService.registrar(db, "cotizacion", db_cotizacion.id, "crear")
         db.commit()
         db.refresh(db_cotizacion)
         
         return db_cotizacion
     
     @staticmethod
-    def generar_pdf_cotizacion(db: Session, cotizacion_id: int):
-        """Generar PDF de una cotización existente"""
+    @medir_memoria("CotizacionService.actualizar_cotizacion")
+    def actualizar_cotizacion(db: Session, cotizacion_id: int, cotizacion_data: CotizacionCreate,
+                              version_esperada: int = None):
+        """Actualizar una cotización reservándola con un UPDATE condicional sobre la versión"""
+        
+        # Verificar cliente y tipo
+        cliente = db.query(Cliente).filter(Cliente.id == cotizacion_data.cliente_id).first()
+        if not cliente:
+            raise ValueError("Cliente no encontrado")
+        
+        tipo = db.query(TipoCotizacion).filter(TipoCotizacion.id == cotizacion_data.tipo_id).first()
+        if not tipo:
+            raise ValueError("Tipo de cotización no encontrado")
+        
+        # Calcular nuevas fechas
+        fecha_emision = datetime.now(timezone.utc)
+        fecha_vencimiento = fecha_emision + timedelta(days=cotizacion_data.vigencia_dias)
+        
+        # Calcular totales
+        lineas, montos = CotizacionService._calcular_montos(cotizacion_data, tipo)
+        terminos = ClausulaService.resolver_terminos(db, cotizacion_data.terminos)
+        
+        # El UPDATE condicional reserva la fila: solo afecta la fila si la versión
+        # sigue siendo la esperada. Como RETURNING solo ve los valores nuevos, este
+        # primero solo sube la versión y devuelve el cliente anterior (que también
+        # necesita su resumen al día) y la última revisión del historial.
+        previa = db.execute(
+            update(Cotizacion)
+            .where(*CotizacionService._condicion_version(cotizacion_id, version_esperada))
+            .values(version=Cotizacion.version + 1)
+            .returning(Cotizacion.cliente_id, Cotizacion.version, RevisionService.sql_ultima(cotizacion_id))
+            .execution_options(synchronize_session=False)
+        ).first()
+        if previa is None:
+            db.rollback()
+            CotizacionService._error_sin_filas(db, cotizacion_id)
+        cliente_anterior, version, ultima_revision = previa
+        
+        # Cotizaciones de antes del historial: su estado actual queda como revisión 1
+        if ultima_revision is None:
+            ultima_revision = RevisionService.guardar_base(db, cotizacion_id, version - 1)
+        
+        # Contenido nuevo sobre la fila ya reservada. Invalida el PDF si existía
+        # (porque cambió el contenido).
+        db.execute(
+            update(Cotizacion)
+            .where(Cotizacion.id == cotizacion_id)
+            .values(
+                cliente_id=cotizacion_data.cliente_id,
+                tipo_id=cotizacion_data.tipo_id,
+                descripcion=cotizacion_data.descripcion,
+                vigencia_dias=cotizacion_data.vigencia_dias,
+                fecha_vencimiento=fecha_vencimiento,
+                pdf_path=None,
+                **montos
+            )
+            .execution_options(synchronize_session=False)
+        )
+        
+        # Reemplazar items y términos (la fila ya quedó reservada por el UPDATE)
+        db.query(ItemCotizacion).filter(ItemCotizacion.cotizacion_id == cotizacion_id).delete()
+        
+        for idx, (item, (monto_c, descuento_c)) in enumerate(zip(cotizacion_data.items, lineas)):
+            db.add(ItemCotizacion(
+                cotizacion_id=cotizacion_id,
+                alcance=item.alcance,
+                monto=a_monto(monto_c),
+                monto_centavos=monto_c,
+                descuento_centavos=descuento_c,
+                orden=idx
+            ))
+        
+        # Los términos solo se reescriben si cambiaron
+        ClausulaService.reemplazar_terminos(db, cotizacion_id, terminos)
+        
+        ClienteService.actualizar_resumen(db, [cliente_anterior, cotizacion_data.cliente_id])
+        RevisionService.registrar(db, cotizacion_id, ultima_revision)
+        CambiosService.registrar(db, "cotizacion", cotizacion_id, "actualizar")
+        db.commit()
+        
+        return CotizacionService.obtener_por_id(db, cotizacion_id)
+    
+    @staticmethod
+    def cambiar_estado(db: Session, cotizacion_id: int, estado: str, version_esperada: int = None):
+        """Cambiar el estado de una cotización con un UPDATE condicional.
+
+        Acepta cualquier estado válido (corrección manual); solo el cambio en lote
+        de `cambiar_estados` exige las TRANSICIONES.
+        """
+        if estado not in ESTADOS_VALIDOS:
+            raise ValueError(f"Estado inválido. Debe ser uno de: {', '.join(ESTADOS_VALIDOS)}")
+        
+        resultado = db.execute(
+            update(Cotizacion)
+            .where(*CotizacionService._condicion_version(cotizacion_id, version_esperada))
+            .values(estado=estado, version=Cotizacion.version + 1)
+            .returning(Cotizacion.cliente_id)
+            .execution_options(synchronize_session=False)
+        )
+        cliente_id = resultado.scalar()
+        if cliente_id is None:
+            db.rollback()
+            CotizacionService._error_sin_filas(db, cotizacion_id)
+        
+        ClienteService.actualizar_resumen(db, [cliente_id])
+        CambiosService.registrar(db, "cotizacion", cotizacion_id, "estado")
+        db.commit()
+        
+        return CotizacionService.obtener_por_id(db, cotizacion_id)
+    
+    @staticmethod
+    def cambiar_estados(db: Session, cambios) -> dict:
+        """Aplicar muchos cambios de estado en una transacción, un UPDATE por estado destino.
+        
+        `cambios` son objetos con `cotizacion_id`, `estado` y `version` opcional.
+        Los que no se pueden aplicar no detienen al resto; se reportan en `errores`
+        con motivo no_encontrada, archivada, transicion_invalida o conflicto_version.
+        """
+        por_estado = {}
+        vistos = set()
+        for cambio in cambios:
+            if cambio.estado not in ESTADOS_VALIDOS:
+                raise ValueError(f"Estado inválido. Debe ser uno de: {', '.join(ESTADOS_VALIDOS)}")
+            if cambio.cotizacion_id in vistos:
+                raise ValueError(f"La cotización {cambio.cotizacion_id} aparece más de una vez")
+            vistos.add(cambio.cotizacion_id)
+            por_estado.setdefault(cambio.estado, []).append(cambio)
+        
+        actualizadas = {}
+        clientes = set()
+        for estado, grupo in por_estado.items():
+            sin_version = [c.cotizacion_id for c in grupo if c.version is None]
+            con_version = [(c.cotizacion_id, c.version) for c in grupo if c.version is not None]
+            condiciones = []
+            if sin_version:
+                condiciones.append(Cotizacion.id.in_(sin_version))
+            if con_version:
+                condiciones.append(tuple_(Cotizacion.id, Cotizacion.version).in_(con_version))
+            filas = db.execute(
+                update(Cotizacion)
+                .where(or_(*condiciones), Cotizacion.estado.in_(estados_de_origen(estado)))
+                .values(estado=estado, version=Cotizacion.version + 1)
+                .returning(Cotizacion.id, Cotizacion.cliente_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            if filas:
+                actualizadas[estado] = [i for i, _ in filas]
+                clientes.update(cliente_id for _, cliente_id in filas)
+        
+        aplicadas = [i for ids in actualizadas.values() for i in ids]
+        ClienteService.actualizar_resumen(db, clientes)
+        CambiosService.registrar_varios(db, "cotizacion", aplicadas, "estado")
+        db.commit()
+        
+        # Motivo de los que no se aplicaron, con una consulta por tabla
+        pendientes = {c.cotizacion_id: c for c in cambios}
+        for i in aplicadas:
+            del pendientes[i]
+        sin_cambios, errores = 0, []
+        if pendientes:
+            actuales = {
+                i: (estado, version) for i, estado, version in
+                db.query(Cotizacion.id, Cotizacion.estado, Cotizacion.version)
+                .filter(Cotizacion.id.in_(list(pendientes))).all()
+            }
+            archivadas = set(db.scalars(
+                select(ArchivoCotizacion.id).where(ArchivoCotizacion.id.in_(list(pendientes)))
+            ).all())
+            for i, cambio in pendientes.items():
+                if i not in actuales:
+                    motivo = "archivada" if i in archivadas else "no_encontrada"
+                elif cambio.version is not None and cambio.version != actuales[i][1]:
+                    motivo = "conflicto_version"
+                elif actuales[i][0] == cambio.estado:
+                    sin_cambios += 1
+                    continue
+                else:
+                    motivo = "transicion_invalida"
+                errores.append({"id": i, "motivo": motivo, "estado_actual": actuales.get(i, (None,))[0]})
+        
+        return {
+            "actualizadas": len(aplicadas),
+            "sin_cambios": sin_cambios,
+            "por_estado": {estado: len(ids) for estado, ids in actualizadas.items()},
+            "errores": errores,
+        }
+    
+    @staticmethod
+    def marcar_vencidas(db: Session, ahora: datetime = None) -> int:
+        """Pasar a 'vencida' todas las pendientes cuya fecha de vencimiento ya pasó.
+        
+        Es un único UPDATE por conjunto que usa el índice (estado, fecha_vencimiento).
+        """
+        ahora = ahora or datetime.now(timezone.utc)
+        ids = db.execute(
+            update(Cotizacion)
+            .where(Cotizacion.estado == "pendiente", Cotizacion.fecha_vencimiento < ahora)
+            .values(estado="vencida", version=Cotizacion.version + 1)
+            .returning(Cotizacion.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        # pendiente -> vencida no cambia el resumen de los clientes (solo suma lo aprobado)
+        CambiosService.registrar_varios(db, "cotizacion", ids, "estado")
+        db.commit()
+        return len(ids)
+    
+    @staticmethod
+    def _calcular_montos(cotizacion_data: CotizacionCreate, tipo: TipoCotizacion):
+        """Líneas en centavos y columnas de montos, con la tasa de ITBIS del tipo"""
+        lineas = [linea_en_centavos(item.monto, item.descuento) for item in cotizacion_data.items]
+        totales = calcular_totales(lineas, tipo.tasa_itbis_bp)
+        montos = {
+            "subtotal_centavos": totales.subtotal,
+            "descuento_centavos": totales.descuento,
+            "itbis_centavos": totales.itbis,
+            "total_centavos": totales.total,
+            "tasa_itbis_bp": tipo.tasa_itbis_bp,
+            "subtotal": a_monto(totales.subtotal),
+            "itbis": a_monto(totales.itbis),
+            "total": a_monto(totales.total),
+        }
+        return lineas, montos
+    
+    @staticmethod
+    def recalcular_totales(db: Session, tipo_id: int = None, estados: list = None) -> int:
+        """Re-totalizar en un solo UPDATE ... FROM todas las cotizaciones (o las de un tipo/estado).
+        
+        Las sumas por cotización se agregan en SQLite y el ITBIS se redondea con la
+        misma aritmética entera que `calcular_totales`. Solo se tocan las filas
+        cuyos totales cambian; a esas se les invalida el PDF y sube la versión.
+        """
+        agregados = (
+            select(
+                Cotizacion.id.label("id"),
+                func.coalesce(func.sum(ItemCotizacion.monto_centavos), 0).label("subtotal"),
+                func.coalesce(func.sum(ItemCotizacion.descuento_centavos), 0).label("descuento"),
+                TipoCotizacion.tasa_itbis_bp.label("tasa")
+            )
+            .join(TipoCotizacion, TipoCotizacion.id == Cotizacion.tipo_id)
+            .outerjoin(ItemCotizacion, ItemCotizacion.cotizacion_id == Cotizacion.id)
+            .group_by(Cotizacion.id)
+        )
+        if tipo_id is not None:
+            agregados = agregados.where(Cotizacion.tipo_id == tipo_id)
+        if estados:
+            agregados = agregados.where(Cotizacion.estado.in_(estados))
+        agregados = agregados.subquery()
+        
+        itbis = sql_calcular_itbis(agregados.c.subtotal - agregados.c.descuento, agregados.c.tasa)
+        total = agregados.c.subtotal - agregados.c.descuento + itbis
+        
+        resultado = db.execute(
+            update(Cotizacion)
+            .where(
+                Cotizacion.id == agregados.c.id,
+                (Cotizacion.subtotal_centavos != agregados.c.subtotal)
+                | (Cotizacion.descuento_centavos != agregados.c.descuento)
+                | (Cotizacion.tasa_itbis_bp != agregados.c.tasa)
+                | (Cotizacion.total_centavos != total)
+            )
+            .values(
+                subtotal_centavos=agregados.c.subtotal,
+                descuento_centavos=agregados.c.descuento,
+                itbis_centavos=itbis,
+                total_centavos=total,
+                tasa_itbis_bp=agregados.c.tasa,
+                subtotal=agregados.c.subtotal / 100.0,
+                itbis=itbis / 100.0,
+                total=total / 100.0,
+                pdf_path=None,
+                version=Cotizacion.version + 1
+            )
+            .returning(Cotizacion.id, Cotizacion.cliente_id)
+            .execution_options(synchronize_session=False)
+        )
+        filas = resultado.all()
+        ids = [i for i, _ in filas]
+        ClienteService.actualizar_resumen(db, {cliente_id for _, cliente_id in filas})
+        CambiosService.registrar_varios(db, "cotizacion", ids, "actualizar")
+        db.commit()
+        
+        return len(ids)
+    
+    @staticmethod
+    def _condicion_version(cotizacion_id: int, version_esperada: int = None):
+        """Condiciones del UPDATE: por ID y, si se indicó, por versión esperada"""
+        condiciones = [Cotizacion.id == cotizacion_id]
+        if version_esperada is not None:
+            condiciones.append(Cotizacion.version == version_esperada)
+        return condiciones
+    
+    @staticmethod
+    def _error_sin_filas(db: Session, cotizacion_id: int):
+        """Distinguir entre cotización inexistente y conflicto de versión"""
+        version_actual = db.query(Cotizacion.version).filter(Cotizacion.id == cotizacion_id).scalar()
+        if version_actual is None:
+            if db.query(ArchivoCotizacion.id).filter(ArchivoCotizacion.id == cotizacion_id).first():
+                raise ValueError("La cotización está archivada y no se puede modificar")
+            raise LookupError("Cotización no encontrada")
+        raise ConflictoVersionError(
+            f"La cotización fue modificada por otro usuario (versión actual: {version_actual})"
+        )
+    
+    @staticmethod
+    @medir_memoria("CotizacionService.generar_pdf_cotizacion")
+    def generar_pdf_cotizacion(db: Session, cotizacion_id: int, perfil: str = None):
+        """Generar PDF de una cotización existente (perfil: screen, print o archive)"""
         from services.pdf_generator_reportlab import generar_pdf_con_datos
         
-        # Obtener cotización completa
-        cotizacion = db.query(Cotizacion).filter(Cotizacion.id == cotizacion_id).first()
+        # Obtener cotización completa (también si está archivada)
+        cotizacion = CotizacionService.obtener_por_id(db, cotizacion_id)
         if not cotizacion:
             raise ValueError("Cotización no encontrada")
         
@@ -118,31 +449,103 @@ class CotizacionService:
                 "direccion": cotizacion.cliente.direccion or ""
             },
             "descripcion": cotizacion.descripcion or "",
-            "items": [{"alcance": item.alcance, "monto": item.monto} for item in cotizacion.items],
+            "items": [{"alcance": item.alcance, "monto": a_monto(item.monto_centavos)} for item in cotizacion.items],
             "terminos": [termino.texto for termino in cotizacion.terminos],
-            "subtotal": cotizacion.subtotal,
-            "itbis": cotizacion.itbis,
-            "total": cotizacion.total
+            "subtotal": a_monto(cotizacion.subtotal_centavos),
+            "descuento": a_monto(cotizacion.descuento_centavos),
+            "itbis": a_monto(cotizacion.itbis_centavos),
+            "tasa_itbis": formatear_tasa(cotizacion.tasa_itbis_bp),
+            "total": a_monto(cotizacion.total_centavos)
         }
         
         # Generar PDF
-        pdf_path = generar_pdf_con_datos(datos_pdf)
+        pdf_path = generar_pdf_con_datos(datos_pdf, perfil=perfil, marca=db.info.get("marca"))
         
-        # Actualizar ruta del PDF en la BD
-        cotizacion.pdf_path = pdf_path
-        db.commit()
+        # Guardar la ruta solo en las activas (las archivadas son de solo lectura) y
+        # solo si cambió: el nombre del archivo es fijo para la misma cotización,
+        # así que regenerar no es un cambio (ni sube la versión)
+        if isinstance(cotizacion, Cotizacion):
+            resultado = db.execute(
+                update(Cotizacion)
+                .where(Cotizacion.id == cotizacion_id, Cotizacion.pdf_path.is_distinct_from(pdf_path))
+                .values(pdf_path=pdf_path)
+                .execution_options(synchronize_session=False)
+            )
+            if resultado.rowcount:
+                CambiosService.registrar(db, "cotizacion", cotizacion_id, "pdf")
+                db.commit()
+                db.refresh(cotizacion)
         
         return pdf_path
     
     @staticmethod
+    @medir_memoria("CotizacionService.listar")
     def listar(db: Session, skip: int = 0, limit: int = 100):
         """Listar cotizaciones"""
         return db.query(Cotizacion).order_by(Cotizacion.fecha_emision.desc()).offset(skip).limit(limit).all()
     
     @staticmethod
     def obtener_por_id(db: Session, cotizacion_id: int):
-        """Obtener cotización por ID"""
-        return db.query(Cotizacion).filter(Cotizacion.id == cotizacion_id).first()
+        """Obtener cotización por ID; si no está en las tablas activas se busca en el archivo"""
+        return (
+            db.query(Cotizacion).filter(Cotizacion.id == cotizacion_id).first()
+            or db.query(ArchivoCotizacion).filter(ArchivoCotizacion.id == cotizacion_id).first()
+        )
+    
+    @staticmethod
+    @medir_memoria("CotizacionService.obtener_completa")
+    def obtener_completa(db: Session, cotizacion_id: int):
+        """Como obtener_por_id, pero con cliente, tipo, items y términos en 3 consultas fijas"""
+        for modelo in (Cotizacion, ArchivoCotizacion):
+            cotizacion = db.query(modelo).options(
+                joinedload(modelo.cliente),
+                joinedload(modelo.tipo),
+                selectinload(modelo.items),
+                selectinload(modelo.terminos)
+            ).filter(modelo.id == cotizacion_id).first()
+            if cotizacion:
+                return cotizacion
+        return None
+    
+    @staticmethod
+    def datos_editor(db: Session, cotizacion_id: int = None, versiones_cliente: dict = None) -> dict:
+        """Todo lo que necesita el editor de cotizaciones en una sola respuesta.
+        
+        Cada catálogo (clientes, tipos, cláusulas) lleva su versión; si el frontend
+        envía la misma versión que ya tiene, ese catálogo vuelve como None y usa su copia.
+        """
+        versiones_cliente = versiones_cliente or {}
+        versiones = CambiosService.versiones(db, ["cliente", "tipo", "clausula"])
+        
+        cotizacion = None
+        if cotizacion_id is not None:
+            cotizacion = CotizacionService.obtener_completa(db, cotizacion_id)
+            if cotizacion is None:
+                raise LookupError("Cotización no encontrada")
+        
+        def vigente(entidad):
+            return versiones_cliente.get(entidad) == versiones[entidad]
+        
+        return {
+            "cotizacion": cotizacion,
+            "clientes": None if vigente("cliente") else
+                db.query(Cliente).filter(Cliente.activo == True).order_by(Cliente.nombre).all(),
+            "tipos": None if vigente("tipo") else
+                db.query(TipoCotizacion).filter(TipoCotizacion.activo == True).order_by(TipoCotizacion.nombre).all(),
+            # Todas las activas: el frontend filtra por tipo si el usuario lo cambia
+            "clausulas": None if vigente("clausula") else
+                db.query(ClausulaTermino).filter(ClausulaTermino.activo == True).order_by(ClausulaTermino.id).all(),
+            "versiones": {"clientes": versiones["cliente"], "tipos": versiones["tipo"],
+                          "clausulas": versiones["clausula"]},
+        }
+    
+    @staticmethod
+    def obtener_por_numero(db: Session, numero: str):
+        """Obtener cotización por número (EST-1125-0001), activa o archivada"""
+        return (
+            db.query(Cotizacion).filter(Cotizacion.numero == numero).first()
+            or db.query(ArchivoCotizacion).filter(ArchivoCotizacion.numero == numero).first()
+        )
     
     @staticmethod
     def contar_total(db: Session) -> int:
@@ -164,8 +567,8 @@ class CotizacionService:
         """Monto total cotizado en el mes"""
         mes_actual = datetime.now().month
         anio_actual = datetime.now().year
-        resultado = db.query(func.sum(Cotizacion.total)).filter(
+        resultado = db.query(func.sum(Cotizacion.total_centavos)).filter(
             extract('month', Cotizacion.fecha_emision) == mes_actual,
             extract('year', Cotizacion.fecha_emision) == anio_actual
         ).scalar()
-        return resultado or 0.0
\ No newline at end of file
+        return a_monto(resultado or 0)
\ No newline at end of file
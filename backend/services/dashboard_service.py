@@ -0,0 +1,50 @@
+import threading
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from models import Cliente, Cotizacion
+from services.archivo_service import ArchivoService
+from services.cambios_service import CambiosService
+from services.cotizacion_service import CotizacionService
+
+class DashboardService:
+    """Agregados del dashboard, cacheados hasta que el registro de cambios avance"""
+
+    _lock = threading.Lock()
+    _cache = {}  # base de datos -> (token, mes, stats); una entrada por empresa
+
+    @staticmethod
+    def stats(db: Session) -> dict:
+        """Devolver los agregados; solo se recalculan si hubo cambios desde el último cálculo"""
+        token = CambiosService.token_actual(db)
+        mes = datetime.now().strftime("%Y-%m")
+        with DashboardService._lock:
+            cache = DashboardService._cache.get(DashboardService._clave(db))
+        if cache and cache[0] == token and cache[1] == mes:
+            return cache[2]
+        return DashboardService.refrescar(db, token)
+
+    @staticmethod
+    def refrescar(db: Session, token: int = None) -> dict:
+        """Recalcular los agregados y dejarlos en caché"""
+        if token is None:
+            token = CambiosService.token_actual(db)
+        por_estado = dict(
+            db.query(Cotizacion.estado, func.count(Cotizacion.id)).group_by(Cotizacion.estado).all()
+        )
+        archivadas = ArchivoService.contar(db)
+        stats = {
+            "total_clientes": db.query(Cliente).filter(Cliente.activo == True).count(),
+            "total_cotizaciones": sum(por_estado.values()) + archivadas,
+            "cotizaciones_archivadas": archivadas,
+            "cotizaciones_mes": CotizacionService.contar_mes_actual(db),
+            "monto_total_mes": CotizacionService.monto_total_mes(db),
+            "por_estado": por_estado,
+        }
+        with DashboardService._lock:
+            DashboardService._cache[DashboardService._clave(db)] = (token, datetime.now().strftime("%Y-%m"), stats)
+        return stats
+
+    @staticmethod
+    def _clave(db: Session) -> str:
+        return str(db.get_bind().url)
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert
+from models import ClaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+# ==============================================
+# IDEMPOTENCY-KEY
+# ==============================================
+# La primera petición con una clave la reclama (fila sin estado_http, con un
+# token de dueño) y, al terminar, guarda su respuesta; guardar y soltar solo
+# tocan la fila si el reclamo sigue siendo suyo. Los reintentos con la misma clave
+# reciben esa respuesta sin ejecutar el endpoint. Una clave reclamada por una
+# ejecución que nunca terminó (proceso caído) vuelve a estar libre después de
+# IDEMPOTENCIA_RECLAMO_S, mucho más que lo que un reintento espera
+# (IDEMPOTENCIA_ESPERA_S) para no ejecutar dos veces una petición lenta. Las
+# respuestas guardadas duran IDEMPOTENCIA_TTL_HORAS.
+# De la respuesta se guarda solo el estado, el Content-Type y el cuerpo: los
+# encabezados de framing (Content-Length, ETag y Vary de la compresión) los
+# vuelve a poner el resto de la pila al repetirla.
+
+IDEMPOTENCIA_TTL_HORAS = float(os.getenv("IDEMPOTENCIA_TTL_HORAS", "24"))
+IDEMPOTENCIA_ESPERA_S = float(os.getenv("IDEMPOTENCIA_ESPERA_S", "30"))     # Lo que espera un duplicado (409 después)
+IDEMPOTENCIA_RECLAMO_S = float(os.getenv("IDEMPOTENCIA_RECLAMO_S", "600"))  # Vigencia del reclamo de una ejecución
+IDEMPOTENCIA_MAX_BYTES = int(os.getenv("IDEMPOTENCIA_MAX_KB", "1024")) * 1024  # Cuerpo de la petición (413 si se pasa)
+
+
+def huella(metodo: str, ruta: str, cuerpo: bytes) -> str:
+    """Identifica la petición: la misma clave con otro cuerpo es un error del cliente"""
+    return hashlib.sha256(metodo.encode() + b" " + ruta.encode() + b"\n" + cuerpo).hexdigest()
+
+
+class IdempotenciaService:
+
+    @staticmethod
+    def nuevo_dueno() -> str:
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def reclamar(db: Session, clave: str, huella_peticion: str, dueno: str) -> Tuple[str, Optional[ClaveIdempotencia]]:
+        """Intentar quedarse con la clave a nombre de `dueno`.
+
+        Devuelve ("nueva", None) si esta ejecución es la primera (o la clave había
+        vencido), ("repetida", fila) con la respuesta guardada, ("en_curso", None)
+        si otra ejecución la tiene y ("distinta", None) si se usó con otra petición.
+        """
+        ahora = datetime.now(timezone.utc)
+        expira = ahora + timedelta(seconds=IDEMPOTENCIA_RECLAMO_S)
+        reclamada = db.execute(
+            insert(ClaveIdempotencia)
+            .values(clave=clave, huella=huella_peticion, dueno=dueno, expira=expira)
+            .on_conflict_do_update(
+                index_elements=[ClaveIdempotencia.clave],
+                set_={"huella": huella_peticion, "dueno": dueno, "estado_http": None,
+                      "tipo_contenido": None, "cuerpo": None, "expira": expira},
+                where=ClaveIdempotencia.expira < ahora
+            )
+            .returning(ClaveIdempotencia.clave)
+        ).scalar()
+        db.commit()
+        if reclamada is not None:
+            return "nueva", None
+
+        fila = db.query(ClaveIdempotencia).filter(ClaveIdempotencia.clave == clave).first()
+        if fila is None:
+            # Se liberó entre el INSERT y la consulta: que el cliente reintente
+            return "en_curso", None
+        if fila.huella != huella_peticion:
+            return "distinta", None
+        if fila.estado_http is None:
+            return "en_curso", None
+        return "repetida", fila
+
+    @staticmethod
+    def guardar(db: Session, clave: str, dueno: str, estado_http: int, tipo_contenido: Optional[str], cuerpo: bytes) -> bool:
+        """Guardar la respuesta si el reclamo sigue siendo de `dueno`; False si venció y otro lo tomó"""
+        guardada = db.execute(
+            update(ClaveIdempotencia)
+            .where(ClaveIdempotencia.clave == clave, ClaveIdempotencia.dueno == dueno,
+                   ClaveIdempotencia.estado_http.is_(None))
+            .values(
+                estado_http=estado_http,
+                tipo_contenido=tipo_contenido,
+                cuerpo=cuerpo,
+                expira=datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCIA_TTL_HORAS)
+            )
+        ).rowcount
+        db.commit()
+        if not guardada:
+            logger.warning("Idempotency-Key %s: el reclamo venció antes de guardar la respuesta", clave)
+        return bool(guardada)
+
+    @staticmethod
+    def soltar(db: Session, clave: str, dueno: str):
+        """Liberar la clave sin respuesta (error del servidor): el reintento vuelve a ejecutar"""
+        db.execute(delete(ClaveIdempotencia).where(
+            ClaveIdempotencia.clave == clave, ClaveIdempotencia.dueno == dueno,
+            ClaveIdempotencia.estado_http.is_(None)
+        ))
+        db.commit()
+
+    @staticmethod
+    def purgar(db: Session) -> int:
+        """Borrar las claves vencidas"""
+        resultado = db.execute(delete(ClaveIdempotencia).where(ClaveIdempotencia.expira < datetime.now(timezone.utc)))
+        db.commit()
+        return resultado.rowcount
@@ -0,0 +1,97 @@
+import os
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+from PIL import Image
+
+# ==============================================
+# PERFILES DE SALIDA Y PIPELINE DE IMÁGENES
+# ==============================================
+# Cada perfil define la resolución a la que se remuestrean las imágenes según el
+# tamaño con que se imprimen en la página, la calidad JPEG y la compresión de
+# los streams de página. pdf_plantilla cachea el resultado de cada
+# (imagen, caja, perfil), así que el remuestreo corre una sola vez por proceso.
+#
+# screen reduce las imágenes a 110 DPI y comprime todo: es el más liviano para
+# correo y pantalla. print limita las imágenes a 300 DPI (una marca con un
+# membrete enorme no infla cada PDF) y deja los streams de página sin comprimir:
+# algunos RIP y herramientas de preflight de imprenta los leen mejor así.
+# archive guarda las imágenes originales, comprime y genera un PDF invariante
+# (sin fecha ni ID aleatorio), así la misma cotización da siempre los mismos bytes.
+
+
+@dataclass(frozen=True)
+class PerfilPDF:
+    nombre: str
+    dpi: Optional[int]            # None = imágenes originales, sin remuestrear
+    calidad_jpeg: Optional[int]   # Calidad al re-codificar una imagen remuestreada
+    compresion_paginas: int       # pageCompression de ReportLab (0/1)
+    invariante: bool = False      # invariant de ReportLab: mismos datos, mismos bytes
+
+
+PERFILES = {
+    "screen": PerfilPDF("screen", dpi=110, calidad_jpeg=60, compresion_paginas=1),
+    "print": PerfilPDF("print", dpi=300, calidad_jpeg=85, compresion_paginas=0),
+    "archive": PerfilPDF("archive", dpi=None, calidad_jpeg=None, compresion_paginas=1, invariante=True),
+}
+PERFIL_POR_DEFECTO = os.getenv("PDF_PERFIL", "print")
+
+
+def obtener_perfil(nombre: Optional[str] = None) -> PerfilPDF:
+    nombre = nombre or PERFIL_POR_DEFECTO
+    if nombre not in PERFILES:
+        raise ValueError(f"Perfil de PDF inválido: {nombre}. Opciones: {', '.join(PERFILES)}")
+    return PERFILES[nombre]
+
+
+def jpeg_para_caja(ruta: str, ancho_pt: float, alto_pt: float, perfil: PerfilPDF) -> bytes:
+    """Bytes de la imagen al tamaño impreso en la caja (pt) y a la resolución del perfil"""
+    with open(ruta, "rb") as f:
+        original = f.read()
+    if perfil.dpi is None:
+        return original
+
+    with Image.open(BytesIO(original)) as imagen:
+        if imagen.format != "JPEG":
+            # Solo se re-codifican JPEG (una PNG perdería su transparencia)
+            return original
+
+        # Tamaño impreso real: la imagen se ajusta a la caja conservando su proporción
+        escala = min(ancho_pt / imagen.width, alto_pt / imagen.height)
+        ancho_px = max(1, round(imagen.width * escala / 72 * perfil.dpi))
+        alto_px = max(1, round(imagen.height * escala / 72 * perfil.dpi))
+        if ancho_px >= imagen.width:
+            # Nunca se agranda: la original ya está por debajo de la resolución del perfil
+            return original
+
+        reducida = imagen.convert("RGB").resize((ancho_px, alto_px), Image.LANCZOS)
+        salida = BytesIO()
+        reducida.save(salida, "JPEG", quality=perfil.calidad_jpeg, optimize=True)
+        return salida.getvalue()
+
+
+# ==============================================
+# MARCA (MEMBRETE, SELLOS Y DATOS DE PAGO POR EMPRESA)
+# ==============================================
+# Todo lo que cambia de una empresa a otra en el PDF. Es inmutable y hashable:
+# los cachés de render (formas, bloque de pago) se separan por marca.
+
+@dataclass(frozen=True)
+class Marca:
+    codigo: str
+    carpeta_pdf: str = "Cotizaciones"
+    cabecera: str = "static/shizzoHeader.jpeg"
+    logo_mini: str = "static/shizzologomini.jpeg"
+    sello: str = "static/shizzosello.jpeg"
+    firma: str = "static/firmaDigitalJulioMundarai.jpeg"
+    direccion: str = "C/ Huáscar Tejeda #9, Higüey, La Altagracia, República Dominicana"
+    pago: tuple = (
+        "<b>Moneda:</b> Peso Dominicano",
+        "<b>Método de pago:</b> Transferencia bancaria",
+        "Banco BHD: 38770920010 – SHIZZO GROUP",
+        "Banco Popular: 835902214 – Daniel A. Saladin",
+        "Banreservas: 9603583795 – Julio Leonardo Mundaray",
+    )
+
+
+MARCA_POR_DEFECTO = Marca(codigo="shizzo")
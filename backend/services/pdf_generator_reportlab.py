@@ -1,14 +1,22 @@
+import logging
 import os
+import threading
+from collections import OrderedDict
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Flowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT, TA_JUSTIFY
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from services.pdf_plantilla import dibujar_imagen, usar_forma, definir_forma, streams_binarios
+from services.pdf_incremental import DocumentoIncremental
+from services.pdf_assets import obtener_perfil, MARCA_POR_DEFECTO
+from perfilado import medir_memoria
 
+logger = logging.getLogger(__name__)
 
 
 def registrar_fuentes_century_gothic():
@@ -27,7 +35,7 @@ registrar_fuentes_century_gothic()
 # ==============================================
 # 2. CONFIGURACIÓN GENERAL
 # ==============================================
-CARPETA_POR_DEFECTO = "Cotizaciones"
+CARPETA_POR_DEFECTO = MARCA_POR_DEFECTO.carpeta_pdf
 os.makedirs(CARPETA_POR_DEFECTO, exist_ok=True)
 
 COLOR_PRIMARIO = colors.HexColor("#141414")
@@ -35,12 +43,17 @@ COLOR_AMARILLO = colors.HexColor("#db901f")
 COLOR_GRIS = colors.HexColor("#515151")
 COLOR_GRIS_CLARO = colors.HexColor('#f8f8f8')
 
+# Desde cuántos items se usa el modo de documento grande (tabla por página y
+# páginas que se cierran al terminarlas, ver TablaItemsPorPagina y CanvasContinuo)
+PDF_ITEMS_GRANDE = int(os.getenv("PDF_ITEMS_GRANDE", "200"))
+
 # ==============================================
 # 3. FOOTER PERSONALIZADO (con Century Gothic)
 # ==============================================
 class FooterCanvas(canvas.Canvas):
     def __init__(self, *args, **kwargs):
-        self.total_paginas = kwargs.pop('total_paginas', 1)
+        self.perfil = kwargs.pop('perfil', None)
+        self.marca = kwargs.pop('marca', MARCA_POR_DEFECTO)
         canvas.Canvas.__init__(self, *args, **kwargs)
         self.pages = []
 
@@ -55,84 +68,219 @@ class FooterCanvas(canvas.Canvas):
             es_ultima = (i == num_pages - 1)
             self.draw_footer(i + 1, num_pages, es_ultima)
             canvas.Canvas.showPage(self)
+        streams_binarios(self._doc)
         canvas.Canvas.save(self)
 
     def draw_footer(self, page_num, total_pages, es_ultima_pagina):
         self.saveState()
 
-        # Imágenes del footer
-        logo_mini_x = 10*mm
-        logo_mini_y = 20*mm
-        logo_mini_w = 20*mm
-        logo_mini_h = 20*mm
-
-        sello_w = 50*mm
-        sello_h = 50*mm
+        # Partes fijas: se dibujan una vez por documento como Form XObject.
+        # Sello y firma van primero para que las barras queden por encima.
         if es_ultima_pagina:
-            sello_x = A4[0] - 70*mm
-            sello_y = 20*mm
+            usar_forma(self, "SelloFirma", lambda c: _dibujar_sello_firma(c, self.marca))
         else:
-            sello_x = A4[0]/2 - 26.5*mm
-            sello_y = 15*mm
+            usar_forma(self, "SelloCentro", lambda c: _dibujar_sello_centro(c, self.marca))
+        usar_forma(self, "PiePagina", lambda c: _dibujar_pie(c, self.marca))
 
-        firma_x = A4[0]/2 - 60*mm
-        firma_y = 5*mm
-        firma_w = 120*mm
-        firma_h = 50*mm
+        # Lo único variable del pie: el número de página
+        _dibujar_numero(self, page_num, total_pages)
+
+        self.restoreState()
 
-        try:
-            logo_path = os.path.abspath('static/shizzologomini.jpeg')
-            if os.path.exists(logo_path):
-                self.drawImage(logo_path, logo_mini_x, logo_mini_y, width=logo_mini_w, height=logo_mini_h,
-                               preserveAspectRatio=True, mask='auto')
-
-            if es_ultima_pagina:
-                firma_path = os.path.abspath('static/firmaDigitalJulioMundarai.jpeg')
-                if os.path.exists(firma_path):
-                    self.drawImage(firma_path, firma_x, firma_y, width=firma_w, height=firma_h,
-                                   preserveAspectRatio=True, mask='auto')
-
-            sello_path = os.path.abspath('static/shizzosello.jpeg')
-            if os.path.exists(sello_path):
-                self.drawImage(sello_path, sello_x, sello_y, width=sello_w, height=sello_h,
-                               preserveAspectRatio=True, mask='auto')
-        except Exception as e:
-            print(f"Error cargando imágenes del footer: {e}")
-
-        # Barra negra + texto con Century Gothic
-        self.setFillColor(COLOR_PRIMARIO)
-        self.rect(0, 0, A4[0], 15*mm, fill=True, stroke=False)
-        self.setFillColor(COLOR_AMARILLO)
-        self.rect(0, 15*mm, A4[0], 1.5*mm, fill=True, stroke=False)
-        self.setFillColor(colors.white)
-        
 
-        self.setFont("CenturyGothic", 9)  # ¡Aquí usamos Century Gothic!
+class CanvasContinuo(FooterCanvas):
+    """FooterCanvas para documentos grandes: cada página se escribe al archivo al terminarla.
 
-        self.drawString(15*mm, 7*mm, "C/ Huáscar Tejeda #9, Higüey, La Altagracia, República Dominicana")
-        self.drawRightString(A4[0] - 15*mm, 7*mm, f"Página {page_num} / {total_pages}")
+    FooterCanvas guarda todas las páginas abiertas hasta el final para conocer el
+    total. Aquí las partes fijas del pie se definen al empezar y cada página se
+    vuelca con DocumentoIncremental en cuanto se cierra; solo el sello (el de la
+    última página lleva firma) y el número "n / N" son formas reservadas que se
+    definen al guardar, cuando el total ya se sabe.
+    """
 
+    def __init__(self, *args, **kwargs):
+        FooterCanvas.__init__(self, *args, **kwargs)
+        self.paginas = 0
+        DocumentoIncremental.para_canvas(self)
+        definir_forma(self, "PiePagina", lambda c: _dibujar_pie(c, self.marca))
+        definir_forma(self, "SelloFirma", lambda c: _dibujar_sello_firma(c, self.marca))
+        definir_forma(self, "SelloCentro", lambda c: _dibujar_sello_centro(c, self.marca))
+
+    def showPage(self):
+        self.paginas += 1
+        self._doc.reservar_forma(f"Sello{self.paginas}")
+        self._doc.reservar_forma(f"Numero{self.paginas}")
+        self.saveState()
+        self.doForm(f"Sello{self.paginas}")
+        self.doForm("PiePagina")
+        self.doForm(f"Numero{self.paginas}")
         self.restoreState()
+        canvas.Canvas.showPage(self)
+        self._doc.volcar()
+
+    def save(self):
+        total = self.paginas
+        for numero in range(1, total + 1):
+            self.beginForm(f"Sello{numero}")
+            self.doForm("SelloFirma" if numero == total else "SelloCentro")
+            self.endForm()
+            self.beginForm(f"Numero{numero}")
+            _dibujar_numero(self, numero, total)
+            self.endForm()
+        canvas.Canvas.save(self)
+
+
+def _dibujar_numero(c, page_num, total_pages):
+    c.setFillColor(colors.white)
+    c.setFont("CenturyGothic", 9)  # ¡Aquí usamos Century Gothic!
+    c.drawRightString(A4[0] - 15*mm, 7*mm, f"Página {page_num} / {total_pages}")
+
+
+def _dibujar_pie(c, marca):
+    # Logo mini
+    dibujar_imagen(c, os.path.abspath(marca.logo_mini), 10*mm, 20*mm, 20*mm, 20*mm)
+
+    # Barra negra + barra amarilla + dirección con Century Gothic
+    c.setFillColor(COLOR_PRIMARIO)
+    c.rect(0, 0, A4[0], 15*mm, fill=True, stroke=False)
+    c.setFillColor(COLOR_AMARILLO)
+    c.rect(0, 15*mm, A4[0], 1.5*mm, fill=True, stroke=False)
+    c.setFillColor(colors.white)
+    c.setFont("CenturyGothic", 9)
+    c.drawString(15*mm, 7*mm, marca.direccion)
+
+
+def _dibujar_sello_centro(c, marca):
+    dibujar_imagen(c, os.path.abspath(marca.sello), A4[0]/2 - 26.5*mm, 15*mm, 50*mm, 50*mm)
+
+
+def _dibujar_sello_firma(c, marca):
+    # Última página: firma centrada y sello a la derecha
+    dibujar_imagen(c, os.path.abspath(marca.firma), A4[0]/2 - 60*mm, 5*mm, 120*mm, 50*mm)
+    dibujar_imagen(c, os.path.abspath(marca.sello), A4[0] - 70*mm, 20*mm, 50*mm, 50*mm)
+
+
+def _dibujar_cabecera(c, marca):
+    header_height = 37 * mm
+    dibujar_imagen(c, os.path.abspath(marca.cabecera), 0, A4[1] - header_height + 1*mm,
+                   A4[0], header_height)
 
 
 # ==============================================
 # 4. GENERADOR DEL PDF (todo con Century Gothic)
 # ==============================================
+# Flowables fijos (bloque de pago, términos repetidos) ya maquetados.
+# Son por hilo porque ReportLab guarda el estado de maquetación en el flowable.
+_flowables_hilo = threading.local()
+MAX_TERMINOS_CACHEADOS = 256  # Párrafos de términos, no juegos completos
+
+
+class ParrafoEstatico(Paragraph):
+    """Paragraph que reutiliza su maquetación mientras el ancho disponible no cambie"""
+    def wrap(self, availWidth, availHeight):
+        if getattr(self, '_ancho_maquetado', None) != availWidth:
+            Paragraph.wrap(self, availWidth, availHeight)
+            self._ancho_maquetado = availWidth
+        return self.width, self.height
+
+
+ANCHOS_ITEMS = [140*mm, 45*mm]
+
+
+class TablaItemsPorPagina(Flowable):
+    """Tabla de items que se arma página por página (modo de documento grande).
+
+    Una sola Table con miles de filas se mide completa y se vuelve a partir en
+    cada página, así que el tiempo crece más que linealmente. Esta solo crea los
+    Paragraph y la Table de las filas que caben en el espacio disponible; el resto
+    queda como otra TablaItemsPorPagina para la página siguiente, con el
+    encabezado repetido. En memoria hay a lo sumo una página de filas.
+    """
+
+    def __init__(self, generador, items, desde=0):
+        Flowable.__init__(self)
+        self.generador = generador
+        self.items = items
+        self.desde = desde
+        self._armada = None  # (ancho, alto, tabla, fin)
+
+    def _armar(self, ancho, alto):
+        if self._armada is not None and self._armada[:2] == (ancho, alto):
+            return self._armada[2:]
+
+        generador = self.generador
+        encabezado = generador._encabezado_items()
+        filas, usado, fin = [], 0, self.desde
+        alto_encabezado = max(p.wrap(a - 12, alto)[1] for p, a in zip(encabezado, ANCHOS_ITEMS)) + 16
+        # Estimación con los paddings del estilo (3 + 3 por fila); la Table confirma abajo
+        while fin < len(self.items):
+            fila = generador._fila_item(self.items[fin])
+            alto_fila = max(p.wrap(a - 12, alto)[1] for p, a in zip(fila, ANCHOS_ITEMS)) + 6
+            if alto_encabezado + usado + alto_fila > alto:
+                # Sin filas todavía: a la página siguiente, salvo que esta ya esté vacía
+                # (una fila más alta que la página se deja partir a la Table)
+                if filas or alto < generador.alto_marco * 0.9:
+                    break
+            filas.append(fila)
+            usado += alto_fila
+            fin += 1
+
+        tabla = None
+        while filas:
+            tabla = Table([encabezado] + filas, colWidths=ANCHOS_ITEMS, repeatRows=1, splitInRow=1)
+            tabla.setStyle(generador._estilo_items())
+            if tabla.wrap(ancho, alto)[1] <= alto or len(filas) == 1:
+                break
+            filas.pop()
+            fin -= 1
+        if not filas:
+            tabla = None
+        self._armada = (ancho, alto, tabla, fin)
+        return tabla, fin
+
+    def wrap(self, availWidth, availHeight):
+        tabla, fin = self._armar(availWidth, availHeight)
+        if tabla is None or fin < len(self.items):
+            return availWidth, availHeight + 1  # No cabe entera: el marco llama a split
+        self.width, self.height = tabla.wrap(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        tabla, fin = self._armar(availWidth, availHeight)
+        if tabla is None:
+            return []
+        partes = [tabla]
+        if tabla.wrap(availWidth, availHeight)[1] > availHeight:
+            # Una sola fila más alta que la página: la Table la parte por dentro
+            partes = tabla.split(availWidth, availHeight)
+        if fin < len(self.items):
+            partes.append(TablaItemsPorPagina(self.generador, self.items, fin))
+        return partes
+
+    def draw(self):
+        self._armada[2].drawOn(self.canv, 0, 0)
+
+
 class PDFGenerator:
-    def __init__(self, datos):
+    _estilos = None  # Hoja de estilos compartida: se construye una sola vez
+
+    def __init__(self, datos, perfil=None, marca=None):
         self.datos = datos
+        self.perfil = obtener_perfil(perfil)
+        self.marca = marca or MARCA_POR_DEFECTO
         self.width, self.height = A4
+        self.alto_marco = self.height - 80*mm  # Márgenes superior e inferior de 40 mm (ver generar)
         self.story = []
-        self.styles = getSampleStyleSheet()
-        self._setup_styles()
+        if PDFGenerator._estilos is None:
+            self.styles = getSampleStyleSheet()
+            self._setup_styles()
+            PDFGenerator._estilos = self.styles
+        self.styles = PDFGenerator._estilos
 
     def _header(self, canvas, doc):
-        logo_path = os.path.abspath('static/shizzoHeader.jpeg')
-        if os.path.exists(logo_path):
-            header_height = 37 * mm
-            canvas.drawImage(logo_path, 0, A4[1] - header_height + 1*mm,
-                             width=A4[0], height=header_height,
-                             preserveAspectRatio=True, mask='auto')
+        canvas.saveState()
+        usar_forma(canvas, "Cabecera", lambda c: _dibujar_cabecera(c, self.marca))
+        canvas.restoreState()
 
     def _setup_styles(self):
         # Todos los estilos con Century Gothic
@@ -224,8 +372,6 @@ class PDFGenerator:
             cliente = self.datos['cliente']
 
             tit_cliente = Paragraph("<b>INFORMACIÓN DEL SOLICITANTE</b>", self.styles['SubtituloCliente'])
-            tit_pago = Paragraph("<b>INFORMACIÓN DE PAGO</b>", self.styles['SubtituloPago'])
-           
             
 
             data_cliente = [
@@ -238,24 +384,29 @@ class PDFGenerator:
                 [Paragraph(f"<b>Dirección:</b> {cliente.get('direccion', 'N/A')}", self.styles['TextoCliente'])]
             ]
 
-            data_pago = [
-                [tit_pago],
-                [Spacer(1, 2*mm)], # Espacio de 2mm (del paso anterior)
-                [Paragraph("<b>Moneda:</b> Peso Dominicano", self.styles['TextoPago'])],
-                [Paragraph("<b>Método de pago:</b> Transferencia bancaria", self.styles['TextoPago'])],
-                [Paragraph("Banco BHD: 38770920010 – SHIZZO GROUP", self.styles['TextoPago'])],
-                [Paragraph("Banco Popular: 835902214 – Daniel A. Saladin", self.styles['TextoPago'])],
-                [Paragraph("Banreservas: 9603583795 – Julio Leonardo Mundaray", self.styles['TextoPago'])]
-            ]
-
             t_cliente = Table(data_cliente, colWidths=[95*mm])
-            t_pago = Table(data_pago, colWidths=[84*mm])
+            t_pago = self._tabla_pago()
             
 
             tabla_doble = Table([[t_cliente, t_pago]], colWidths=[105*mm, 89*mm])
             self.story.append(tabla_doble)
             self.story.append(Spacer(1, 8*mm))
 
+    def _tabla_pago(self):
+        # Bloque fijo de cada marca: se arma y maqueta una vez por hilo
+        tablas = getattr(_flowables_hilo, 'tablas_pago', None)
+        if tablas is None:
+            tablas = _flowables_hilo.tablas_pago = {}
+        tabla = tablas.get(self.marca)
+        if tabla is None:
+            data_pago = [
+                [ParrafoEstatico("<b>INFORMACIÓN DE PAGO</b>", self.styles['SubtituloPago'])],
+                [Spacer(1, 2*mm)], # Espacio de 2mm (del paso anterior)
+            ]
+            data_pago += [[ParrafoEstatico(linea, self.styles['TextoPago'])] for linea in self.marca.pago]
+            tabla = tablas[self.marca] = Table(data_pago, colWidths=[84*mm])
+        return tabla
+
     def _add_descripcion(self):
         if self.datos.get('descripcion'):
             self.story.append(Paragraph("<b>DESCRIPCIÓN</b>", self.styles['Subtitulo']))
@@ -264,15 +415,26 @@ class PDFGenerator:
             self.story.append(Spacer(1, 4*mm))
 
     def _add_tabla_items(self):
-        data = [[Paragraph("<b>ALCANCE</b>", self.styles['HeaderTable']),
-                 Paragraph("<b>MONTO (DOP)</b>", self.styles['HeaderTable'])]]
+        items = self.datos.get('items', [])
+        if len(items) >= PDF_ITEMS_GRANDE:
+            self.story.append(TablaItemsPorPagina(self, items))
+        else:
+            tabla = Table([self._encabezado_items()] + [self._fila_item(item) for item in items],
+                          colWidths=ANCHOS_ITEMS)
+            tabla.setStyle(self._estilo_items())
+            self.story.append(tabla)
+        self.story.append(Spacer(1, 10*mm))
+
+    def _encabezado_items(self):
+        return [Paragraph("<b>ALCANCE</b>", self.styles['HeaderTable']),
+                Paragraph("<b>MONTO (DOP)</b>", self.styles['HeaderTable'])]
 
-        for item in self.datos.get('items', []):
-            data.append([Paragraph(item['alcance'], self.styles['TextoNormal']),
-                        Paragraph(f"DOP {item['monto']:,.2f}", self.styles['TextoNormal'])])
+    def _fila_item(self, item):
+        return [Paragraph(item['alcance'], self.styles['TextoNormal']),
+                Paragraph(f"DOP {item['monto']:,.2f}", self.styles['TextoNormal'])]
 
-        tabla = Table(data, colWidths=[140*mm, 45*mm])
-        tabla.setStyle(TableStyle([
+    def _estilo_items(self):
+        return TableStyle([
             # Estilos para el encabezado (Fila 0):
             ('BACKGROUND', (0,0), (-1,0), COLOR_GRIS_CLARO),
             ('TEXTCOLOR', (0,0), (-1,0), COLOR_PRIMARIO),
@@ -285,13 +447,13 @@ class PDFGenerator:
             ('VALIGN', (0,0), (-1,-1), 'TOP'),
             ('LEFTPADDING', (0,0), (-1,-1), 6),
             ('RIGHTPADDING', (0,0), (-1,-1), 6),
-        ]))
-        self.story.append(tabla)
-        self.story.append(Spacer(1, 10*mm))
+        ])
 
     def _add_totales(self):
             subtotal = self.datos.get('subtotal', 0)
+            descuento = self.datos.get('descuento', 0)
             itbis = self.datos.get('itbis', 0)
+            tasa_itbis = self.datos.get('tasa_itbis', '18')
             total = self.datos.get('total', 0)
 
             # Los estilos de alineación se pueden definir en los ParagraphStyle, pero usaremos el TableStyle
@@ -306,13 +468,18 @@ class PDFGenerator:
                 [Paragraph('SUBTOTAL', estilo_normal), 
                 Paragraph(f"DOP {subtotal:,.2f}", estilo_normal)], # <-- Volvemos a incluir 'DOP'
                 
-                [Paragraph('ITBIS (18%)', estilo_normal), 
+                [Paragraph(f'ITBIS ({tasa_itbis}%)', estilo_normal), 
                 Paragraph(f"DOP {itbis:,.2f}", estilo_normal)], # <-- Volvemos a incluir 'DOP'
                 
                 [Paragraph('<b>TOTAL</b>', estilo_bold), 
                 Paragraph(f"<b>DOP {total:,.2f}</b>", estilo_bold)], # <-- Volvemos a incluir 'DOP'
             ]
             
+            # Descuentos por item: solo se muestran si existen
+            if descuento:
+                data.insert(1, [Paragraph('DESCUENTO', estilo_normal),
+                                Paragraph(f"- DOP {descuento:,.2f}", estilo_normal)])
+            
             # Ancho para 2 columnas (ejemplo: 50mm + 50mm = 100mm)
             # Queremos que la columna de monto (Col 1) sea dinámica pero la de etiqueta (Col 0) sea fija.
             # Ajustamos los anchos:
@@ -342,10 +509,32 @@ class PDFGenerator:
         self.story.append(PageBreak())
         self.story.append(Paragraph("<b>TÉRMINOS Y CONDICIONES</b>", self.styles['Subtitulo']))
         self.story.append(Spacer(1, 8*mm))
-        for i, t in enumerate(self.datos['terminos'], 1):
-            self.story.append(Paragraph(f"<b>{i}.</b> {t}", self.styles['Termino']))
-            self.story.append(Spacer(1, 3*mm))
-
+        self.story.extend(self._parrafos_terminos(self.datos['terminos']))
+
+    def _parrafos_terminos(self, terminos):
+        # Las cotizaciones comparten cláusulas del catálogo: LRU por hilo de cada
+        # párrafo ya maquetado, por (número, texto)
+        cache = getattr(_flowables_hilo, 'terminos', None)
+        if cache is None:
+            cache = _flowables_hilo.terminos = OrderedDict()
+
+        parrafos = []
+        for i, t in enumerate(terminos, 1):
+            clave = (i, t)
+            parrafo = cache.get(clave)
+            if parrafo is None:
+                # Los saltos de línea del texto se respetan (Paragraph los trataría como espacios)
+                texto = t.replace("\n", "<br/>")
+                parrafo = cache[clave] = ParrafoEstatico(f"<b>{i}.</b> {texto}", self.styles['Termino'])
+                if len(cache) > MAX_TERMINOS_CACHEADOS:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(clave)
+            parrafos.append(parrafo)
+            parrafos.append(Spacer(1, 3*mm))
+        return parrafos
+
+    @medir_memoria("PDFGenerator.generar")
     def generar(self, ruta_salida=None):
         if ruta_salida:
             ruta_final = ruta_salida
@@ -354,12 +543,10 @@ class PDFGenerator:
             cliente = "".join(c for c in self.datos['cliente']['nombre'] if c.isalnum() or c in " -_").strip()
             fecha = self.datos['fecha_emision'].replace("/", "-")
             nombre = f"COT-{self.datos['numero']} {cliente} {fecha}.pdf"
-            ruta_final = os.path.join(CARPETA_POR_DEFECTO, nombre)
+            os.makedirs(self.marca.carpeta_pdf, exist_ok=True)
+            ruta_final = os.path.join(self.marca.carpeta_pdf, nombre)
 
-        # Estimación de páginas (para el footer)
         items = len(self.datos.get('items', []))
-        terminos = 1 if self.datos.get('terminos') else 0
-        total_paginas = max(1, (items // 9) + 1) + terminos
 
         doc = SimpleDocTemplate(
             ruta_final,
@@ -367,7 +554,9 @@ class PDFGenerator:
             topMargin=40*mm,
             bottomMargin=40*mm,
             leftMargin=10*mm,
-            rightMargin=10*mm
+            rightMargin=10*mm,
+            pageCompression=self.perfil.compresion_paginas,
+            invariant=int(self.perfil.invariante)
         )
 
         self._add_info_cotizacion()
@@ -377,20 +566,30 @@ class PDFGenerator:
         self._add_totales()
         self._add_terminos()
 
-        doc.build(
-            self.story,
-            onFirstPage=self._header,
-            onLaterPages=self._header,
-            canvasmaker=lambda *a, **k: FooterCanvas(*a, total_paginas=total_paginas, **k)
-        )
+        clase_canvas = CanvasContinuo if items >= PDF_ITEMS_GRANDE else FooterCanvas
+        canvases = []
 
-        print(f"PDF generado con Century Gothic → {ruta_final}")
+        def crear_canvas(*a, **k):
+            canvases.append(clase_canvas(*a, perfil=self.perfil, marca=self.marca, **k))
+            return canvases[-1]
+
+        try:
+            doc.build(self.story, onFirstPage=self._header, onLaterPages=self._header, canvasmaker=crear_canvas)
+        except BaseException:
+            # El modo grande escribe mientras maqueta: no dejar el archivo a medias
+            for c in canvases:
+                if isinstance(c._doc, DocumentoIncremental):
+                    c._doc.descartar()
+            raise
+
+        logger.info("PDF generado (%s) → %s", self.perfil.nombre, ruta_final)
         return ruta_final
 
 
 # ==============================================
 # FUNCIÓN PÚBLICA
 # ==============================================
-def generar_pdf_con_datos(datos, ruta_salida=None):
-    gen = PDFGenerator(datos)
+def generar_pdf_con_datos(datos, ruta_salida=None, perfil=None, marca=None):
+    """perfil: 'screen', 'print' o 'archive' (por defecto PDF_PERFIL o 'print'); marca: ver pdf_assets.Marca"""
+    gen = PDFGenerator(datos, perfil, marca)
     return gen.generar(ruta_salida)
\ No newline at end of file
@@ -0,0 +1,148 @@
+import os
+from reportlab.pdfbase import pdfdoc
+from services.pdf_plantilla import stream_binario
+
+# ==============================================
+# ESCRITURA INCREMENTAL DEL PDF
+# ==============================================
+# PDFDocument de ReportLab guarda todos los objetos (y el stream de cada página)
+# hasta save() y recién ahí arma el archivo completo en memoria. Para los
+# documentos grandes (ver CanvasContinuo), DocumentoIncremental escribe cada
+# objeto en cuanto está completo: después de cada página se vuelcan la página y
+# su stream, y se sueltan. Al final solo quedan los objetos que cambian hasta el
+# último momento (árbol de páginas, diccionario de fuentes, fuentes TTF
+# subconjunto, catálogo e info) y las formas reservadas.
+#
+# Una forma reservada tiene número de objeto desde antes de existir: las páginas
+# ya escritas la referencian por ese número y su contenido se define al final
+# (el número de página "n / N", cuando N ya se sabe).
+
+_ESCRITO = None  # Lo que queda en idToObject de un objeto ya escrito y soltado
+
+
+class DocumentoIncremental(pdfdoc.PDFDocument):
+    """PDFDocument que escribe cada objeto al archivo en cuanto está completo"""
+
+    @classmethod
+    def para_canvas(cls, canvas):
+        """Tomar el lugar del documento recién creado por el Canvas (antes de dibujar nada)"""
+        documento = cls.__new__(cls)
+        documento.__dict__.update(canvas._doc.__dict__)
+        documento.ruta = canvas._filename
+        documento.ruta_parcial = f"{canvas._filename}.parcial"  # Se renombra al cerrar
+        documento._archivo = None
+        documento._posicion = 0
+        documento._revisados = 0       # Último número de objeto ya escrito o diferido
+        documento._pendientes = set()  # Números diferidos hasta el cierre
+        documento._reservadas = set()  # Nombres internos de formas reservadas sin definir
+        documento._cerrando = False
+        canvas._doc = documento
+        return documento
+
+    # ====================== FORMAS RESERVADAS ======================
+
+    def reservar_forma(self, nombre: str):
+        """Dar número a la forma `nombre` para poder referenciarla antes de definirla"""
+        interno = pdfdoc.xObjectName(nombre)
+        if interno not in self.idToObject:
+            self.Reference(pdfdoc.PDFDictionary(), interno)
+            self._reservadas.add(interno)
+
+    def addForm(self, name, form):
+        interno = pdfdoc.xObjectName(name)
+        if interno not in self._reservadas:
+            return pdfdoc.PDFDocument.addForm(self, name, form)
+        # Ocupa el lugar (y el número) del marcador y, ya completa, se escribe
+        self._reservadas.discard(interno)
+        form.__InternalName__ = interno
+        self.idToObject[interno] = form
+        self.inObject = None
+        numero = self.idToObjectNumberAndVersion[interno][0]
+        if numero in self._pendientes:
+            self._pendientes.discard(numero)
+            self._escribir_objeto(interno)
+
+    # ====================== ESCRITURA ======================
+
+    def volcar(self):
+        """Escribir todos los objetos completos registrados desde el último volcado"""
+        if self._archivo is None:
+            if self.encrypt.info() is not None:
+                raise ValueError("DocumentoIncremental no admite PDF cifrados")
+            self._archivo = open(self.ruta_parcial, "wb")
+            self._escribir(pdfdoc.PDFFile(self._pdfVersion).strings[0])
+        # Formatear un objeto puede registrar otros (el stream de una página): el
+        # ciclo sigue hasta que no aparecen más
+        while self._revisados < self.objectcounter:
+            self._revisados += 1
+            nombre = self.numberToId[self._revisados]
+            if self._diferido(nombre):
+                self._pendientes.add(self._revisados)
+            else:
+                self._escribir_objeto(nombre)
+
+    def _diferido(self, nombre) -> bool:
+        if self._cerrando:
+            return False
+        objeto = self.idToObject[nombre]
+        return (nombre == pdfdoc.BasicFonts or nombre in self._reservadas
+                or objeto is self.Pages or objeto is self.Catalog or objeto is self.info)
+
+    def _escribir(self, datos: bytes) -> int:
+        posicion = self._posicion
+        self._archivo.write(datos)
+        self._posicion += len(datos)
+        return posicion
+
+    def _escribir_objeto(self, nombre):
+        objeto = self.idToObject[nombre]
+        stream_binario(objeto)
+        self.idToOffset[nombre] = self._escribir(pdfdoc.PDFIndirectObject(nombre, objeto).format(self))
+        # Soltar lo escrito: la página sigue en el árbol, pero ahí solo se usa su
+        # nombre; el stream ya no lo necesita nadie
+        if isinstance(objeto, pdfdoc.PDFPage):
+            objeto.__dict__.clear()
+            objeto.__InternalName__ = nombre
+        elif isinstance(objeto, (pdfdoc.PDFStream, pdfdoc.PDFFormXObject)):
+            # Las formas se siguen buscando por nombre (hasForm): queda la clave
+            self.idToObject[nombre] = _ESCRITO
+
+    def SaveToFile(self, filename, canvas):
+        """Cerrar: lo diferido, xref y trailer (lo mismo que GetPDFData + format)"""
+        if self._reservadas:
+            raise ValueError(f"Formas reservadas sin definir: {sorted(self._reservadas)}")
+        for fuente in self.delayedFonts:
+            fuente.addObjects(self)
+        self.info.invariant = self.invariant
+        self.info.digest(self.signature)
+        self.Reference(self.Catalog)
+        self.Reference(self.info)
+        self.Outlines.prepare(self, canvas)
+        if self.Outlines.ready < 0:
+            self.Catalog.Outlines = None
+
+        self.volcar()
+        self._cerrando = True
+        for numero in sorted(self._pendientes):
+            self._escribir_objeto(self.numberToId[numero])
+        # Los diferidos pueden registrar objetos nuevos (lo que referencia BasicFonts)
+        self.volcar()
+
+        ids = [self.numberToId[numero] for numero in range(1, self.objectcounter + 1)]
+        xref = pdfdoc.PDFCrossReferenceTable()
+        xref.addsection(0, ids)
+        inicio_xref = self._escribir(xref.format(self))
+        trailer = pdfdoc.PDFTrailer(
+            startxref=inicio_xref, Size=len(ids) + 1,
+            Root=self.Reference(self.Catalog), Info=self.Reference(self.info), ID=self.ID(),
+        )
+        self._escribir(trailer.format(self))
+        self._archivo.close()
+        os.replace(self.ruta_parcial, self.ruta)
+
+    def descartar(self):
+        """Borrar el archivo parcial si la generación falló"""
+        if self._archivo is not None:
+            self._archivo.close()
+            if os.path.exists(self.ruta_parcial):
+                os.remove(self.ruta_parcial)
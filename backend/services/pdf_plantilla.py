@@ -0,0 +1,112 @@
+import copy
+import hashlib
+import os
+import threading
+from io import BytesIO
+from reportlab.lib.boxstuff import aspectRatioFix
+from reportlab.pdfbase import pdfdoc, pdfutils
+from services.pdf_assets import jpeg_para_caja, obtener_perfil
+
+# ==============================================
+# CROMO ESTÁTICO PRECOMPILADO
+# ==============================================
+# Las imágenes del membrete, logo, sello y firma son las mismas en todos los PDF.
+# Se preparan una sola vez por proceso (remuestreadas según el perfil de salida)
+# y se incrustan como JPEG crudo. Dentro de cada documento, las partes fijas de
+# la página se dibujan una vez como Form XObject y cada página solo las
+# referencia con `doForm`.
+
+_imagenes = {}
+_lock = threading.Lock()
+
+
+def imagen_precompilada(ruta, ancho_pt, alto_pt, perfil):
+    """XObject de imagen listo para incrustar (se prepara una vez por ruta, caja y perfil)"""
+    ruta = os.path.abspath(ruta)
+    clave = (ruta, round(ancho_pt, 2), round(alto_pt, 2), perfil.nombre)
+    with _lock:
+        imagen = _imagenes.get(clave)
+    if imagen is None:
+        imagen = _cargar_imagen(ruta, jpeg_para_caja(ruta, ancho_pt, alto_pt, perfil), clave)
+        with _lock:
+            imagen = _imagenes.setdefault(clave, imagen)
+    return imagen
+
+
+def _cargar_imagen(ruta, contenido, clave):
+    nombre = "Img" + hashlib.md5(repr(clave).encode("utf-8")).hexdigest()
+    try:
+        ancho, alto, componentes = pdfutils.readJPEGInfo(BytesIO(contenido))[:3]
+    except Exception:
+        # No es JPEG: ReportLab la pasa a RGB comprimido con Flate
+        imagen = pdfdoc.PDFImageXObject(nombre)
+        imagen.loadImageFromRaw(ruta)
+        return imagen
+
+    imagen = pdfdoc.PDFImageXObject(nombre)
+    imagen.width, imagen.height = ancho, alto
+    imagen.bitsPerComponent = 8
+    imagen.colorSpace = {1: "DeviceGray", 3: "DeviceRGB"}.get(componentes, "DeviceCMYK")
+    if componentes == 4:
+        imagen._dotrans = 1
+    imagen.streamContent = contenido
+    imagen._filters = ("DCTDecode",)
+    imagen.mask = None
+    return imagen
+
+
+def dibujar_imagen(canvas, ruta, x, y, width, height):
+    """Dibujar una imagen precompilada conservando su proporción (centrada en la caja)"""
+    if not os.path.exists(ruta):
+        return
+    # El canvas del documento indica el perfil de salida (ver FooterCanvas)
+    perfil = getattr(canvas, 'perfil', None) or obtener_perfil()
+    imagen = imagen_precompilada(ruta, width, height, perfil)
+    if not canvas.hasForm(imagen.name):
+        # Cada documento registra su propia copia: el objeto cacheado no se toca
+        canvas._doc.addForm(imagen.name, copy.copy(imagen))
+    x, y, width, height, _ = aspectRatioFix(True, "c", x, y, width, height, imagen.width, imagen.height)
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.scale(width, height)
+    canvas.doForm(imagen.name)
+    canvas.restoreState()
+
+
+def streams_binarios(documento):
+    """Armar los streams de páginas y formas del documento sin la capa ASCII85.
+
+    ReportLab decide si agrega ASCII85 (~25% más de bytes y CPU) leyendo
+    `rl_config.useA85`, que es global al proceso, recién al formatear. Llamar
+    justo antes de guardar: los streams quedan armados solo con Flate y el
+    resto de documentos ReportLab del proceso no se ven afectados.
+    """
+    for pagina in documento.Pages.pages:
+        stream_binario(pagina)
+    for objeto in documento.idToObject.values():
+        stream_binario(objeto)
+
+
+def stream_binario(objeto):
+    """Lo mismo que streams_binarios para un solo objeto (página o forma; el resto no cambia)"""
+    if isinstance(objeto, pdfdoc.PDFPage):
+        if objeto.compression and objeto.stream and not objeto.Contents:
+            objeto.Contents = pdfdoc.PDFStream(content=objeto.stream, filters=[pdfdoc.PDFZCompress])
+    elif isinstance(objeto, pdfdoc.PDFFormXObject) and objeto.compression and not objeto.Contents:
+        objeto.Contents = pdfdoc.PDFStream(content=objeto.stream, filters=[pdfdoc.PDFZCompress])
+        # Sin esto, PDFFormXObject.format volvería a poner los filtros según rl_config
+        objeto.compression = 0
+
+
+def definir_forma(canvas, nombre, dibujar):
+    """Dibujar el Form XObject con `dibujar(canvas)` si el documento todavía no lo tiene"""
+    if not canvas.hasForm(nombre):
+        canvas.beginForm(nombre)
+        dibujar(canvas)
+        canvas.endForm()
+
+
+def usar_forma(canvas, nombre, dibujar):
+    """Referenciar un Form XObject; la primera vez en el documento se dibuja con `dibujar(canvas)`"""
+    definir_forma(canvas, nombre, dibujar)
+    canvas.doForm(nombre)
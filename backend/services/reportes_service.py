@@ -0,0 +1,428 @@
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, cast, Integer
+from models import (
+    Cambio, Cliente, TipoCotizacion,
+    Cotizacion, ItemCotizacion, ArchivoCotizacion, ArchivoItemCotizacion
+)
+from services.cambios_service import CambiosService
+from services.cotizacion_service import ESTADOS_VALIDOS
+from services.totales import a_monto
+
+# ==============================================
+# REPORTES SOBRE UNA INSTANTÁNEA EN MEMORIA
+# ==============================================
+# Las agrupaciones por tipo, cliente, mes y estado corren sobre una copia por
+# columnas (arrays de NumPy) de todas las cotizaciones, incluidas las archivadas,
+# y no sobre la base. Filtrar es una máscara booleana y agrupar es np.unique más
+# np.bincount / np.add.at sobre la columna de la clave: ningún reporte recorre
+# las filas en Python. La copia se pone al día con el registro de cambios: solo
+# se releen las cotizaciones que cambiaron desde el último token.
+
+REPORTES_REFRESCO_SEGUNDOS = float(os.getenv("REPORTES_REFRESCO_SEGUNDOS", "5"))  # Mínimo entre consultas al registro
+REPORTES_RECARGA_CAMBIOS = 20000  # Con más cambios pendientes se recarga todo
+REPORTES_MAX_RESULTADOS = 256     # Reportes cacheados por empresa mientras no cambie el token
+REPORTES_INACTIVA_SEGUNDOS = float(os.getenv("REPORTES_INACTIVA_SEGUNDOS", "3600"))  # Sin uso: se libera
+LOTE_IDS = 5000
+
+ESTADOS = list(ESTADOS_VALIDOS)
+SIN_ESTADO = -1   # Estado desconocido o cotización que ya no existe
+
+# Columnas de la instantánea: (nombre, dtype)
+COLUMNAS = [
+    ("tipo_id", np.int64),
+    ("cliente_id", np.int64),
+    ("estado", np.int8),        # Índice en ESTADOS
+    ("mes", np.int32),          # AAAAMM de fecha_emision
+    ("subtotal", np.int64),     # Centavos
+    ("itbis", np.int64),
+    ("total", np.int64),
+    ("items", np.int32),        # Cantidad de items
+    ("items_monto", np.int64),  # Suma de monto_centavos de los items
+    ("items_descuento", np.int64),
+]
+# Columnas que se suman en el resumen, en el orden de la respuesta
+SUMAS = ["subtotal", "itbis", "total", "items", "items_monto", "items_descuento"]
+
+AGRUPACIONES = {"tipo": "tipo_id", "cliente": "cliente_id", "mes": "mes", "estado": "estado"}
+
+
+class Instantanea:
+    """Una posición por cotización en cada columna; `posicion` va de ID a posición.
+
+    Las columnas se reservan con holgura y crecen al doble; `columna()` devuelve
+    solo la parte ocupada (una vista, sin copiar). Las posiciones de cotizaciones
+    que ya no existen quedan marcadas SIN_ESTADO hasta que `compactar()` las libera.
+    """
+
+    def __init__(self, capacidad: int = 1024):
+        for nombre, tipo in COLUMNAS:
+            setattr(self, nombre, np.zeros(capacidad, dtype=tipo))
+        self.posicion = {}
+        self.usadas = 0      # Posiciones ocupadas, incluidas las libres que aún no se compactan
+        self.clientes = {}   # id -> nombre
+        self.tipos = {}      # id -> nombre
+        self.token = 0
+        self.revisada = 0.0  # time.monotonic() de la última consulta al registro
+        self.usada = time.monotonic()  # Último reporte calculado sobre ella
+
+    def __len__(self):
+        return len(self.posicion)
+
+    def columna(self, nombre: str) -> np.ndarray:
+        return getattr(self, nombre)[:self.usadas]
+
+    def _reservar(self, cantidad: int):
+        capacidad = len(self.estado)
+        if cantidad <= capacidad:
+            return
+        while capacidad < cantidad:
+            capacidad *= 2
+        for nombre, _ in COLUMNAS:
+            nueva = np.zeros(capacidad, dtype=getattr(self, nombre).dtype)
+            nueva[:self.usadas] = self.columna(nombre)
+            setattr(self, nombre, nueva)
+
+    def cargar(self, ids: list, filas: list):
+        """Carga inicial: `filas` con una tupla de valores (en el orden de COLUMNAS) por ID"""
+        self._reservar(max(len(ids), 1))
+        if filas:
+            valores = np.array(filas, dtype=np.int64)
+            for i, (nombre, _) in enumerate(COLUMNAS):
+                getattr(self, nombre)[:len(ids)] = valores[:, i]
+        self.posicion = {cotizacion_id: pos for pos, cotizacion_id in enumerate(ids)}
+        self.usadas = len(ids)
+
+    def poner(self, cotizacion_id: int, valores: tuple):
+        pos = self.posicion.get(cotizacion_id)
+        if pos is None:
+            pos = self.usadas
+            self._reservar(pos + 1)
+            self.posicion[cotizacion_id] = pos
+            self.usadas += 1
+        for (nombre, _), valor in zip(COLUMNAS, valores):
+            getattr(self, nombre)[pos] = valor
+
+    def quitar(self, cotizacion_id: int):
+        pos = self.posicion.pop(cotizacion_id, None)
+        if pos is not None:
+            self.estado[pos] = SIN_ESTADO
+
+    def libres(self) -> int:
+        return self.usadas - len(self.posicion)
+
+    def compactar(self):
+        """Copiar solo las posiciones vivas a columnas nuevas (del tamaño justo, con holgura)"""
+        ids = list(self.posicion)
+        vivas = np.fromiter(self.posicion.values(), dtype=np.int64, count=len(ids))
+        capacidad = max(1024, 2 * len(ids))
+        for nombre, _ in COLUMNAS:
+            nueva = np.zeros(capacidad, dtype=getattr(self, nombre).dtype)
+            nueva[:len(ids)] = self.columna(nombre)[vivas]
+            setattr(self, nombre, nueva)
+        self.posicion = {cotizacion_id: pos for pos, cotizacion_id in enumerate(ids)}
+        self.usadas = len(ids)
+
+    def bytes(self) -> int:
+        return sum(getattr(self, nombre).nbytes for nombre, _ in COLUMNAS)
+
+
+def _mes(texto: str) -> int:
+    """"2025-03" -> 202503"""
+    try:
+        anio, mes = texto.split("-")
+        return int(anio) * 100 + int(mes)
+    except ValueError:
+        raise ValueError(f"Mes inválido: {texto} (formato AAAA-MM)")
+
+
+class ReportesService:
+    _lock = threading.Lock()  # Solo protege `_locks`
+    _locks = {}         # base de datos -> Lock: la carga de una empresa no detiene a las demás
+    _instantaneas = {}  # base de datos -> Instantanea; una por empresa
+    _resultados = {}    # base de datos -> (token, {(reporte, parámetros): resultado})
+
+    # ====================== INSTANTÁNEA ======================
+
+    @staticmethod
+    def instantanea(db: Session, forzar: bool = False) -> Instantanea:
+        """Instantánea de la empresa, puesta al día si pasó REPORTES_REFRESCO_SEGUNDOS.
+
+        Se llama con el lock de la empresa (`_lock_de`) tomado.
+        """
+        clave = str(db.get_bind().url)
+        inst = ReportesService._instantaneas.get(clave)
+        if inst is None:
+            inst = ReportesService._cargar(db)
+            ReportesService._instantaneas[clave] = inst
+        elif forzar or time.monotonic() - inst.revisada >= REPORTES_REFRESCO_SEGUNDOS:
+            if not ReportesService._refrescar(db, inst):
+                inst = ReportesService._cargar(db)
+                ReportesService._instantaneas[clave] = inst
+        return inst
+
+    @staticmethod
+    def _lock_de(clave: str) -> threading.Lock:
+        with ReportesService._lock:
+            return ReportesService._locks.setdefault(clave, threading.Lock())
+
+    @staticmethod
+    def _liberar_inactivas(actual: str):
+        """Soltar las instantáneas de empresas sin reportes en REPORTES_INACTIVA_SEGUNDOS"""
+        limite = time.monotonic() - REPORTES_INACTIVA_SEGUNDOS
+        for clave, inst in list(ReportesService._instantaneas.items()):
+            if clave == actual or inst.usada >= limite:
+                continue
+            lock = ReportesService._lock_de(clave)
+            if not lock.acquire(blocking=False):
+                continue  # Se está usando justo ahora
+            try:
+                if ReportesService._instantaneas.get(clave) is inst:
+                    del ReportesService._instantaneas[clave]
+                    ReportesService._resultados.pop(clave, None)
+            finally:
+                lock.release()
+
+    @staticmethod
+    def _cargar(db: Session) -> Instantanea:
+        """Carga completa de la base principal y el archivo"""
+        inst = Instantanea()
+        # El token se toma antes de leer: lo que cambie durante la carga se relee después
+        inst.token = CambiosService.token_actual(db)
+        ids, filas = [], []
+        for cotizacion_id, *valores in ReportesService._leer(db):
+            ids.append(cotizacion_id)
+            filas.append(valores)
+        inst.cargar(ids, filas)
+        del filas
+        inst.clientes = dict(db.query(Cliente.id, Cliente.nombre).all())
+        inst.tipos = dict(db.query(TipoCotizacion.id, TipoCotizacion.nombre).all())
+        inst.revisada = time.monotonic()
+        return inst
+
+    @staticmethod
+    def _refrescar(db: Session, inst: Instantanea) -> bool:
+        """Releer solo lo que cambió desde `inst.token`; False si conviene recargar todo"""
+        cambios = db.query(Cambio.id, Cambio.entidad, Cambio.entidad_id).filter(
+            Cambio.id > inst.token
+        ).order_by(Cambio.id).limit(REPORTES_RECARGA_CAMBIOS + 1).all()
+        inst.revisada = time.monotonic()
+        if not cambios:
+            return True
+        if len(cambios) > REPORTES_RECARGA_CAMBIOS:
+            return False
+
+        ids = {"cliente": set(), "tipo": set(), "cotizacion": set()}
+        for cambio in cambios:
+            ids.setdefault(cambio.entidad, set()).add(cambio.entidad_id)
+
+        pendientes = set(ids["cotizacion"])
+        for cotizacion_id, *valores in ReportesService._leer(db, sorted(pendientes)):
+            inst.poner(cotizacion_id, valores)
+            pendientes.discard(cotizacion_id)
+        for cotizacion_id in pendientes:
+            inst.quitar(cotizacion_id)
+        if inst.libres() > max(1024, inst.usadas // 4):
+            inst.compactar()
+
+        if ids["cliente"]:
+            inst.clientes.update(
+                db.query(Cliente.id, Cliente.nombre).filter(Cliente.id.in_(ids["cliente"])).all()
+            )
+        if ids["tipo"]:
+            inst.tipos = dict(db.query(TipoCotizacion.id, TipoCotizacion.nombre).all())
+        inst.token = cambios[-1].id
+        return True
+
+    @staticmethod
+    def _leer(db: Session, ids: list = None):
+        """Filas (id, *COLUMNAS) de la base principal y del archivo, opcionalmente solo `ids`"""
+        codigo_estado = {estado: i for i, estado in enumerate(ESTADOS)}
+        lotes = [ids[i:i + LOTE_IDS] for i in range(0, len(ids), LOTE_IDS)] if ids is not None else [None]
+        for modelo, modelo_items in ((Cotizacion, ItemCotizacion), (ArchivoCotizacion, ArchivoItemCotizacion)):
+            for lote in lotes:
+                items = select(
+                    modelo_items.cotizacion_id,
+                    func.count().label("n"),
+                    func.sum(modelo_items.monto_centavos).label("monto"),
+                    func.sum(modelo_items.descuento_centavos).label("descuento"),
+                ).group_by(modelo_items.cotizacion_id)
+                if lote is not None:
+                    items = items.where(modelo_items.cotizacion_id.in_(lote))
+                items = items.subquery()
+                consulta = select(
+                    modelo.id, modelo.tipo_id, modelo.cliente_id, modelo.estado,
+                    cast(func.strftime("%Y%m", modelo.fecha_emision), Integer),
+                    modelo.subtotal_centavos, modelo.itbis_centavos, modelo.total_centavos,
+                    func.coalesce(items.c.n, 0), func.coalesce(items.c.monto, 0), func.coalesce(items.c.descuento, 0),
+                ).outerjoin(items, items.c.cotizacion_id == modelo.id)
+                if lote is not None:
+                    consulta = consulta.where(modelo.id.in_(lote))
+                for fila in db.execute(consulta.execution_options(yield_per=LOTE_IDS)):
+                    (cotizacion_id, tipo_id, cliente_id, estado, mes,
+                     subtotal, itbis, total, n, monto, descuento) = fila
+                    yield (cotizacion_id, tipo_id or 0, cliente_id or 0, codigo_estado.get(estado, SIN_ESTADO),
+                           mes or 0, subtotal, itbis, total, n, monto, descuento)
+
+    # ====================== REPORTES ======================
+
+    @staticmethod
+    def _mascara(inst: Instantanea, desde: str = None, hasta: str = None,
+                 estado: str = None, tipo_id: int = None) -> np.ndarray:
+        """Posiciones que pasan los filtros, como máscara booleana"""
+        if estado is not None and estado not in ESTADOS:
+            raise ValueError(f"Estado inválido. Debe ser uno de: {', '.join(ESTADOS)}")
+        codigos = inst.columna("estado")
+        mascara = codigos != SIN_ESTADO
+        if desde:
+            mascara &= inst.columna("mes") >= _mes(desde)
+        if hasta:
+            mascara &= inst.columna("mes") <= _mes(hasta)
+        if estado is not None:
+            mascara &= codigos == ESTADOS.index(estado)
+        if tipo_id is not None:
+            mascara &= inst.columna("tipo_id") == tipo_id
+        return mascara
+
+    @staticmethod
+    def _agrupar(inst: Instantanea, columna: str, mascara: np.ndarray):
+        """(claves ordenadas, grupo de cada posición filtrada, cantidad por grupo)"""
+        claves, grupo = np.unique(inst.columna(columna)[mascara], return_inverse=True)
+        return claves, grupo, np.bincount(grupo, minlength=len(claves))
+
+    @staticmethod
+    def _sumar(inst: Instantanea, columna: str, mascara: np.ndarray, grupo: np.ndarray, grupos: int) -> np.ndarray:
+        # np.add.at sobre int64 y no bincount con weights: los pesos pasan por float64
+        # y los centavos tienen que sumar exacto
+        suma = np.zeros(grupos, dtype=np.int64)
+        np.add.at(suma, grupo, inst.columna(columna)[mascara])
+        return suma
+
+    @staticmethod
+    def _nombre(inst: Instantanea, por: str, clave: int):
+        if por == "tipo":
+            return inst.tipos.get(clave)
+        if por == "cliente":
+            return inst.clientes.get(clave)
+        if por == "estado":
+            return ESTADOS[clave]
+        return f"{clave // 100:04d}-{clave % 100:02d}"
+
+    @staticmethod
+    def _calcular(db: Session, reporte: str, parametros: tuple, funcion) -> dict:
+        """Correr `funcion(inst)` o devolver el resultado ya calculado con el mismo token"""
+        clave = str(db.get_bind().url)
+        ReportesService._liberar_inactivas(clave)
+        with ReportesService._lock_de(clave):
+            inst = ReportesService.instantanea(db)
+            inst.usada = time.monotonic()
+            token, cache = ReportesService._resultados.get(clave, (None, None))
+            if token != inst.token:
+                cache = {}
+                ReportesService._resultados[clave] = (inst.token, cache)
+            resultado = cache.get((reporte, parametros))
+            if resultado is None:
+                resultado = {"token": inst.token, **funcion(inst)}
+                if len(cache) < REPORTES_MAX_RESULTADOS:
+                    cache[(reporte, parametros)] = resultado
+            return resultado
+
+    @staticmethod
+    def resumen(db: Session, por: str, desde: str = None, hasta: str = None,
+                estado: str = None, tipo_id: int = None) -> dict:
+        """Cantidad y montos agrupados por tipo, cliente, mes o estado"""
+        if por not in AGRUPACIONES:
+            raise ValueError(f"Agrupación inválida. Debe ser una de: {', '.join(AGRUPACIONES)}")
+
+        def calcular(inst):
+            mascara = ReportesService._mascara(inst, desde, hasta, estado, tipo_id)
+            claves, grupo, cantidades = ReportesService._agrupar(inst, AGRUPACIONES[por], mascara)
+            sumas = {
+                nombre: ReportesService._sumar(inst, nombre, mascara, grupo, len(claves)).tolist()
+                for nombre in SUMAS
+            }
+            filas = [
+                {
+                    "clave": clave,
+                    "nombre": ReportesService._nombre(inst, por, clave),
+                    "cotizaciones": cantidad,
+                    "subtotal": a_monto(sumas["subtotal"][i]),
+                    "itbis": a_monto(sumas["itbis"][i]),
+                    "total": a_monto(sumas["total"][i]),
+                    "items": sumas["items"][i],
+                    "items_monto": a_monto(sumas["items_monto"][i]),
+                    "items_descuento": a_monto(sumas["items_descuento"][i]),
+                }
+                for i, (clave, cantidad) in enumerate(zip(claves.tolist(), cantidades.tolist()))
+            ]
+            return {"por": por, "filas": filas}
+
+        return ReportesService._calcular(db, "resumen", (por, desde, hasta, estado, tipo_id), calcular)
+
+    @staticmethod
+    def top_clientes(db: Session, n: int = 10, estado: str = None,
+                     desde: str = None, hasta: str = None) -> dict:
+        """Los `n` clientes con mayor monto total"""
+        def calcular(inst):
+            mascara = ReportesService._mascara(inst, desde, hasta, estado)
+            clientes, grupo, cantidades = ReportesService._agrupar(inst, "cliente_id", mascara)
+            totales = ReportesService._sumar(inst, "total", mascara, grupo, len(clientes))
+            # Orden estable sobre los IDs ya ordenados: en un empate va primero el ID menor
+            mejores = np.argsort(-totales, kind="stable")[:n]
+            return {
+                "filas": [
+                    {"cliente_id": cliente_id, "nombre": inst.clientes.get(cliente_id),
+                     "cotizaciones": cantidad, "total": a_monto(total)}
+                    for cliente_id, cantidad, total in zip(
+                        clientes[mejores].tolist(), cantidades[mejores].tolist(), totales[mejores].tolist()
+                    )
+                ],
+            }
+
+        return ReportesService._calcular(db, "top_clientes", (n, estado, desde, hasta), calcular)
+
+    @staticmethod
+    def conversion(db: Session, por: str = "tipo", desde: str = None, hasta: str = None) -> dict:
+        """Cotizaciones por estado y tasa de aprobación (aprobadas / cerradas) de cada grupo"""
+        if por not in AGRUPACIONES or por == "estado":
+            raise ValueError("Agrupación inválida. Debe ser una de: tipo, cliente, mes")
+        aprobada, pendiente = ESTADOS.index("aprobada"), ESTADOS.index("pendiente")
+
+        def calcular(inst):
+            mascara = ReportesService._mascara(inst, desde, hasta)
+            claves, grupo, cantidades = ReportesService._agrupar(inst, AGRUPACIONES[por], mascara)
+            # Una celda (grupo, estado) por cotización: bincount sobre el índice aplanado
+            conteos = np.bincount(
+                grupo * len(ESTADOS) + inst.columna("estado")[mascara],
+                minlength=len(claves) * len(ESTADOS)
+            ).reshape(len(claves), len(ESTADOS))
+            cerradas = cantidades - conteos[:, pendiente]
+            filas = []
+            for clave, conteo, cerrada in zip(claves.tolist(), conteos.tolist(), cerradas.tolist()):
+                filas.append({
+                    "clave": clave,
+                    "nombre": ReportesService._nombre(inst, por, clave),
+                    **{estado: conteo[i] for i, estado in enumerate(ESTADOS)},
+                    "tasa_aprobacion": round(conteo[aprobada] / cerrada, 4) if cerrada else None,
+                })
+            return {"por": por, "filas": filas}
+
+        return ReportesService._calcular(db, "conversion", (por, desde, hasta), calcular)
+
+    @staticmethod
+    def metricas(db: Session) -> dict:
+        clave = str(db.get_bind().url)
+        with ReportesService._lock_de(clave):
+            inst = ReportesService._instantaneas.get(clave)
+            if inst is None:
+                return {"cargada": False}
+            return {
+                "cargada": True,
+                "cotizaciones": len(inst),
+                "posiciones_libres": inst.libres(),
+                "token": inst.token,
+                "bytes": inst.bytes(),
+            }
@@ -0,0 +1,198 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from database import DB_DIR
+
+# ==============================================
+# RESPALDOS EN LÍNEA
+# ==============================================
+# Se usa la API de backup de SQLite: copia las páginas en pasos cortos y entre
+# paso y paso suelta el lock de lectura, así las escrituras de la API siguen
+# corriendo. Si otra conexión escribe durante la copia, SQLite la reinicia; tras
+# varios reinicios se vuelve a empezar con pasos 4 veces más grandes (y al final
+# en un solo paso) para no quedar en un ciclo con escrituras constantes.
+
+RESPALDOS_DIR = Path(os.getenv("RESPALDOS_DIR", DB_DIR / "respaldos"))
+RESPALDOS_MAXIMO = int(os.getenv("RESPALDOS_MAXIMO", "7"))          # Juegos que se conservan
+RESPALDO_PAGINAS = int(os.getenv("RESPALDO_PAGINAS", "256"))        # Páginas por paso
+RESPALDO_PAUSA_MS = float(os.getenv("RESPALDO_PAUSA_MS", "10"))     # Pausa entre pasos
+RESPALDO_MAX_REINICIOS = int(os.getenv("RESPALDO_MAX_REINICIOS", "3"))
+# Los endpoints de respaldo son de administración: sin token configurado no se exponen
+RESPALDOS_TOKEN = os.getenv("RESPALDOS_TOKEN", "")
+
+
+
+class RespaldoEnCursoError(Exception):
+    """Ya hay un respaldo corriendo"""
+
+
+class _DemasiadosReinicios(Exception):
+    pass
+
+
+@dataclass
+class ResultadoRespaldo:
+    nombre: str
+    archivos: list = field(default_factory=list)
+    bytes: int = 0
+    pasos: int = 0
+    reinicios: int = 0
+    paginas_por_paso: int = 0       # El paso más grande que hizo falta (-1 = un solo paso)
+    duracion_ms: float = 0.0
+    copia_ms: float = 0.0           # Tiempo leyendo la base (el resto es compresión, sin locks)
+    latencia_durante: dict = field(default_factory=dict)
+
+
+def resumen_latencias(latencias) -> dict:
+    """Cantidad, percentiles y máximo (ms) de una serie de latencias"""
+    if not latencias:
+        return {"peticiones": 0}
+    ordenadas = sorted(latencias)
+    percentil = lambda p: ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+    return {
+        "peticiones": len(ordenadas),
+        "p50_ms": round(percentil(0.50), 2),
+        "p95_ms": round(percentil(0.95), 2),
+        "p99_ms": round(percentil(0.99), 2),
+        "max_ms": round(ordenadas[-1], 2),
+    }
+
+
+class RespaldoService:
+    _lock = threading.Lock()
+    _latencias_respaldo = None          # Lista mientras corre un respaldo
+    _latencias_normal = deque(maxlen=1000)
+    ultimo: Optional[ResultadoRespaldo] = None
+
+    @staticmethod
+    def registrar_latencia(ms: float):
+        """Anotar la latencia de una petición (la llama el middleware de main.py)"""
+        durante = RespaldoService._latencias_respaldo
+        if durante is not None:
+            durante.append(ms)
+        else:
+            RespaldoService._latencias_normal.append(ms)
+
+    @staticmethod
+    def crear_respaldo(tenant, comprimir: bool = True) -> ResultadoRespaldo:
+        """Copiar las bases de la empresa como un juego con marca de tiempo y rotar los viejos"""
+        if not RespaldoService._lock.acquire(blocking=False):
+            raise RespaldoEnCursoError("Ya hay un respaldo en curso")
+        try:
+            RespaldoService._latencias_respaldo = []
+            inicio = time.perf_counter()
+            directorio = RespaldoService._directorio(tenant)
+            directorio.mkdir(parents=True, exist_ok=True)
+            resultado = ResultadoRespaldo(nombre=datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S"))
+
+            # Primero la principal y después el archivo: si un lote se archiva en medio,
+            # el juego queda con la cotización repetida en ambos, nunca sin ella
+            for origen in (tenant.db_path, tenant.archivo_path):
+                if not os.path.exists(origen):
+                    continue
+                destino = directorio / f"{Path(origen).stem}-{resultado.nombre}.db"
+                inicio_copia = time.perf_counter()
+                RespaldoService._copiar(origen, destino, resultado)
+                resultado.copia_ms += round((time.perf_counter() - inicio_copia) * 1000, 2)
+                if comprimir:
+                    destino = RespaldoService._comprimir(destino)
+                resultado.archivos.append(destino.name)
+                resultado.bytes += destino.stat().st_size
+
+            resultado.duracion_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            resultado.latencia_durante = resumen_latencias(RespaldoService._latencias_respaldo)
+            RespaldoService._rotar(directorio)
+            RespaldoService.ultimo = resultado
+            return resultado
+        finally:
+            RespaldoService._latencias_respaldo = None
+            RespaldoService._lock.release()
+
+    @staticmethod
+    def _copiar(origen, destino: Path, resultado: ResultadoRespaldo):
+        """Backup en línea paso a paso, agrandando los pasos si se reinicia demasiado"""
+        estado = {"pendientes": None, "reinicios": 0}
+
+        def progreso(status, restantes, total):
+            resultado.pasos += 1
+            if estado["pendientes"] is not None and restantes > estado["pendientes"]:
+                # Otra conexión escribió: SQLite empezó la copia de nuevo
+                estado["reinicios"] += 1
+                resultado.reinicios += 1
+                if estado["reinicios"] > RESPALDO_MAX_REINICIOS:
+                    raise _DemasiadosReinicios(total)
+            estado["pendientes"] = restantes
+            if restantes:
+                time.sleep(RESPALDO_PAUSA_MS / 1000)
+
+        paginas = RESPALDO_PAGINAS
+        fuente = sqlite3.connect(origen)
+        copia = sqlite3.connect(destino)
+        try:
+            while True:
+                estado.update(pendientes=None, reinicios=0)
+                if resultado.paginas_por_paso != -1 and (paginas == -1 or paginas > resultado.paginas_por_paso):
+                    resultado.paginas_por_paso = paginas
+                try:
+                    fuente.backup(copia, pages=paginas, progress=progreso)
+                    return
+                except _DemasiadosReinicios as e:
+                    total = e.args[0]
+                    paginas = paginas * 4 if 0 < paginas * 4 < total else -1
+        finally:
+            copia.close()
+            fuente.close()
+
+    @staticmethod
+    def _comprimir(ruta: Path) -> Path:
+        comprimido = ruta.with_name(ruta.name + ".gz")
+        with open(ruta, "rb") as entrada, gzip.open(comprimido, "wb", compresslevel=6) as salida:
+            shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        ruta.unlink()
+        return comprimido
+
+    @staticmethod
+    def _directorio(tenant) -> Path:
+        """Cada empresa rota sus respaldos en su propia carpeta"""
+        return RESPALDOS_DIR / tenant.codigo
+
+    @staticmethod
+    def _rotar(directorio: Path):
+        """Conservar solo los RESPALDOS_MAXIMO juegos más recientes"""
+        juegos = sorted({RespaldoService._marca(p) for p in directorio.glob("*.db*")} - {None}, reverse=True)
+        for viejo in juegos[RESPALDOS_MAXIMO:]:
+            for ruta in directorio.glob(f"*-{viejo}.db*"):
+                ruta.unlink()
+
+    @staticmethod
+    def _marca(ruta: Path) -> Optional[str]:
+        nombre = ruta.name.split(".db")[0]
+        partes = nombre.rsplit("-", 2)
+        return "-".join(partes[1:]) if len(partes) == 3 else None
+
+    @staticmethod
+    def listar(tenant) -> list:
+        directorio = RespaldoService._directorio(tenant)
+        if not directorio.exists():
+            return []
+        return [
+            {"archivo": p.name, "bytes": p.stat().st_size,
+             "fecha": datetime.fromtimestamp(p.stat().st_mtime, timezone.utc)}
+            for p in sorted(directorio.glob("*.db*"), reverse=True)
+        ]
+
+    @staticmethod
+    def metricas() -> dict:
+        return {
+            "en_curso": RespaldoService._lock.locked(),
+            "ultimo": asdict(RespaldoService.ultimo) if RespaldoService.ultimo else None,
+            "latencia_normal": resumen_latencias(RespaldoService._latencias_normal),
+        }
@@ -0,0 +1,260 @@
+import json
+import os
+import zlib
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from models import Cotizacion, ItemCotizacion, TerminoCotizacion, ClausulaTermino, RevisionCotizacion
+from services.totales import a_monto
+
+# ==============================================
+# HISTORIAL DE REVISIONES
+# ==============================================
+# Cada creación o edición de una cotización deja una revisión. La revisión 1 y
+# luego una de cada REVISION_COMPLETA_CADA guardan la cotización completa; las
+# demás solo el delta contra la anterior (campos que cambiaron y las operaciones
+# de difflib sobre items y términos). Reconstruir cualquier revisión lee como
+# máximo REVISION_COMPLETA_CADA filas.
+#
+# Documento de una revisión:
+#   {"campos": {...}, "items": [[alcance, monto_c, descuento_c], ...],
+#    "terminos": [[clausula_id, texto_propio], ...]}
+
+REVISION_COMPLETA_CADA = int(os.getenv("REVISION_COMPLETA_CADA", "10"))
+
+# Columnas de la cotización que forman parte del historial (el estado tiene su propio flujo)
+CAMPOS = [
+    "cliente_id", "tipo_id", "descripcion", "vigencia_dias", "fecha_emision", "fecha_vencimiento",
+    "subtotal_centavos", "descuento_centavos", "itbis_centavos", "total_centavos", "tasa_itbis_bp",
+]
+
+
+def _serializar(documento: dict) -> bytes:
+    return zlib.compress(json.dumps(documento, separators=(",", ":"), ensure_ascii=False).encode(), 9)
+
+
+def _deserializar(datos: bytes) -> dict:
+    return json.loads(zlib.decompress(datos))
+
+
+def diferencia_lista(antes: list, despues: list) -> list:
+    """Operaciones [desde, hasta, filas_nuevas] que convierten `antes` en `despues`"""
+    comparador = SequenceMatcher(None, [tuple(f) for f in antes], [tuple(f) for f in despues], autojunk=False)
+    return [
+        [i1, i2, despues[j1:j2]]
+        for operacion, i1, i2, j1, j2 in comparador.get_opcodes()
+        if operacion != "equal"
+    ]
+
+
+def aplicar_lista(lista: list, operaciones: list) -> list:
+    resultado = list(lista)
+    # De atrás hacia adelante: los índices de cada operación se refieren a la lista original
+    for desde, hasta, filas in reversed(operaciones):
+        resultado[desde:hasta] = filas
+    return resultado
+
+
+def delta(antes: dict, despues: dict) -> dict:
+    """Lo que cambió entre dos documentos (vacío si son iguales)"""
+    cambios = {}
+    campos = {k: v for k, v in despues["campos"].items() if antes["campos"].get(k) != v}
+    if campos:
+        cambios["campos"] = campos
+    for lista in ("items", "terminos"):
+        operaciones = diferencia_lista(antes[lista], despues[lista])
+        if operaciones:
+            cambios[lista] = operaciones
+    return cambios
+
+
+def aplicar(documento: dict, cambios: dict) -> dict:
+    return {
+        "campos": {**documento["campos"], **cambios.get("campos", {})},
+        "items": aplicar_lista(documento["items"], cambios.get("items", [])),
+        "terminos": aplicar_lista(documento["terminos"], cambios.get("terminos", [])),
+    }
+
+
+class RevisionService:
+
+    @staticmethod
+    def documento(db: Session, cotizacion_id: int) -> Optional[dict]:
+        """Estado actual de la cotización en la sesión (incluye lo no confirmado)"""
+        fila = db.query(*(getattr(Cotizacion, c) for c in CAMPOS), Cotizacion.version).filter(
+            Cotizacion.id == cotizacion_id
+        ).first()
+        if fila is None:
+            return None
+        items = db.query(
+            ItemCotizacion.alcance, ItemCotizacion.monto_centavos, ItemCotizacion.descuento_centavos
+        ).filter(ItemCotizacion.cotizacion_id == cotizacion_id).order_by(ItemCotizacion.orden).all()
+        terminos = db.query(TerminoCotizacion.clausula_id, TerminoCotizacion.texto_propio).filter(
+            TerminoCotizacion.cotizacion_id == cotizacion_id
+        ).order_by(TerminoCotizacion.orden).all()
+        campos = {
+            c: v.isoformat() if isinstance(v, datetime) else v
+            for c, v in zip(CAMPOS, fila)
+        }
+        return {
+            "campos": campos,
+            "items": [list(i) for i in items],
+            "terminos": [list(t) for t in terminos],
+            "version": fila.version,
+        }
+
+    @staticmethod
+    def registrar(db: Session, cotizacion_id: int, ultima: int = None):
+        """Guardar el estado actual como nueva revisión (después de escribir, antes del commit).
+
+        Se calcula contra la última revisión reconstruida, no contra la fila: así
+        un delta nunca depende de cambios que no pasaron por el historial. Si el
+        llamador ya conoce el número de la última revisión (ver `sql_ultima`) se
+        ahorra la consulta.
+        """
+        db.flush()
+        actual = RevisionService.documento(db, cotizacion_id)
+        version = actual.pop("version")
+        numero, anterior = RevisionService._ultima(db, cotizacion_id, ultima)
+        RevisionService._guardar(db, cotizacion_id, numero + 1, version, actual, anterior)
+
+    @staticmethod
+    def sql_ultima(cotizacion_id: int):
+        """Subconsulta con el número de la última revisión (NULL sin historial), para un RETURNING"""
+        return select(func.max(RevisionCotizacion.revision)).where(
+            RevisionCotizacion.cotizacion_id == cotizacion_id
+        ).scalar_subquery()
+
+    @staticmethod
+    def guardar_base(db: Session, cotizacion_id: int, version: int) -> int:
+        """Guardar como revisión 1 el estado de una cotización sin historial, antes de editarla.
+
+        Dos primeras ediciones a la vez guardarían la misma base: la segunda no
+        inserta nada (ON CONFLICT DO NOTHING) en vez de chocar con el índice único.
+        """
+        actual = RevisionService.documento(db, cotizacion_id)
+        actual.pop("version")
+        db.execute(
+            insert(RevisionCotizacion)
+            .values(**RevisionService._fila(cotizacion_id, 1, version, actual, None))
+            .on_conflict_do_nothing(index_elements=["cotizacion_id", "revision"])
+        )
+        return 1
+
+    @staticmethod
+    def _fila(cotizacion_id: int, numero: int, version: int, documento: dict, anterior) -> dict:
+        completa = anterior is None or (numero - 1) % REVISION_COMPLETA_CADA == 0
+        datos = documento if completa else delta(anterior, documento)
+        return {"cotizacion_id": cotizacion_id, "revision": numero, "version": version,
+                "completa": completa, "datos": _serializar(datos)}
+
+    @staticmethod
+    def _guardar(db: Session, cotizacion_id: int, numero: int, version: int, documento: dict, anterior):
+        db.add(RevisionCotizacion(**RevisionService._fila(cotizacion_id, numero, version, documento, anterior)))
+        # Las sesiones no hacen autoflush: la próxima `_ultima` debe ver esta revisión
+        db.flush()
+
+    @staticmethod
+    def _ultima(db: Session, cotizacion_id: int, numero: int = None):
+        """(número, documento) de la última revisión; (0, None) si no hay historial"""
+        if numero is None:
+            numero = db.query(func.max(RevisionCotizacion.revision)).filter(
+                RevisionCotizacion.cotizacion_id == cotizacion_id
+            ).scalar()
+        if numero is None:
+            return 0, None
+        return numero, RevisionService.reconstruir(db, cotizacion_id, numero)
+
+    @staticmethod
+    def reconstruir(db: Session, cotizacion_id: int, numero: int) -> Optional[dict]:
+        """Documento de la revisión `numero`: la última completa hasta ella más sus deltas"""
+        base = select(func.max(RevisionCotizacion.revision)).where(
+            RevisionCotizacion.cotizacion_id == cotizacion_id,
+            RevisionCotizacion.completa.is_(True),
+            RevisionCotizacion.revision <= numero
+        ).scalar_subquery()
+        filas = db.query(RevisionCotizacion.revision, RevisionCotizacion.datos).filter(
+            RevisionCotizacion.cotizacion_id == cotizacion_id,
+            RevisionCotizacion.revision.between(base, numero)
+        ).order_by(RevisionCotizacion.revision).all()
+        if not filas or filas[-1].revision != numero:
+            return None
+        documento = _deserializar(filas[0].datos)
+        for fila in filas[1:]:
+            documento = aplicar(documento, _deserializar(fila.datos))
+        return documento
+
+    @staticmethod
+    def listar(db: Session, cotizacion_id: int) -> list:
+        """Revisiones de una cotización (sin descomprimir los datos)"""
+        filas = db.query(
+            RevisionCotizacion.revision, RevisionCotizacion.version, RevisionCotizacion.completa,
+            func.length(RevisionCotizacion.datos).label("bytes"), RevisionCotizacion.created_at
+        ).filter(RevisionCotizacion.cotizacion_id == cotizacion_id).order_by(RevisionCotizacion.revision).all()
+        return [
+            {"revision": f.revision, "version": f.version, "completa": f.completa,
+             "bytes": f.bytes, "fecha": f.created_at}
+            for f in filas
+        ]
+
+    @staticmethod
+    def obtener(db: Session, cotizacion_id: int, numero: int) -> dict:
+        documento = RevisionService.reconstruir(db, cotizacion_id, numero)
+        if documento is None:
+            raise LookupError("Revisión no encontrada")
+        textos = RevisionService._textos(db, [documento])
+        return {"revision": numero, **RevisionService._legible(documento, textos)}
+
+    @staticmethod
+    def comparar(db: Session, cotizacion_id: int, desde: int, hasta: int) -> dict:
+        """Qué cambió entre dos revisiones: campos (antes/después) y bloques de items y términos"""
+        antes = RevisionService.reconstruir(db, cotizacion_id, desde)
+        despues = RevisionService.reconstruir(db, cotizacion_id, hasta)
+        if antes is None or despues is None:
+            raise LookupError("Revisión no encontrada")
+        textos = RevisionService._textos(db, [antes, despues])
+        antes, despues = RevisionService._legible(antes, textos), RevisionService._legible(despues, textos)
+
+        resultado = {
+            "desde": desde,
+            "hasta": hasta,
+            "campos": {
+                c: {"antes": antes["campos"].get(c), "despues": v}
+                for c, v in despues["campos"].items() if antes["campos"].get(c) != v
+            },
+        }
+        for lista in ("items", "terminos"):
+            filas_antes = [list(f.values()) for f in antes[lista]]
+            filas_despues = [list(f.values()) for f in despues[lista]]
+            resultado[lista] = [
+                {"posicion": i1, "antes": antes[lista][i1:i2], "despues": despues[lista][j1:j2]}
+                for operacion, i1, i2, j1, j2 in SequenceMatcher(
+                    None, [tuple(f) for f in filas_antes], [tuple(f) for f in filas_despues], autojunk=False
+                ).get_opcodes()
+                if operacion != "equal"
+            ]
+        return resultado
+
+    @staticmethod
+    def _textos(db: Session, documentos: list) -> dict:
+        ids = {t[0] for d in documentos for t in d["terminos"] if t[0] is not None}
+        if not ids:
+            return {}
+        return dict(db.query(ClausulaTermino.id, ClausulaTermino.texto).filter(ClausulaTermino.id.in_(ids)).all())
+
+    @staticmethod
+    def _legible(documento: dict, textos: dict) -> dict:
+        return {
+            "campos": documento["campos"],
+            "items": [
+                {"alcance": alcance, "monto": a_monto(monto), "descuento": a_monto(descuento)}
+                for alcance, monto, descuento in documento["items"]
+            ],
+            "terminos": [
+                {"clausula_id": clausula_id, "texto": propio if propio is not None else textos.get(clausula_id, "")}
+                for clausula_id, propio in documento["terminos"]
+            ],
+        }
@@ -0,0 +1,96 @@
+import os
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP, ROUND_HALF_EVEN, InvalidOperation
+from typing import Iterable, Tuple
+from sqlalchemy import case, and_
+
+# Todos los montos se guardan como enteros en centavos y las tasas en puntos
+# básicos (1800 = 18%). Así los totales son exactos y no acumulan el error de
+# los float al exportar a contabilidad.
+
+TASA_ITBIS_BP_POR_DEFECTO = 1800
+BASE_PUNTOS_BASICOS = 10000
+
+MODOS_REDONDEO = {
+    "half_up": ROUND_HALF_UP,      # 0.005 -> 0.01 (el habitual en facturación)
+    "half_even": ROUND_HALF_EVEN,  # redondeo bancario
+}
+REDONDEO_POR_DEFECTO = os.getenv("REDONDEO_MONTOS", "half_up")
+if REDONDEO_POR_DEFECTO not in MODOS_REDONDEO:
+    raise ValueError(f"REDONDEO_MONTOS inválido: {REDONDEO_POR_DEFECTO}. Opciones: {', '.join(MODOS_REDONDEO)}")
+
+
+@dataclass
+class Totales:
+    subtotal: int   # suma de montos (centavos)
+    descuento: int  # suma de descuentos por item (centavos)
+    itbis: int      # impuesto sobre (subtotal - descuento)
+    total: int
+
+
+def a_centavos(monto, modo: str = REDONDEO_POR_DEFECTO) -> int:
+    """Convertir un monto (float, str o Decimal) a centavos exactos"""
+    try:
+        valor = Decimal(str(monto))
+    except InvalidOperation:
+        raise ValueError(f"Monto inválido: {monto}")
+    return int(valor.quantize(Decimal("0.01"), rounding=MODOS_REDONDEO[modo]) * 100)
+
+
+def a_monto(centavos: int) -> float:
+    """Centavos a float solo para presentación (API y PDF)"""
+    return centavos / 100
+
+
+def dividir_redondeando(numerador: int, divisor: int, modo: str = REDONDEO_POR_DEFECTO) -> int:
+    """División entera con la regla de redondeo indicada (numerador >= 0)"""
+    cociente, resto = divmod(numerador, divisor)
+    if resto * 2 > divisor or (resto * 2 == divisor and (modo == "half_up" or cociente % 2 == 1)):
+        cociente += 1
+    return cociente
+
+
+def calcular_itbis(base: int, tasa_itbis_bp: int, modo: str = REDONDEO_POR_DEFECTO) -> int:
+    return dividir_redondeando(base * tasa_itbis_bp, BASE_PUNTOS_BASICOS, modo)
+
+
+def linea_en_centavos(monto, descuento=0, modo: str = REDONDEO_POR_DEFECTO) -> Tuple[int, int]:
+    """Validar un item y devolver (monto, descuento) en centavos"""
+    monto_c = a_centavos(monto, modo)
+    descuento_c = a_centavos(descuento or 0, modo)
+    if monto_c < 0:
+        raise ValueError("El monto de un item no puede ser negativo")
+    if descuento_c < 0 or descuento_c > monto_c:
+        raise ValueError("El descuento de un item debe estar entre 0 y su monto")
+    return monto_c, descuento_c
+
+
+def calcular_totales(lineas: Iterable[Tuple[int, int]], tasa_itbis_bp: int,
+                     modo: str = REDONDEO_POR_DEFECTO) -> Totales:
+    """Totales de una cotización a partir de sus líneas (monto, descuento) en centavos"""
+    subtotal = 0
+    descuento = 0
+    for monto_c, descuento_c in lineas:
+        subtotal += monto_c
+        descuento += descuento_c
+    itbis = calcular_itbis(subtotal - descuento, tasa_itbis_bp, modo)
+    return Totales(subtotal=subtotal, descuento=descuento, itbis=itbis, total=subtotal - descuento + itbis)
+
+
+def sql_calcular_itbis(base, tasa_itbis_bp, modo: str = REDONDEO_POR_DEFECTO):
+    """Misma regla que `calcular_itbis`, como expresión SQL entera para recálculos masivos"""
+    numerador = base * tasa_itbis_bp
+    cociente = numerador // BASE_PUNTOS_BASICOS
+    if modo == "half_up":
+        return (numerador + BASE_PUNTOS_BASICOS // 2) // BASE_PUNTOS_BASICOS
+    doble_resto = (numerador - cociente * BASE_PUNTOS_BASICOS) * 2
+    return cociente + case(
+        (doble_resto > BASE_PUNTOS_BASICOS, 1),
+        (and_(doble_resto == BASE_PUNTOS_BASICOS, cociente % 2 == 1), 1),
+        else_=0
+    )
+
+
+def formatear_tasa(tasa_itbis_bp: int) -> str:
+    """1800 -> '18', 1650 -> '16.5'"""
+    return f"{(Decimal(tasa_itbis_bp) / 100).normalize():f}"
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from tenants import TENANTS, sesiones
+from services.archivo_service import ArchivoService
+from services.cambios_service import CambiosService
+from services.respaldo_service import RespaldoService
+from services.cotizacion_service import CotizacionService
+from services.dashboard_service import DashboardService
+from services.idempotencia_service import IdempotenciaService
+
+logger = logging.getLogger("shizzo.tareas")
+
+# Tareas periódicas que corren dentro del ciclo de vida de la API (sin cron externo).
+# Cada tarea devuelve cuántas filas tocó; eso y la duración quedan en sus métricas.
+
+
+@dataclass
+class MetricasTarea:
+    ejecuciones: int = 0
+    errores: int = 0
+    filas_total: int = 0
+    ultimas_filas: int = 0
+    ultima_duracion_ms: float = 0.0
+    ultima_ejecucion: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+
+
+class TareaPeriodica:
+    def __init__(self, nombre: str, intervalo_segundos: float, funcion: Callable[[], int]):
+        self.nombre = nombre
+        self.intervalo_segundos = intervalo_segundos
+        self.funcion = funcion
+        self.metricas = MetricasTarea()
+
+    def ejecutar(self) -> int:
+        """Correr la tarea una vez registrando filas afectadas y duración"""
+        inicio = time.perf_counter()
+        try:
+            filas = self.funcion() or 0
+        except Exception as e:
+            self.metricas.errores += 1
+            self.metricas.ultimo_error = str(e)
+            logger.exception("Tarea %s falló", self.nombre)
+            return 0
+        finally:
+            self.metricas.ejecuciones += 1
+            self.metricas.ultima_duracion_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            self.metricas.ultima_ejecucion = datetime.now(timezone.utc)
+
+        self.metricas.ultimas_filas = filas
+        self.metricas.filas_total += filas
+        logger.info("Tarea %s: %d filas en %.2f ms", self.nombre, filas, self.metricas.ultima_duracion_ms)
+        return filas
+
+    async def ciclo(self):
+        """Ejecutar al iniciar y luego cada `intervalo_segundos`, fuera del event loop"""
+        while True:
+            await asyncio.to_thread(self.ejecutar)
+            await asyncio.sleep(self.intervalo_segundos)
+
+
+# ====================== TAREAS ======================
+
+def por_empresa(funcion: Callable) -> Callable[[], int]:
+    """Correr `funcion(tenant, db)` en la base de cada empresa y sumar las filas"""
+    def ejecutar() -> int:
+        filas = 0
+        for tenant in TENANTS.values():
+            db = sesiones(tenant)()
+            try:
+                filas += funcion(tenant, db) or 0
+            finally:
+                db.close()
+        return filas
+    return ejecutar
+
+
+def barrer_vencidas(tenant, db) -> int:
+    """Marcar como vencidas las cotizaciones pendientes y refrescar el dashboard"""
+    filas = CotizacionService.marcar_vencidas(db)
+    if filas:
+        DashboardService.refrescar(db)
+    return filas
+
+
+def archivar_antiguas(tenant, db) -> int:
+    """Archivar cotizaciones cerradas antiguas y compactar las bases si se movió algo"""
+    filas = ArchivoService.archivar(db)
+    if filas:
+        ArchivoService.mantenimiento(db.get_bind())
+        DashboardService.refrescar(db)
+    return filas
+
+
+def respaldar(tenant, db) -> int:
+    """Respaldo programado; devuelve los bytes escritos"""
+    return RespaldoService.crear_respaldo(tenant).bytes
+
+
+def purgar_idempotencia(tenant, db) -> int:
+    """Borrar las Idempotency-Key vencidas"""
+    return IdempotenciaService.purgar(db)
+
+
+def compactar_cambios(tenant, db) -> int:
+    """Borrar los cambios viejos que ya tienen uno más nuevo para la misma fila"""
+    return CambiosService.compactar(db)
+
+
+TAREAS = [
+    TareaPeriodica("vencimientos", float(os.getenv("VENCIMIENTOS_INTERVALO_SEGUNDOS", "300")), por_empresa(barrer_vencidas)),
+    TareaPeriodica("cambios", float(os.getenv("CAMBIOS_INTERVALO_SEGUNDOS", "86400")), por_empresa(compactar_cambios)),
+    TareaPeriodica("idempotencia", float(os.getenv("IDEMPOTENCIA_INTERVALO_SEGUNDOS", "3600")), por_empresa(purgar_idempotencia)),
+    # Deshabilitadas por defecto (0): se programan con ARCHIVO_INTERVALO_SEGUNDOS y RESPALDO_INTERVALO_SEGUNDOS
+    TareaPeriodica("archivo", float(os.getenv("ARCHIVO_INTERVALO_SEGUNDOS", "0")), por_empresa(archivar_antiguas)),
+    TareaPeriodica("respaldo", float(os.getenv("RESPALDO_INTERVALO_SEGUNDOS", "0")), por_empresa(respaldar)),
+]
+
+
+def iniciar_tareas() -> list:
+    """Lanzar las tareas habilitadas (intervalo > 0) en el event loop actual"""
+    return [asyncio.create_task(t.ciclo()) for t in TAREAS if t.intervalo_segundos > 0]
+
+
+async def detener_tareas(tareas: list):
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+
+
+def metricas_tareas() -> dict:
+    return {t.nombre: {"intervalo_segundos": t.intervalo_segundos, **asdict(t.metricas)} for t in TAREAS}
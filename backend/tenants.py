@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Request
+from sqlalchemy.orm import sessionmaker
+from database import Base, DB_DIR, DB_PATH, ARCHIVO_DB_PATH, engine, crear_engine
+from migraciones import aplicar_migraciones
+from services.pdf_assets import Marca, MARCA_POR_DEFECTO
+
+# ==============================================
+# EMPRESAS (MULTI-TENANT)
+# ==============================================
+# Cada empresa tiene su propia base SQLite (y su archivo), así que no comparten
+# locks, y su propia marca para los PDF. Se configuran en tenants.json:
+#
+#   {"por_defecto": "shizzo",
+#    "empresas": {
+#       "shizzo": {},
+#       "norte": {"db": "norte.db", "marca": {"cabecera": "static/norte/header.jpeg",
+#                                            "direccion": "...", "pago": ["..."]}}}}
+#
+# Sin ese archivo hay una sola empresa con la base y la marca de siempre.
+# La empresa de cada petición sale del encabezado X-Tenant o del subdominio.
+
+TENANTS_CONFIG = Path(os.getenv("TENANTS_CONFIG", Path(__file__).resolve().parent / "tenants.json"))
+TENANTS_MAX_MOTORES = int(os.getenv("TENANTS_MAX_MOTORES", "8"))  # Engines abiertos a la vez
+
+
+@dataclass(frozen=True)
+class Tenant:
+    codigo: str
+    db_path: Path
+    archivo_path: Path
+    marca: Marca = field(default=MARCA_POR_DEFECTO)
+
+
+def _cargar_tenants():
+    """Leer tenants.json; sin archivo, una sola empresa con la configuración actual"""
+    if not TENANTS_CONFIG.exists():
+        return MARCA_POR_DEFECTO.codigo, {
+            MARCA_POR_DEFECTO.codigo: Tenant(MARCA_POR_DEFECTO.codigo, DB_PATH, ARCHIVO_DB_PATH)
+        }
+
+    config = json.loads(TENANTS_CONFIG.read_text(encoding="utf-8"))
+    por_defecto = config.get("por_defecto", MARCA_POR_DEFECTO.codigo)
+    tenants = {}
+    for codigo, datos in config["empresas"].items():
+        if codigo == por_defecto and "db" not in datos:
+            db_path, archivo_path = DB_PATH, ARCHIVO_DB_PATH
+        else:
+            db_path = DB_DIR / datos.get("db", f"{codigo}.db")
+            archivo_path = DB_DIR / datos.get("archivo", f"{codigo}_archivo.db")
+        marca = dict(datos.get("marca", {}))
+        if "pago" in marca:
+            marca["pago"] = tuple(marca["pago"])
+        marca.setdefault("carpeta_pdf", MARCA_POR_DEFECTO.carpeta_pdf if codigo == por_defecto
+                         else os.path.join(MARCA_POR_DEFECTO.carpeta_pdf, codigo))
+        tenants[codigo] = Tenant(codigo, db_path, archivo_path, Marca(codigo=codigo, **marca))
+    if por_defecto not in tenants:
+        raise ValueError(f"tenants.json: la empresa por defecto '{por_defecto}' no está en 'empresas'")
+    return por_defecto, tenants
+
+
+TENANT_POR_DEFECTO, TENANTS = _cargar_tenants()
+
+
+# ====================== ENGINES ======================
+
+_motores = OrderedDict()  # codigo -> (engine, sessionmaker), el más reciente al final
+_preparados = set()       # Empresas con tablas y migraciones aplicadas en este proceso
+_preparando = {}          # codigo -> Lock de la empresa mientras se abre su engine
+_lock = threading.Lock()  # Solo protege los diccionarios: nunca se tiene durante E/S
+
+
+def sesiones(tenant: Tenant) -> sessionmaker:
+    """Fábrica de sesiones de la empresa; mantiene abiertos solo los engines más usados"""
+    with _lock:
+        abierto = _motores.get(tenant.codigo)
+        if abierto is not None:
+            _motores.move_to_end(tenant.codigo)
+            return abierto[1]
+        lock_empresa = _preparando.setdefault(tenant.codigo, threading.Lock())
+
+    # create_all y las migraciones de una empresa no detienen a las demás
+    with lock_empresa:
+        with _lock:
+            abierto = _motores.get(tenant.codigo)
+        if abierto is not None:
+            return abierto[1]  # Otro hilo lo abrió mientras se esperaba
+
+        if tenant.codigo == TENANT_POR_DEFECTO and tenant.db_path == DB_PATH:
+            motor = engine  # El de database.py: nunca se cierra
+        else:
+            motor = crear_engine(tenant.db_path, tenant.archivo_path)
+        if tenant.codigo not in _preparados:
+            Base.metadata.create_all(bind=motor)
+            aplicar_migraciones(motor)
+            _preparados.add(tenant.codigo)
+
+        # Los servicios leen la empresa y su marca desde `db.info`
+        fabrica = sessionmaker(autocommit=False, autoflush=False, bind=motor,
+                               info={"tenant": tenant.codigo, "marca": tenant.marca})
+        with _lock:
+            _motores[tenant.codigo] = (motor, fabrica)
+            _cerrar_sobrantes()
+        return fabrica
+
+
+def _cerrar_sobrantes():
+    """Cerrar los engines menos usados que sobren, saltando los que tienen conexiones en uso.
+
+    Un engine con sesiones abiertas no se cierra (ni cuenta como candidato): si todos
+    están ocupados se tolera pasar de TENANTS_MAX_MOTORES hasta que alguno quede libre.
+    """
+    for codigo in list(_motores)[:-1]:  # El recién abierto se queda
+        if len(_motores) <= TENANTS_MAX_MOTORES:
+            return
+        viejo, _ = _motores[codigo]
+        if viejo is engine or viejo.pool.checkedout():
+            continue
+        del _motores[codigo]
+        viejo.dispose()
+
+
+def motor(tenant: Tenant):
+    return sesiones(tenant).kw["bind"]
+
+
+# ====================== RESOLUCIÓN POR PETICIÓN ======================
+
+def resolver_tenant(encabezado: Optional[str], host: Optional[str]) -> Tenant:
+    """Empresa indicada por X-Tenant o, si no, por el subdominio (norte.ejemplo.com)"""
+    if encabezado:
+        tenant = TENANTS.get(encabezado.strip().lower())
+        if tenant is None:
+            raise HTTPException(status_code=404, detail=f"Empresa no encontrada: {encabezado}")
+        return tenant
+    if host:
+        subdominio = host.split(":")[0].split(".")[0].lower()
+        if subdominio in TENANTS:
+            return TENANTS[subdominio]
+    return TENANTS[TENANT_POR_DEFECTO]
+
+
+def tenant_de_peticion(request: Request) -> Tenant:
+    return resolver_tenant(request.headers.get("x-tenant"), request.headers.get("host"))
+
+
+def get_db(request: Request):
+    """Sesión de la base de la empresa que hace la petición"""
+    db = sesiones(tenant_de_peticion(request))()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+# ==============================================
+# ENTORNO DE PRUEBAS
+# ==============================================
+# La app lee sus rutas al importarse: antes de importarla se apunta a bases
+# SQLite temporales y a un tenants.json inexistente (una sola empresa). Las
+# rutas de static/ son relativas, así que las pruebas corren desde backend/.
+
+BACKEND = Path(__file__).resolve().parent.parent
+TEMPORAL = Path(tempfile.mkdtemp(prefix="shizzo-pruebas-"))
+
+os.environ["DB_PATH"] = str(TEMPORAL / "shizzo.db")
+os.environ["ARCHIVO_DB_PATH"] = str(TEMPORAL / "shizzo_archivo.db")
+os.environ["TENANTS_CONFIG"] = str(TEMPORAL / "tenants.json")
+sys.path.insert(0, str(BACKEND))
+os.chdir(BACKEND)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from main import app  # noqa: E402
+from services.pdf_assets import MARCA_POR_DEFECTO  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEMPORAL, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def api():
+    # Sin `with`: no arrancan las tareas periódicas del lifespan
+    return TestClient(app)
+
+
+@pytest.fixture
+def tipo(api):
+    codigo = uuid.uuid4().hex[:8].upper()
+    respuesta = api.post("/api/tipos-cotizacion", json={"nombre": f"Tipo {codigo}", "codigo": codigo})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+@pytest.fixture
+def cliente(api):
+    respuesta = api.post("/api/clientes", json={"nombre": f"Cliente {uuid.uuid4().hex[:8]}"})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+@pytest.fixture
+def pdfs_generados():
+    """Borrar al final los PDF que la prueba genere en la carpeta de la marca"""
+    carpeta = BACKEND / MARCA_POR_DEFECTO.carpeta_pdf
+    antes = set(carpeta.glob("*.pdf"))
+    yield carpeta
+    for ruta in set(carpeta.glob("*.pdf")) - antes:
+        ruta.unlink()
+
+
+def datos_cotizacion(cliente, tipo, items=None, **extra):
+    return {
+        "cliente_id": cliente["id"],
+        "tipo_id": tipo["id"],
+        "descripcion": "Cotización de prueba",
+        "vigencia_dias": 15,
+        "items": items if items is not None else [
+            {"alcance": "Instalación de luminarias", "monto": 1500.0},
+            {"alcance": "Cableado", "monto": 820.5, "descuento": 20.5},
+        ],
+        **extra,
+    }
+
+
+@pytest.fixture
+def cotizacion(api, cliente, tipo):
+    respuesta = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo))
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+def version_de_etag(etag: str) -> int:
+    """Versión de una ETag, con o sin el sufijo de la variante comprimida ("3-gzip")"""
+    return int(etag.strip('"').partition("-")[0])
+
+
+def datos_pdf(items=3, terminos=True):
+    """Datos de generar_pdf_con_datos para una cotización de `items` líneas"""
+    return {
+        "numero": "COT-PRUEBA-001",
+        "fecha_emision": "01/10/2026",
+        "fecha_vencimiento": "16/10/2026",
+        "vigencia_dias": 15,
+        "cliente": {
+            "nombre": "Ferretería El Progreso", "rnc": "1-09-45678-3", "correo": "ventas@ejemplo.com",
+            "telefono": "(809) 555-6789", "direccion": "Calle Duarte #45, Santiago",
+        },
+        "descripcion": "Suministro e instalación de materiales eléctricos.",
+        "items": [{"alcance": f"Item {i}: instalación de lámpara LED de 18W", "monto": 1000.0 + i}
+                  for i in range(items)],
+        "terminos": ["El pago se realiza contra entrega.", "Los precios incluyen transporte."] if terminos else [],
+        "subtotal": 1000.0 * items, "descuento": 0.0, "itbis": 180.0 * items, "tasa_itbis": "18",
+        "total": 1180.0 * items,
+    }
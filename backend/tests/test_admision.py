@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import middleware
+from middleware import ControlAdmision, MedidorLatencia, Presupuesto, grupo_de
+
+
+def test_grupos_de_rutas():
+    assert grupo_de("GET", "/api/cotizaciones/12/pdf") == "pdf"
+    assert grupo_de("GET", "/api/reportes/resumen") == "pesado"
+    assert grupo_de("GET", "/api/cotizaciones/12") == "crud"
+    assert grupo_de("GET", "/api/changes/stream") is None
+    assert grupo_de("GET", "/api/metricas/admision") is None
+    assert grupo_de("GET", "/static/logo.png") is None
+
+
+def test_presupuesto_cola_y_rechazo():
+    async def correr():
+        presupuesto = Presupuesto("prueba", concurrencia=1, cola=1)
+        assert await presupuesto.entrar()
+        segunda = asyncio.create_task(presupuesto.entrar())
+        await asyncio.sleep(0)
+        assert presupuesto.metricas()["en_cola"] == 1
+        # Cola llena: se rechaza sin esperar
+        assert not await presupuesto.entrar()
+        # Al salir la primera, el cupo pasa directo a la que esperaba
+        presupuesto.salir(50.0)
+        assert await segunda
+        presupuesto.salir(50.0)
+        return presupuesto.metricas()
+
+    metricas = asyncio.run(correr())
+    assert (metricas["activas"], metricas["admitidas"], metricas["rechazadas"]) == (0, 2, 1)
+
+
+def test_presupuesto_espera_vencida(monkeypatch):
+    monkeypatch.setattr(middleware, "ADMISION_ESPERA_S", 0.05)
+
+    async def correr():
+        presupuesto = Presupuesto("prueba", concurrencia=1, cola=5)
+        assert await presupuesto.entrar()
+        assert not await presupuesto.entrar()
+        return presupuesto.metricas()
+
+    metricas = asyncio.run(correr())
+    assert (metricas["en_cola"], metricas["rechazadas"]) == (0, 1)
+
+
+def test_saturado_responde_503_con_retry_after(monkeypatch):
+    monkeypatch.setitem(middleware.PRESUPUESTOS, "pdf", Presupuesto("pdf", concurrencia=1, cola=1))
+    corriendo = []
+
+    async def app(scope, receive, send):
+        corriendo.append(scope["path"])
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"%PDF"})
+
+    async def pedir(control):
+        mensajes = []
+
+        async def enviar(mensaje):
+            mensajes.append(mensaje)
+
+        scope = {"type": "http", "method": "GET", "path": "/api/cotizaciones/1/pdf", "headers": []}
+        await control(scope, None, enviar)
+        return mensajes
+
+    async def correr():
+        control = ControlAdmision(app)
+        return await asyncio.gather(*(pedir(control) for _ in range(3)))
+
+    respuestas = asyncio.run(correr())
+    estados = sorted(m[0]["status"] for m in respuestas)
+    assert estados == [200, 200, 503]
+    # La petición rechazada no llegó a la app
+    assert len(corriendo) == 2
+
+    rechazada = next(m for m in respuestas if m[0]["status"] == 503)
+    encabezados = dict(rechazada[0]["headers"])
+    assert int(encabezados[b"retry-after"]) >= 1
+    assert json.loads(rechazada[1]["body"])["detail"].startswith("Servidor ocupado (pdf)")
+    assert ControlAdmision.metricas()["pdf"]["rechazadas"] == 1
+
+
+def test_latencia_por_grupo(api, monkeypatch):
+    monkeypatch.setattr(MedidorLatencia, "_latencias", {})
+    for ms in range(1, 101):
+        MedidorLatencia.registrar("pdf", float(ms))
+
+    api.get("/api/dashboard/stats")
+    api.get("/api/reportes/resumen", params={"por": "tipo"})
+    metricas = api.get("/api/metricas/latencia").json()
+
+    assert metricas["pdf"] == {"peticiones": 100, "p50_ms": 51.0, "p95_ms": 96.0, "p99_ms": 100.0, "max_ms": 100.0}
+    assert metricas["crud"]["peticiones"] == 1
+    assert metricas["pesado"]["peticiones"] == 1
+    assert metricas["crud"]["p50_ms"] <= metricas["crud"]["max_ms"]
+    # La consulta de métricas se anota al terminar, en el grupo de las rutas sin límite
+    assert "otras" not in metricas
+    assert api.get("/api/metricas/latencia").json()["otras"]["peticiones"] == 1
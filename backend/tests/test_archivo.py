@@ -0,0 +1,86 @@
+from sqlalchemy import event, text
+from sqlalchemy.schema import CreateTable
+
+from conftest import datos_cotizacion
+from database import Base, crear_engine
+from migraciones import aplicar_migraciones
+from models import Cotizacion
+from services.archivo_service import ArchivoService
+
+_INSERTAR = ("INSERT INTO {tabla} ({id}numero, cliente_id, tipo_id, subtotal_centavos, descuento_centavos, "
+             "itbis_centavos, total_centavos, tasa_itbis_bp, version) VALUES ({valor_id}:numero, 1, 1, 0, 0, 0, 0, 1800, 1)")
+
+
+def _insertar(conn, numero, tabla="cotizaciones", id_=None):
+    sql = _INSERTAR.format(tabla=tabla, id="id, " if id_ else "", valor_id=":id, " if id_ else "")
+    conn.execute(text(sql), {"id": id_, "numero": numero})
+
+
+def test_id_archivado_no_se_reutiliza(api, cliente, tipo):
+    cerrada = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+    assert api.patch(f"/api/cotizaciones/{cerrada['id']}/estado", json={"estado": "rechazada"}).status_code == 200
+
+    # Es la cotización con el ID más alto y aun así se archiva
+    assert api.post("/api/mantenimiento/archivar", params={"dias": 0}).json()["archivadas"] >= 1
+    nueva = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+
+    assert nueva["id"] > cerrada["id"]
+    assert api.get(f"/api/cotizaciones/{cerrada['id']}").json()["numero"] == cerrada["numero"]
+    assert api.get(f"/api/cotizaciones/{nueva['id']}").json()["numero"] == nueva["numero"]
+
+
+def test_pdf_de_una_archivada_no_la_modifica(api, cliente, tipo, pdfs_generados):
+    cerrada = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+    api.patch(f"/api/cotizaciones/{cerrada['id']}/estado", json={"estado": "aprobada"})
+    assert api.post("/api/mantenimiento/archivar", params={"dias": 0}).json()["archivadas"] >= 1
+
+    respuesta = api.get(f"/api/cotizaciones/{cerrada['id']}/pdf")
+    assert respuesta.status_code == 200
+    assert respuesta.content.startswith(b"%PDF")
+    assert api.get(f"/api/cotizaciones/{cerrada['id']}").json()["pdf_path"] is None
+
+
+def test_migracion_agrega_autoincrement(tmp_path):
+    motor = crear_engine(tmp_path / "vieja.db", tmp_path / "vieja_archivo.db")
+    Base.metadata.create_all(bind=motor)
+    # Tabla como la creaban las versiones anteriores: sin AUTOINCREMENT
+    ddl = str(CreateTable(Cotizacion.__table__).compile(dialect=motor.dialect)).replace(" AUTOINCREMENT", "")
+    with motor.begin() as conn:
+        conn.execute(text("DROP TABLE cotizaciones"))
+        conn.execute(text(ddl))
+        _insertar(conn, "EST-0001", id_=1)
+        _insertar(conn, "EST-0007", id_=7)
+        _insertar(conn, "EST-0040", tabla="archivo.cotizaciones", id_=40)
+
+    sentencias = []
+    event.listen(motor, "before_cursor_execute", lambda conn, cursor, sql, *args: sentencias.append(sql))
+    aplicar_migraciones(motor)
+    # La reconstrucción no compacta la base al arrancar: eso queda para el mantenimiento
+    assert not [s for s in sentencias if s.lstrip().upper().startswith("VACUUM")]
+
+    with motor.begin() as conn:
+        definicion = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'cotizaciones'")).scalar()
+        assert "AUTOINCREMENT" in definicion
+        assert conn.execute(text("SELECT id, numero FROM cotizaciones ORDER BY id")).all() == [
+            (1, "EST-0001"), (7, "EST-0007")
+        ]
+        indices = {n for (n,) in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'cotizaciones'"
+        ))}
+        assert {"ix_cotizaciones_estado_vencimiento", "ix_cotizaciones_cliente_estado"} <= indices
+        # Las claves foráneas de los hijos siguen apuntando a `cotizaciones`
+        items = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'items_cotizacion'")).scalar()
+        assert "REFERENCES cotizaciones (id)" in items
+
+        _insertar(conn, "EST-NUEVA")
+        assert conn.execute(text("SELECT id FROM cotizaciones WHERE numero = 'EST-NUEVA'")).scalar() == 41
+
+    ArchivoService.mantenimiento(motor)
+    with motor.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA main.auto_vacuum").scalar() == 2
+        assert conn.exec_driver_sql("PRAGMA archivo.auto_vacuum").scalar() == 2
+    motor.dispose()
+
+
+def test_compactar_bajo_demanda(api):
+    assert api.post("/api/mantenimiento/compactar").status_code == 200
@@ -0,0 +1,90 @@
+import asyncio
+
+from sqlalchemy import text
+
+import main
+from conftest import datos_cotizacion
+from database import engine
+from tenants import TENANTS, TENANT_POR_DEFECTO
+
+
+def _ultimo():
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(id) FROM cambios")).scalar() or 0
+
+
+def test_paginas_por_token(api, cliente, tipo):
+    desde = _ultimo()
+    creadas = [api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()["id"] for _ in range(5)]
+
+    vistas, token, paginas = [], desde, 0
+    while True:
+        pagina = api.get("/api/changes", params={"since": token, "limite": 2}).json()
+        vistas += [c["id"] for c in pagina["cotizaciones"]]
+        token, paginas = pagina["token"], paginas + 1
+        if not pagina["hay_mas"]:
+            break
+    assert vistas == creadas
+    # Cada cotización nueva registra también el resumen de su cliente: 10 cambios
+    assert paginas == 5
+    assert token == _ultimo()
+
+    # Al día: nada nuevo y el mismo token
+    al_dia = api.get("/api/changes", params={"since": token}).json()
+    assert (al_dia["token"], al_dia["hay_mas"], al_dia["cotizaciones"]) == (token, False, [])
+
+
+def test_filtro_por_entidad(api, cliente, tipo):
+    desde = _ultimo()
+    otro = api.post("/api/clientes", json={"nombre": "Cliente del filtro"}).json()
+    api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo))
+
+    solo_clientes = api.get("/api/changes", params={"since": desde, "entidades": "cliente"}).json()
+    # `cliente` también: la cotización nueva cambió su resumen
+    assert [c["id"] for c in solo_clientes["clientes"]] == [cliente["id"], otro["id"]]
+    assert solo_clientes["cotizaciones"] == []
+    # El token avanza también sobre lo que el filtro dejó fuera
+    assert solo_clientes["token"] == _ultimo()
+
+    assert api.get("/api/changes", params={"entidades": "cliente,factura"}).status_code == 400
+
+
+def test_token_viejo_despues_de_compactar(api, cliente, tipo):
+    viejo = _ultimo()
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+    for descripcion in ("Primera", "Segunda", "Tercera"):
+        api.put(f"/api/cotizaciones/{cotizacion['id']}", json=datos_cotizacion(cliente, tipo, descripcion=descripcion))
+
+    db = main.sesiones(TENANTS[TENANT_POR_DEFECTO])()
+    try:
+        # Recientes: no se borra nada; con todo "viejo", solo queda el último de cada fila
+        assert main.CambiosService.compactar(db, dias=30) == 0
+        assert main.CambiosService.compactar(db, dias=-1) >= 3
+        assert main.CambiosService.compactar(db, dias=-1) == 0
+    finally:
+        db.close()
+
+    # El token de antes de compactar sigue recibiendo el estado actual
+    delta = api.get("/api/changes", params={"since": viejo}).json()
+    assert [(c["id"], c["descripcion"]) for c in delta["cotizaciones"]] == [(cotizacion["id"], "Tercera")]
+    assert delta["token"] == _ultimo()
+    completa = api.get("/api/changes", params={"since": 0, "limite": 2000}).json()
+    assert {cliente["id"], cotizacion["cliente_id"]} <= {c["id"] for c in completa["clientes"]}
+
+
+def test_token_desconocido(api):
+    # Un token que esta base nunca emitió (otra empresa, respaldo restaurado): 410
+    assert api.get("/api/changes", params={"since": _ultimo() + 100}).status_code == 410
+    assert api.get("/api/changes", params={"since": _ultimo()}).status_code == 200
+
+
+def test_stream_avisa_el_nuevo_token(api, cliente):
+    async def primer_evento():
+        eventos = main.eventos_cambios(TENANTS[TENANT_POR_DEFECTO], since=0, pausa=0.01)
+        try:
+            return await anext(eventos)
+        finally:
+            await eventos.aclose()
+
+    api.put(f"/api/clientes/{cliente['id']}", json={"nombre": "Para el stream"})
+    assert asyncio.run(primer_evento()) == f'event: cambios\ndata: {{"token": {_ultimo()}}}\n\n'
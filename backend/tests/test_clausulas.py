@@ -0,0 +1,77 @@
+from sqlalchemy import text
+
+from conftest import datos_cotizacion
+from database import Base, crear_engine, engine
+from migraciones import aplicar_migraciones
+
+CON_SALTOS = "Forma de pago:\n  - 50% al aprobar\n  - 50% contra entrega"
+
+
+def _terminos_guardados(cotizacion_id):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT clausula_id, texto FROM terminos_cotizacion WHERE cotizacion_id = :id ORDER BY orden"
+        ), {"id": cotizacion_id}).all()
+
+
+def test_texto_libre_queda_en_la_cotizacion_tal_cual(api, cliente, tipo):
+    respuesta = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, terminos=[{"texto": CON_SALTOS}]))
+    assert respuesta.status_code == 200, respuesta.text
+
+    assert [(t["clausula_id"], t["texto"]) for t in respuesta.json()["terminos"]] == [(None, CON_SALTOS)]
+    # No entra al catálogo compartido
+    assert CON_SALTOS not in {c["texto"] for c in api.get("/api/clausulas").json()}
+
+
+def test_texto_libre_que_coincide_con_el_catalogo(api, cliente, tipo):
+    clausula = api.post("/api/clausulas", json={"texto": "Garantía de 12 meses\nen mano de obra."}).json()
+    assert clausula["texto"] == "Garantía de 12 meses\nen mano de obra."
+
+    otro_formato = "Garantía de 12 meses en  mano de obra."
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, terminos=[
+        {"texto": clausula["texto"]},
+        {"texto": otro_formato},
+        {"clausula_id": clausula["id"], "texto": "Garantía de 24 meses."},
+    ])).json()
+
+    # Las tres referencian la cláusula; solo se copia el texto que no es idéntico
+    assert _terminos_guardados(cotizacion["id"]) == [
+        (clausula["id"], None),
+        (clausula["id"], otro_formato),
+        (clausula["id"], "Garantía de 24 meses."),
+    ]
+    assert [t["texto"] for t in cotizacion["terminos"]] == [clausula["texto"], otro_formato, "Garantía de 24 meses."]
+
+
+def test_migracion_conserva_el_formato(tmp_path):
+    motor = crear_engine(tmp_path / "vieja.db", tmp_path / "vieja_archivo.db")
+    Base.metadata.create_all(bind=motor)
+    # Tabla como la dejaban las versiones anteriores: el texto completo en cada término
+    with motor.begin() as conn:
+        conn.execute(text("DROP TABLE terminos_cotizacion"))
+        conn.execute(text("CREATE TABLE terminos_cotizacion (id INTEGER PRIMARY KEY, "
+                          "cotizacion_id INTEGER NOT NULL, texto TEXT NOT NULL, orden INTEGER)"))
+        for id_ in (1, 2):
+            conn.execute(text(
+                "INSERT INTO cotizaciones (id, numero, cliente_id, tipo_id, subtotal_centavos, descuento_centavos, "
+                "itbis_centavos, total_centavos, tasa_itbis_bp, version) VALUES (:id, :numero, 1, 1, 0, 0, 0, 0, 1800, 1)"
+            ), {"id": id_, "numero": f"EST-{id_}"})
+        conn.execute(text("INSERT INTO terminos_cotizacion (id, cotizacion_id, texto, orden) VALUES (:id, :c, :t, :o)"), [
+            {"id": 1, "c": 1, "t": CON_SALTOS, "o": 0},
+            {"id": 2, "c": 1, "t": "Solo para esta obra:\nacceso por el portón norte.", "o": 1},
+            {"id": 3, "c": 2, "t": CON_SALTOS.replace("\n", " "), "o": 0},
+        ])
+
+    aplicar_migraciones(motor)
+
+    with motor.begin() as conn:
+        # Solo el texto que usan dos cotizaciones entra al catálogo, con su formato original
+        catalogo = conn.execute(text("SELECT id, texto FROM clausulas_termino")).all()
+        assert [t for _, t in catalogo] == [CON_SALTOS]
+        clausula_id = catalogo[0][0]
+        assert conn.execute(text("SELECT id, clausula_id, texto FROM terminos_cotizacion ORDER BY id")).all() == [
+            (1, clausula_id, None),
+            (2, None, "Solo para esta obra:\nacceso por el portón norte."),
+            (3, clausula_id, CON_SALTOS.replace("\n", " ")),
+        ]
+    motor.dispose()
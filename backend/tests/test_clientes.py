@@ -0,0 +1,158 @@
+import logging
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from conftest import datos_cotizacion
+from database import Base, crear_engine, engine
+from migraciones import _rellenar_rnc_normalizado
+from models import Cliente
+from services.cliente_service import ClienteService
+from tenants import TENANTS, TENANT_POR_DEFECTO, sesiones
+
+
+def _importar(api, clientes):
+    respuesta = api.post("/api/clientes/lote", json={"clientes": clientes})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+def test_importar_por_correo(api):
+    correo = f"{uuid.uuid4().hex[:8]}@ejemplo.com"
+    creado = _importar(api, [{"nombre": "Por correo", "correo": correo}])["resultados"][0]
+    assert creado["resultado"] == "creado"
+
+    # Mismo correo con otras mayúsculas: se actualiza solo lo que cambió
+    cambio = _importar(api, [{"nombre": "Por correo", "correo": correo.upper(), "telefono": "809-555-0000"}])
+    assert cambio["resultados"][0] == {**creado, "resultado": "actualizado"}
+    igual = _importar(api, [{"nombre": "Por correo", "correo": correo.upper(), "telefono": "809-555-0000"}])
+    assert igual["resultados"][0]["resultado"] == "sin_cambios"
+
+    cliente = api.get(f"/api/clientes/{creado['id']}").json()
+    assert cliente["version"] == 2
+    assert cliente["telefono"] == "809-555-0000"
+    assert cliente["correo"] == correo.upper()
+
+
+def test_importar_mezcla_rnc_correo_y_sin_clave(api):
+    rnc = str(uuid.uuid4().int)[:9]
+    correo = f"{uuid.uuid4().hex[:8]}@ejemplo.com"
+    filas = [
+        {"nombre": "Con RNC", "rnc": rnc},
+        {"nombre": "Con correo", "correo": correo},
+        {"nombre": "Sin clave"},
+        {"nombre": "Con RNC (repetido)", "rnc": f"{rnc[0]}-{rnc[1:]}"},
+    ]
+    primera = _importar(api, filas)
+    assert (primera["creados"], primera["duplicados"]) == (3, 1)
+
+    segunda = _importar(api, filas[:2])
+    assert (segunda["creados"], segunda["actualizados"], segunda["sin_cambios"]) == (0, 1, 1)
+    assert api.get(f"/api/clientes/{segunda['resultados'][0]['id']}").json()["nombre"] == "Con RNC"
+
+
+def test_migracion_reporta_rnc_duplicados(tmp_path, caplog):
+    motor = crear_engine(tmp_path / "clientes.db", tmp_path / "clientes_archivo.db")
+    Base.metadata.create_all(bind=motor)
+    with motor.begin() as conn:
+        for nombre, rnc in (("Original", "1-01-00001-1"), ("Copia", "101000011"), ("Otro", "2-02-00002-2")):
+            conn.execute(text("INSERT INTO clientes (nombre, rnc, version, total_cotizaciones, aprobado_centavos) "
+                              "VALUES (:nombre, :rnc, 1, 0, 0)"), {"nombre": nombre, "rnc": rnc})
+        with caplog.at_level(logging.WARNING, logger="migraciones"):
+            _rellenar_rnc_normalizado(conn)
+
+    assert "el RNC 101000011 ya es del cliente 1" in caplog.text
+    with Session(motor) as db:
+        assert ClienteService.rnc_duplicados(db) == [{"cliente_id": 2, "rnc": "101000011", "en_uso_por": 1}]
+    motor.dispose()
+
+
+def test_resumen_clientes_lista_rnc_duplicados(api, cliente):
+    rnc = str(uuid.uuid4().int)[:9]
+    original = api.post("/api/clientes", json={"nombre": "Original", "rnc": rnc}).json()
+    # Como quedaría un duplicado anterior al índice único
+    with sesiones(TENANTS[TENANT_POR_DEFECTO])() as db:
+        copia = Cliente(nombre="Copia", rnc=f"{rnc[:3]}-{rnc[3:]}", rnc_normalizado=None)
+        db.add(copia)
+        db.commit()
+        copia_id = copia.id
+
+    resumen = api.post("/api/mantenimiento/resumen-clientes").json()
+    assert {"cliente_id": copia_id, "rnc": f"{rnc[:3]}-{rnc[3:]}", "en_uso_por": original["id"]} in resumen["rnc_duplicados"]
+    assert resumen["con_rnc_duplicado"] >= 1
+
+
+def test_rnc_de_un_cliente_desactivado(api):
+    rnc = str(uuid.uuid4().int)[:9]
+    original = api.post("/api/clientes", json={"nombre": "Antes", "rnc": rnc}).json()
+    assert api.delete(f"/api/clientes/{original['id']}").status_code == 200
+
+    # Otro cliente no puede tomar ese RNC: el mensaje dice de quién es
+    otro = api.post("/api/clientes", json={"nombre": "Otro"}).json()
+    respuesta = api.put(f"/api/clientes/{otro['id']}", json={"nombre": "Otro", "rnc": rnc})
+    assert respuesta.status_code == 400
+    assert "inactivo" in respuesta.json()["detail"]
+
+    # Crearlo de nuevo reactiva el cliente desactivado con los datos nuevos
+    de_nuevo = api.post("/api/clientes", json={"nombre": "Después", "rnc": f"{rnc[0]}-{rnc[1:]}"}).json()
+    assert (de_nuevo["id"], de_nuevo["nombre"], de_nuevo["activo"]) == (original["id"], "Después", True)
+    assert de_nuevo["version"] == original["version"] + 1
+    assert api.post("/api/clientes", json={"nombre": "Tercero", "rnc": rnc}).status_code == 400
+
+
+def test_rnc_repetido_en_carrera(api, monkeypatch):
+    rnc = str(uuid.uuid4().int)[:9]
+    primero = api.post("/api/clientes", json={"nombre": "Primero", "rnc": rnc}).json()
+    otro = api.post("/api/clientes", json={"nombre": "Otro"}).json()
+
+    # Como si la otra petición guardara el RNC justo después de la consulta: el índice único responde
+    monkeypatch.setattr(ClienteService, "cliente_con_rnc", staticmethod(lambda *args, **kwargs: None))
+    assert api.post("/api/clientes", json={"nombre": "Segundo", "rnc": rnc}).status_code == 400
+    assert api.put(f"/api/clientes/{otro['id']}", json={"nombre": "Otro", "rnc": rnc}).status_code == 400
+    assert api.get(f"/api/clientes/{primero['id']}").json()["nombre"] == "Primero"
+
+
+def _cambios_de_cliente(desde, cliente_id):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT operacion FROM cambios WHERE id > :desde AND entidad = 'cliente' AND entidad_id = :id ORDER BY id"
+        ), {"desde": desde, "id": cliente_id}).scalars().all()
+
+
+def test_resumen_de_cotizaciones_y_su_registro(api, cliente, tipo):
+    inicio = api.get("/api/changes", params={"since": 0, "entidades": "tipo"}).json()["token"]
+
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+    creado = api.get(f"/api/clientes/{cliente['id']}").json()
+    assert (creado["total_cotizaciones"], creado["monto_aprobado"]) == (1, 0)
+    assert creado["ultima_cotizacion"] is not None
+    # El resumen no es una edición: la versión del cliente no cambia, pero sí queda en el registro
+    assert creado["version"] == cliente["version"]
+    assert _cambios_de_cliente(inicio, cliente["id"]) == ["actualizar"]
+
+    api.patch(f"/api/cotizaciones/{cotizacion['id']}/estado", json={"estado": "aprobada"})
+    aprobado = api.get(f"/api/clientes/{cliente['id']}").json()
+    assert aprobado["monto_aprobado"] == pytest.approx(cotizacion["total"])
+    assert _cambios_de_cliente(inicio, cliente["id"]) == ["actualizar", "actualizar"]
+    delta = api.get("/api/changes", params={"since": inicio, "entidades": "cliente"}).json()
+    assert {c["id"]: c["monto_aprobado"] for c in delta["clientes"]}[cliente["id"]] == aprobado["monto_aprobado"]
+
+
+def test_reparar_resumen(api, cliente, tipo):
+    api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo))
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE clientes SET total_cotizaciones = 7 WHERE id = :id"), {"id": cliente["id"]})
+        desde = conn.execute(text("SELECT MAX(id) FROM cambios")).scalar()
+
+    revision = api.post("/api/mantenimiento/resumen-clientes").json()
+    assert cliente["id"] in [d["cliente_id"] for d in revision["diferencias"]]
+    assert revision["reparados"] == 0
+    assert api.get(f"/api/clientes/{cliente['id']}").json()["total_cotizaciones"] == 7
+
+    reparado = api.post("/api/mantenimiento/resumen-clientes", params={"reparar": True}).json()
+    assert reparado["reparados"] == reparado["con_diferencias"] >= 1
+    assert api.get(f"/api/clientes/{cliente['id']}").json()["total_cotizaciones"] == 1
+    assert _cambios_de_cliente(desde, cliente["id"]) == ["actualizar"]
+    assert api.post("/api/mantenimiento/resumen-clientes").json()["con_diferencias"] == 0
@@ -0,0 +1,128 @@
+import gzip
+
+from sqlalchemy import event
+
+import compresion
+from conftest import datos_cotizacion
+from database import engine
+from middleware import MedidorLatencia
+from services.cotizacion_service import CotizacionService
+
+GZIP = {"Accept-Encoding": "gzip"}
+SIN_COMPRIMIR = {"Accept-Encoding": "identity"}
+
+
+def _items(n):
+    return [{"alcance": f"Item {i}: canalización y cableado del nivel {i}", "monto": 100.0 + i} for i in range(n)]
+
+
+def test_etag_de_la_variante_comprimida(api, cliente, tipo):
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, _items(30))).json()
+    url = f"/api/cotizaciones/{cotizacion['id']}"
+
+    comprimida = api.get(url, headers=GZIP)
+    plana = api.get(url, headers=SIN_COMPRIMIR)
+    assert comprimida.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plana.headers
+    assert plana.headers["etag"] == f'"{cotizacion["version"]}"'
+    assert comprimida.headers["etag"] == f'"{cotizacion["version"]}-gzip"'
+    assert comprimida.json() == plana.json()
+
+    # La ETag de cualquiera de las dos variantes sirve como If-Match
+    datos = datos_cotizacion(cliente, tipo, _items(30), descripcion="Con ETag gzip")
+    respuesta = api.put(url, json=datos, headers={"If-Match": comprimida.headers["etag"]})
+    assert respuesta.status_code == 200, respuesta.text
+    respuesta = api.put(url, json=datos, headers={"If-Match": plana.headers["etag"]})
+    assert respuesta.status_code == 409
+    respuesta = api.put(url, json=datos, headers={"If-Match": f'"{cotizacion["version"]}-rar"'})
+    assert respuesta.status_code == 400
+
+
+def test_acierto_no_llama_al_endpoint_y_una_escritura_lo_invalida(api, cliente, tipo, monkeypatch):
+    api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, _items(30)))
+    llamadas = []
+    listar = CotizacionService.listar
+
+    def contar(db, *args, **kwargs):
+        llamadas.append(1)
+        return listar(db, *args, **kwargs)
+
+    monkeypatch.setattr(CotizacionService, "listar", staticmethod(contar))
+
+    primera = api.get("/api/cotizaciones", headers=GZIP)
+    desde_cache = compresion.metricas()["por_codificacion"]["gzip"]["desde_cache"]
+    segunda = api.get("/api/cotizaciones", headers=GZIP)
+    assert len(llamadas) == 1
+    assert segunda.content == primera.content
+    assert compresion.metricas()["por_codificacion"]["gzip"]["desde_cache"] == desde_cache + 1
+
+    # Otra codificación es otra entrada
+    api.get("/api/cotizaciones", headers=SIN_COMPRIMIR)
+    assert len(llamadas) == 2
+
+    # La escritura sube el token: la siguiente lectura vuelve al endpoint
+    nueva = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+    tercera = api.get("/api/cotizaciones", headers=GZIP)
+    assert len(llamadas) == 3
+    assert nueva["id"] in {c["id"] for c in tercera.json()}
+
+
+def test_rutas_fuera_de_la_cache():
+    assert compresion.cacheable("GET", "/api/cotizaciones/12/revisiones/3")
+    assert not compresion.cacheable("GET", "/api/dashboard/stats")
+    assert not compresion.cacheable("GET", "/api/reportes/resumen")
+    assert not compresion.cacheable("POST", "/api/cotizaciones")
+
+
+def test_etag_codificada():
+    assert compresion.etag_codificada(b'"5"', "br") == b'"5-br"'
+    assert compresion.etag_codificada(b'W/"5"', "gzip") == b'W/"5-gzip"'
+    assert gzip.decompress(compresion.comprimir(b"x" * 2000, "gzip")) == b"x" * 2000
+
+
+def test_token_recordado_sin_abrir_sesion(api, cliente, monkeypatch):
+    monkeypatch.setattr(compresion, "COMPRESION_TOKEN_SEGUNDOS", 60)
+    lecturas = []
+
+    def anotar(conn, cursor, sql, *args):
+        if sql.startswith("SELECT max(cambios.id) AS max_1"):
+            lecturas.append(sql)
+
+    event.listen(engine, "before_cursor_execute", anotar)
+    try:
+        api.get("/api/clientes", headers=GZIP)
+        api.get("/api/clientes", headers=GZIP)
+        api.get("/api/tipos-cotizacion", headers=GZIP)
+        assert len(lecturas) <= 1
+
+        # El commit de la escritura olvida el token: la siguiente lectura ve el cliente renombrado
+        api.put(f"/api/clientes/{cliente['id']}", json={"nombre": "Renombrado por la caché"})
+        lecturas.clear()
+        nombres = {c["nombre"] for c in api.get("/api/clientes", headers=GZIP).json()}
+        assert "Renombrado por la caché" in nombres
+        assert len(lecturas) == 1
+
+        # Vencida la vigencia se vuelve a leer (escrituras de otros procesos)
+        monkeypatch.setattr(compresion, "COMPRESION_TOKEN_SEGUNDOS", 0)
+        api.get("/api/clientes", headers=GZIP)
+        assert len(lecturas) == 2
+    finally:
+        event.remove(engine, "before_cursor_execute", anotar)
+
+
+def test_token_leido_durante_un_commit_no_se_recuerda():
+    gen = compresion.generacion("prueba")
+    compresion._olvidar_token(type("Sesion", (), {"info": {"tenant": "prueba"}})())
+    compresion.recordar_token("prueba", 41, gen)
+    assert compresion.token_recordado("prueba") is None
+    compresion.recordar_token("prueba", 42, compresion.generacion("prueba"))
+    assert compresion.token_recordado("prueba") == 42
+
+
+def test_aciertos_cuentan_en_la_latencia(api, monkeypatch):
+    api.get("/api/clientes", headers=GZIP)
+    monkeypatch.setattr(MedidorLatencia, "_latencias", {})
+    desde_cache = compresion.metricas()["por_codificacion"]["gzip"]["desde_cache"]
+    api.get("/api/clientes", headers=GZIP)
+    assert compresion.metricas()["por_codificacion"]["gzip"]["desde_cache"] == desde_cache + 1
+    assert MedidorLatencia.metricas()["crud"]["peticiones"] == 1
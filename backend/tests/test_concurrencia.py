@@ -0,0 +1,135 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, text
+
+from conftest import datos_cotizacion, version_de_etag
+from database import engine
+
+
+def _en_paralelo(*peticiones):
+    """Lanzar las peticiones a la vez (barrera) y devolver sus respuestas"""
+    barrera = threading.Barrier(len(peticiones))
+
+    def lanzar(peticion):
+        barrera.wait()
+        return peticion()
+
+    with ThreadPoolExecutor(len(peticiones)) as hilos:
+        return list(hilos.map(lanzar, peticiones))
+
+
+# ====================== COTIZACIONES ======================
+
+def test_cotizacion_dos_put_con_el_mismo_if_match(api, cliente, tipo, cotizacion):
+    url = f"/api/cotizaciones/{cotizacion['id']}"
+    encabezados = {"If-Match": f'"{cotizacion["version"]}"'}
+    respuestas = _en_paralelo(
+        lambda: api.put(url, json=datos_cotizacion(cliente, tipo, descripcion="Primera"), headers=encabezados),
+        lambda: api.put(url, json=datos_cotizacion(cliente, tipo, descripcion="Segunda"), headers=encabezados),
+    )
+
+    assert sorted(r.status_code for r in respuestas) == [200, 409]
+    ganadora = next(r for r in respuestas if r.status_code == 200)
+    assert version_de_etag(ganadora.headers["etag"]) == cotizacion["version"] + 1
+    actual = api.get(url).json()
+    assert actual["version"] == cotizacion["version"] + 1
+    assert actual["descripcion"] == ganadora.json()["descripcion"]
+
+
+def test_cotizacion_put_sin_if_match_gana_la_ultima(api, cliente, tipo, cotizacion):
+    url = f"/api/cotizaciones/{cotizacion['id']}"
+    for descripcion in ("Primera", "Segunda"):
+        respuesta = api.put(url, json=datos_cotizacion(cliente, tipo, descripcion=descripcion))
+        assert respuesta.status_code == 200
+
+    actual = api.get(url).json()
+    assert actual["descripcion"] == "Segunda"
+    assert actual["version"] == cotizacion["version"] + 2
+
+
+def test_cotizacion_put_inexistente(api, cliente, tipo):
+    respuesta = api.put("/api/cotizaciones/999999", json=datos_cotizacion(cliente, tipo), headers={"If-Match": '"1"'})
+    assert respuesta.status_code == 404
+
+
+def test_cotizacion_put_no_lee_la_fila_antes_del_update(api, cliente, tipo, cotizacion):
+    sentencias = []
+
+    def anotar(conn, cursor, sql, parametros, contexto, en_lote):
+        sentencias.append(" ".join(sql.split()))
+
+    event.listen(engine, "before_cursor_execute", anotar)
+    try:
+        respuesta = api.put(f"/api/cotizaciones/{cotizacion['id']}", json=datos_cotizacion(cliente, tipo),
+                            headers={"If-Match": f'"{cotizacion["version"]}"'})
+    finally:
+        event.remove(engine, "before_cursor_execute", anotar)
+
+    assert respuesta.status_code == 200
+    sobre_cotizaciones = [s for s in sentencias if s.startswith("UPDATE cotizaciones") or " FROM cotizaciones" in s]
+    # La primera vez que se toca la fila es el UPDATE condicional que la reserva
+    assert sobre_cotizaciones[0].startswith("UPDATE cotizaciones SET version")
+    assert "RETURNING" in sobre_cotizaciones[0]
+
+
+def test_cotizacion_put_cambia_de_cliente(api, cliente, tipo, cotizacion):
+    otro = api.post("/api/clientes", json={"nombre": "Cliente nuevo de la cotización"}).json()
+    respuesta = api.put(f"/api/cotizaciones/{cotizacion['id']}", json=datos_cotizacion(otro, tipo))
+    assert respuesta.status_code == 200
+
+    assert api.get(f"/api/clientes/{cliente['id']}").json()["total_cotizaciones"] == 0
+    assert api.get(f"/api/clientes/{otro['id']}").json()["total_cotizaciones"] == 1
+
+
+def test_generar_pdf_no_es_una_edicion(api, cotizacion, pdfs_generados):
+    url = f"/api/cotizaciones/{cotizacion['id']}"
+    with engine.connect() as conn:
+        antes = conn.execute(text("SELECT MAX(id) FROM cambios")).scalar()
+    for _ in range(2):
+        assert api.post(f"{url}/generar-pdf").status_code == 200
+    despues = api.get("/api/changes", params={"since": antes}).json()
+
+    # La ruta se guarda una vez (un solo cambio) y la versión no sube
+    assert [c["id"] for c in despues["cotizaciones"]] == [cotizacion["id"]]
+    assert despues["token"] == antes + 1
+    actual = api.get(url).json()
+    assert actual["pdf_path"] and actual["version"] == cotizacion["version"]
+
+
+def test_if_match_invalido(api, cliente, tipo, cotizacion):
+    respuesta = api.put(
+        f"/api/cotizaciones/{cotizacion['id']}", json=datos_cotizacion(cliente, tipo), headers={"If-Match": "abc"}
+    )
+    assert respuesta.status_code == 400
+
+
+# ====================== CLIENTES ======================
+
+def test_cliente_dos_put_con_el_mismo_if_match(api, cliente):
+    url = f"/api/clientes/{cliente['id']}"
+    encabezados = {"If-Match": f'W/"{cliente["version"]}"'}
+    respuestas = _en_paralelo(
+        lambda: api.put(url, json={"nombre": "Nombre A"}, headers=encabezados),
+        lambda: api.put(url, json={"nombre": "Nombre B"}, headers=encabezados),
+    )
+
+    assert sorted(r.status_code for r in respuestas) == [200, 409]
+    conflicto = next(r for r in respuestas if r.status_code == 409)
+    assert f"versión actual: {cliente['version'] + 1}" in conflicto.json()["detail"]
+    assert api.get(url).json()["nombre"] == next(r for r in respuestas if r.status_code == 200).json()["nombre"]
+
+
+def test_cliente_put_sin_if_match_gana_la_ultima(api, cliente):
+    url = f"/api/clientes/{cliente['id']}"
+    assert api.put(url, json={"nombre": "Primero"}).status_code == 200
+    respuesta = api.put(url, json={"nombre": "Segundo"})
+
+    assert respuesta.status_code == 200
+    assert version_de_etag(respuesta.headers["etag"]) == cliente["version"] + 2
+    assert api.get(url).json()["nombre"] == "Segundo"
+
+
+def test_cliente_put_inexistente(api):
+    respuesta = api.put("/api/clientes/999999", json={"nombre": "Nadie"}, headers={"If-Match": '"1"'})
+    assert respuesta.status_code == 404
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import datos_cotizacion, version_de_etag
+from database import engine
+
+
+@contextmanager
+def _consultas():
+    """Sentencias que corre el endpoint (sin la lectura del token de la caché comprimida)"""
+    sentencias = []
+
+    def anotar(conn, cursor, sql, *args):
+        if not sql.startswith("SELECT max(cambios.id) AS max_1"):
+            sentencias.append(sql)
+
+    event.listen(engine, "before_cursor_execute", anotar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(engine, "before_cursor_execute", anotar)
+
+
+def _editor(api, **params):
+    respuesta = api.get("/api/editor-cotizacion", params=params)
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta
+
+
+def test_bundle_con_catalogos_versionados(api, cliente, tipo):
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json()
+
+    with _consultas() as completa:
+        respuesta = _editor(api, cotizacion_id=cotizacion["id"])
+    datos = respuesta.json()
+    assert datos["cotizacion"]["numero"] == cotizacion["numero"]
+    assert version_de_etag(respuesta.headers["etag"]) == cotizacion["version"]
+    assert cliente["id"] in {c["id"] for c in datos["clientes"]}
+    assert tipo["id"] in {t["id"] for t in datos["tipos"]}
+    assert datos["clausulas"] is not None
+    # Versiones, cotización con items y términos, y los tres catálogos
+    assert len(completa) == 7
+
+    versiones = {f"{catalogo}_version": v for catalogo, v in datos["versiones"].items()}
+    with _consultas() as vigente:
+        al_dia = _editor(api, cotizacion_id=cotizacion["id"], **versiones).json()
+    assert (al_dia["clientes"], al_dia["tipos"], al_dia["clausulas"]) == (None, None, None)
+    assert al_dia["cotizacion"]["id"] == cotizacion["id"]
+    assert len(vigente) == 4
+
+    # Solo vuelve el catálogo que cambió
+    api.put(f"/api/clientes/{cliente['id']}", json={"nombre": "Cliente renombrado"})
+    cambio = _editor(api, cotizacion_id=cotizacion["id"], **versiones).json()
+    assert cambio["versiones"]["clientes"] > datos["versiones"]["clientes"]
+    assert "Cliente renombrado" in {c["nombre"] for c in cambio["clientes"]}
+    assert (cambio["tipos"], cambio["clausulas"]) == (None, None)
+
+
+def test_bundle_sin_cotizacion_y_404(api):
+    respuesta = _editor(api)
+    assert respuesta.json()["cotizacion"] is None
+    assert "etag" not in respuesta.headers
+
+    assert api.get("/api/editor-cotizacion", params={"cotizacion_id": 999999}).status_code == 404
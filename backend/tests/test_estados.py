@@ -0,0 +1,38 @@
+from conftest import datos_cotizacion, version_de_etag
+
+
+def _crear(api, cliente, tipo, cantidad):
+    return [api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo)).json() for _ in range(cantidad)]
+
+
+def test_cambio_individual_acepta_cualquier_estado(api, cotizacion):
+    url = f"/api/cotizaciones/{cotizacion['id']}/estado"
+    assert api.patch(url, json={"estado": "aprobada"}).status_code == 200
+    # Fuera de TRANSICIONES (aprobada -> rechazada): corrección manual permitida
+    respuesta = api.patch(url, json={"estado": "rechazada"})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["cotizacion"]["estado"] == "rechazada"
+    assert version_de_etag(respuesta.headers["etag"]) == cotizacion["version"] + 2
+
+    assert api.patch(url, json={"estado": "archivada"}).status_code == 400
+    assert api.patch(url, json={"estado": "pendiente"}, headers={"If-Match": '"1"'}).status_code == 409
+    assert api.patch("/api/cotizaciones/999999/estado", json={"estado": "aprobada"}).status_code == 404
+
+
+def test_cambio_en_lote_respeta_transiciones(api, cliente, tipo):
+    aprobada, pendiente, otra = _crear(api, cliente, tipo, 3)
+    api.patch(f"/api/cotizaciones/{aprobada['id']}/estado", json={"estado": "aprobada"})
+
+    respuesta = api.patch("/api/cotizaciones/estado", json={"cambios": [
+        {"cotizacion_id": aprobada["id"], "estado": "rechazada"},
+        {"cotizacion_id": pendiente["id"], "estado": "rechazada"},
+        {"cotizacion_id": otra["id"], "estado": "aprobada", "version": otra["version"] + 5},
+        {"cotizacion_id": 999999, "estado": "aprobada"},
+    ]})
+    assert respuesta.status_code == 200
+    resumen = respuesta.json()
+    assert resumen["actualizadas"] == 1
+    motivos = {e["id"]: e["motivo"] for e in resumen["errores"]}
+    assert motivos == {aprobada["id"]: "transicion_invalida", otra["id"]: "conflicto_version",
+                       999999: "no_encontrada"}
+    assert api.get(f"/api/cotizaciones/{pendiente['id']}").json()["estado"] == "rechazada"
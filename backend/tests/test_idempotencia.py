@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+
+from sqlalchemy import text
+
+import middleware
+from database import engine
+from middleware import Idempotencia
+from services.idempotencia_service import IdempotenciaService
+from tenants import TENANTS, TENANT_POR_DEFECTO, sesiones
+
+
+def _clave():
+    return uuid.uuid4().hex
+
+
+def test_repetir_devuelve_la_primera_respuesta(api):
+    clave = _clave()
+    datos = {"nombre": f"Cliente idempotente {clave[:8]}"}
+    primera = api.post("/api/clientes", json=datos, headers={"Idempotency-Key": clave})
+    segunda = api.post("/api/clientes", json=datos, headers={"Idempotency-Key": clave})
+
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.content == primera.content
+    assert segunda.headers["idempotent-replayed"] == "true"
+    assert segunda.headers["content-type"] == "application/json"
+    assert int(segunda.headers["content-length"]) == len(segunda.content)
+    # Nada de la respuesta original más que tipo y cuerpo: Vary lo pone una sola vez la compresión
+    assert segunda.headers.get_list("vary") == ["Accept-Encoding"]
+    assert "etag" not in segunda.headers
+
+    creados = [c for c in api.get("/api/clientes").json() if c["nombre"] == datos["nombre"]]
+    assert len(creados) == 1
+
+
+def test_misma_clave_con_otro_cuerpo(api):
+    clave = _clave()
+    assert api.post("/api/clientes", json={"nombre": "Uno"}, headers={"Idempotency-Key": clave}).status_code == 200
+    respuesta = api.post("/api/clientes", json={"nombre": "Otro"}, headers={"Idempotency-Key": clave})
+    assert respuesta.status_code == 422
+
+
+def test_cuerpo_demasiado_grande(api, monkeypatch):
+    monkeypatch.setattr(middleware, "IDEMPOTENCIA_MAX_BYTES", 64)
+    datos = {"nombre": "x" * 100}
+    respuesta = api.post("/api/clientes", json=datos, headers={"Idempotency-Key": _clave()})
+    assert respuesta.status_code == 413
+    # Sin Idempotency-Key el límite no aplica
+    assert api.post("/api/clientes", json=datos).status_code == 200
+
+
+def test_solo_el_dueno_del_reclamo_guarda_o_suelta():
+    clave = _clave()
+    db = sesiones(TENANTS[TENANT_POR_DEFECTO])()
+    try:
+        assert IdempotenciaService.reclamar(db, clave, "h", "a") == ("nueva", None)
+        assert IdempotenciaService.reclamar(db, clave, "h", "b") == ("en_curso", None)
+        assert IdempotenciaService.guardar(db, clave, "b", 200, "application/json", b"{}") is False
+        IdempotenciaService.soltar(db, clave, "b")
+        assert IdempotenciaService.reclamar(db, clave, "h", "c") == ("en_curso", None)
+
+        # Reclamo vencido (proceso caído): otro lo toma y el primero ya no puede guardar
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE claves_idempotencia SET expira = '2000-01-01' WHERE clave = :c"), {"c": clave})
+        assert IdempotenciaService.reclamar(db, clave, "h", "d") == ("nueva", None)
+        assert IdempotenciaService.guardar(db, clave, "a", 200, "application/json", b"{}") is False
+        assert IdempotenciaService.guardar(db, clave, "d", 201, "application/json", b"[]") is True
+        estado, fila = IdempotenciaService.reclamar(db, clave, "h", "e")
+        assert (estado, fila.estado_http, fila.cuerpo) == ("repetida", 201, b"[]")
+    finally:
+        db.close()
+
+
+def _scope(clave):
+    return {"type": "http", "method": "POST", "path": "/api/clientes",
+            "headers": [(b"idempotency-key", clave.encode()), (b"content-length", b"2")]}
+
+
+async def _recibir():
+    return {"type": "http.request", "body": b"{}", "more_body": False}
+
+
+def test_espera_en_el_mismo_proceso_acotada(monkeypatch):
+    monkeypatch.setattr(middleware, "IDEMPOTENCIA_ESPERA_S", 0.1)
+    clave = _clave()
+    enviados = []
+
+    async def no_llamar(scope, receive, send):
+        raise AssertionError("El duplicado no debe ejecutar el endpoint")
+
+    async def enviar(mensaje):
+        enviados.append(mensaje)
+
+    async def correr():
+        # Una primera ejecución en este proceso que no termina nunca
+        llave = (TENANT_POR_DEFECTO, clave)
+        Idempotencia._en_vuelo[llave] = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(Idempotencia(no_llamar)(_scope(clave), _recibir, enviar), 5)
+        finally:
+            Idempotencia._en_vuelo.pop(llave, None)
+
+    asyncio.run(correr())
+    assert enviados[0]["status"] == 409
+
+
+def test_cancelada_no_deja_esperas_colgadas(monkeypatch):
+    clave = _clave()
+    llave = (TENANT_POR_DEFECTO, clave)
+    al_soltar = []
+    soltar = IdempotenciaService.soltar
+
+    def anotar_y_soltar(db, *args):
+        # Cuando se suelta el reclamo, los que esperan en el proceso ya tienen su respuesta
+        al_soltar.append(llave in Idempotencia._en_vuelo)
+        return soltar(db, *args)
+
+    monkeypatch.setattr(IdempotenciaService, "soltar", staticmethod(anotar_y_soltar))
+
+    async def lenta(scope, receive, send):
+        await asyncio.sleep(60)
+
+    async def enviar(mensaje):
+        pass
+
+    async def correr():
+        tarea = asyncio.create_task(Idempotencia(lenta)(_scope(clave), _recibir, enviar))
+        while llave not in Idempotencia._en_vuelo:
+            await asyncio.sleep(0.01)
+        primera = Idempotencia._en_vuelo[llave]
+        await asyncio.sleep(0.05)
+        tarea.cancel()  # Cliente desconectado
+        await asyncio.gather(tarea, return_exceptions=True)
+        return primera
+
+    primera = asyncio.run(correr())
+    assert primera.done() and primera.result() is None
+    assert llave not in Idempotencia._en_vuelo
+    assert al_soltar == [False]
+    # El reclamo se soltó: un reintento vuelve a ejecutar
+    db = sesiones(TENANTS[TENANT_POR_DEFECTO])()
+    try:
+        assert IdempotenciaService.reclamar(db, clave, "otra", "nuevo") == ("nueva", None)
+    finally:
+        db.close()
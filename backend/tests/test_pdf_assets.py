@@ -0,0 +1,75 @@
+from io import BytesIO
+
+import pymupdf
+import pytest
+from PIL import Image
+from reportlab import rl_config
+from reportlab.lib.units import mm
+
+from conftest import datos_pdf
+from services.pdf_assets import PERFILES, jpeg_para_caja, obtener_perfil
+from services.pdf_generator_reportlab import generar_pdf_con_datos
+
+
+def _generar(tmp_path, nombre, perfil):
+    with open(generar_pdf_con_datos(datos_pdf(), str(tmp_path / nombre), perfil=perfil), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def jpeg_grande(tmp_path):
+    ruta = tmp_path / "grande.jpeg"
+    Image.new("RGB", (3000, 3000), (219, 144, 31)).save(ruta, "JPEG", quality=95)
+    return str(ruta)
+
+
+def test_perfil_invalido():
+    with pytest.raises(ValueError):
+        obtener_perfil("poster")
+
+
+def test_remuestreo_segun_caja_y_perfil(jpeg_grande):
+    with open(jpeg_grande, "rb") as f:
+        original = f.read()
+    caja = (50 * mm, 50 * mm)  # ~2 pulgadas
+
+    assert jpeg_para_caja(jpeg_grande, *caja, obtener_perfil("archive")) == original
+    for perfil, lado in (("print", 591), ("screen", 217)):
+        with Image.open(BytesIO(jpeg_para_caja(jpeg_grande, *caja, obtener_perfil(perfil)))) as imagen:
+            assert imagen.size == (lado, lado)
+    # Nunca se agranda una imagen que ya está por debajo de la resolución del perfil
+    assert jpeg_para_caja(jpeg_grande, 2000 * mm, 2000 * mm, obtener_perfil("print")) == original
+
+
+def test_perfiles_de_salida(tmp_path):
+    screen = _generar(tmp_path, "screen.pdf", "screen")
+    impreso = _generar(tmp_path, "print.pdf", "print")
+    assert len(screen) < 0.75 * len(impreso)
+
+    # archive es invariante: la misma cotización da los mismos bytes
+    assert _generar(tmp_path, "a1.pdf", "archive") == _generar(tmp_path, "a2.pdf", "archive")
+
+
+def test_cada_perfil_cambia_la_salida(tmp_path):
+    pdfs = {perfil: pymupdf.open(stream=_generar(tmp_path, f"{perfil}.pdf", perfil)) for perfil in PERFILES}
+
+    def filtros(documento):
+        return {documento.xref_get_key(x, "Filter")[1] for pagina in documento for x in pagina.get_contents()}
+
+    def anchos(documento):
+        return sorted(imagen[2] for imagen in documento[0].get_images())
+
+    # print deja las páginas sin comprimir; screen y archive las comprimen
+    assert filtros(pdfs["print"]) == {"null"}
+    assert filtros(pdfs["screen"]) == filtros(pdfs["archive"]) == {"[/FlateDecode]"}
+    # screen remuestrea las imágenes; archive guarda las originales
+    assert all(s < a for s, a in zip(anchos(pdfs["screen"]), anchos(pdfs["archive"])))
+    # archive no lleva fecha de creación real (invariante)
+    assert pdfs["archive"].metadata["creationDate"] != pdfs["print"].metadata["creationDate"]
+
+
+def test_sin_ascii85_y_sin_tocar_la_configuracion_global(tmp_path):
+    antes = rl_config.useA85
+    pdf = _generar(tmp_path, "binario.pdf", "print")
+    assert b"ASCII85Decode" not in pdf
+    assert rl_config.useA85 == antes
@@ -0,0 +1,66 @@
+import tracemalloc
+
+import pymupdf
+import pytest
+
+from conftest import datos_pdf
+from services import pdf_generator_reportlab
+from services.pdf_generator_reportlab import PDF_ITEMS_GRANDE, generar_pdf_con_datos
+
+
+def _pico_mb(items, ruta):
+    """Pico de memoria de Python durante la generación (los datos ya están armados)"""
+    datos = datos_pdf(items=items)
+    tracemalloc.start()
+    try:
+        generar_pdf_con_datos(datos, ruta_salida=str(ruta))
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def test_memoria_plana_de_1000_a_10000_items(tmp_path):
+    pico_1k = _pico_mb(1000, tmp_path / "mil.pdf")
+    pico_10k = _pico_mb(10000, tmp_path / "diez_mil.pdf")
+    # Guardando las páginas hasta el final el pico pasaba de ~3 MB a ~16 MB;
+    # volcando cada página pasa de ~0.8 MB a ~1.5 MB
+    assert pico_10k - pico_1k < 4, (pico_1k, pico_10k)
+
+
+def test_modo_grande_numera_y_firma_cada_pagina(tmp_path):
+    ruta = generar_pdf_con_datos(datos_pdf(items=PDF_ITEMS_GRANDE + 100), ruta_salida=str(tmp_path / "grande.pdf"))
+    documento = pymupdf.open(ruta)
+    assert not documento.is_repaired  # xref y offsets escritos a mano: tienen que cuadrar
+    total = documento.page_count
+    assert total > 5
+    for numero, pagina in enumerate(documento, 1):
+        assert f"Página {numero} / {total}" in pagina.get_text()
+    # Firma solo en la última: una imagen más que las demás
+    assert len(documento[-1].get_images()) == len(documento[0].get_images()) + 1
+    textos = "".join(p.get_text() for p in documento)
+    assert f"Item {PDF_ITEMS_GRANDE + 99}:" in textos
+    assert not (tmp_path / "grande.pdf.parcial").exists()
+
+
+def test_modo_grande_invariante_en_archivo(tmp_path):
+    datos = datos_pdf(items=PDF_ITEMS_GRANDE)
+    primera = generar_pdf_con_datos(datos, ruta_salida=str(tmp_path / "a.pdf"), perfil="archive")
+    segunda = generar_pdf_con_datos(datos, ruta_salida=str(tmp_path / "b.pdf"), perfil="archive")
+    with open(primera, "rb") as a, open(segunda, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_error_no_deja_archivo_a_medias(tmp_path, monkeypatch):
+    fila_item = pdf_generator_reportlab.PDFGenerator._fila_item
+    filas = []
+
+    def fallar_a_la_mitad(self, item):
+        filas.append(item)
+        if len(filas) > PDF_ITEMS_GRANDE:
+            raise RuntimeError("falla de prueba")
+        return fila_item(self, item)
+
+    monkeypatch.setattr(pdf_generator_reportlab.PDFGenerator, "_fila_item", fallar_a_la_mitad)
+    with pytest.raises(RuntimeError):
+        generar_pdf_con_datos(datos_pdf(items=PDF_ITEMS_GRANDE * 2), ruta_salida=str(tmp_path / "rota.pdf"))
+    assert list(tmp_path.iterdir()) == []
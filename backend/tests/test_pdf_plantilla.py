@@ -0,0 +1,37 @@
+import re
+
+from conftest import datos_pdf
+from services.pdf_assets import obtener_perfil
+from services.pdf_generator_reportlab import generar_pdf_con_datos
+from services.pdf_plantilla import imagen_precompilada
+
+PAGINA = re.compile(rb"/Type /Page\b(?!s)")
+
+
+def _generar(tmp_path, nombre, items, perfil="print"):
+    ruta = generar_pdf_con_datos(datos_pdf(items), str(tmp_path / nombre), perfil=perfil)
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+def test_imagen_precompilada_una_vez_por_proceso():
+    perfil = obtener_perfil("print")
+    primera = imagen_precompilada("static/shizzosello.jpeg", 100, 100, perfil)
+    assert imagen_precompilada("static/shizzosello.jpeg", 100, 100, perfil) is primera
+    assert imagen_precompilada("static/shizzosello.jpeg", 100, 100, obtener_perfil("screen")) is not primera
+
+
+def test_cromo_fijo_se_incrusta_una_vez_por_documento(tmp_path):
+    # archive: imágenes originales como print, pero con las páginas comprimidas
+    corta = _generar(tmp_path, "corta.pdf", 3, perfil="archive")
+    larga = _generar(tmp_path, "larga.pdf", 150, perfil="archive")
+    paginas_corta, paginas_larga = len(PAGINA.findall(corta)), len(PAGINA.findall(larga))
+    assert paginas_larga >= paginas_corta + 4
+
+    # Imágenes y formas fijas: las mismas sin importar cuántas páginas las usan
+    for objeto in (rb"/Subtype /Image", rb"/Subtype /Form"):
+        assert larga.count(objeto) == corta.count(objeto)
+
+    # Cada página extra solo agrega su contenido propio (el membrete pesa mucho más)
+    por_pagina = (len(larga) - len(corta)) / (paginas_larga - paginas_corta)
+    assert por_pagina < 6 * 1024
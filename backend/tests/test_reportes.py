@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from conftest import datos_cotizacion
+from services import reportes_service
+from services.reportes_service import COLUMNAS, ESTADOS, Instantanea, ReportesService
+
+
+@pytest.fixture(autouse=True)
+def sin_espera(monkeypatch):
+    # Cada consulta revisa el registro de cambios: las pruebas ven lo recién escrito
+    monkeypatch.setattr(reportes_service, "REPORTES_REFRESCO_SEGUNDOS", 0)
+
+
+def _crear(api, cliente, tipo, estado=None, items=None):
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, items)).json()
+    if estado is not None:
+        respuesta = api.patch(f"/api/cotizaciones/{cotizacion['id']}/estado", json={"estado": estado})
+        assert respuesta.status_code == 200, respuesta.text
+    return cotizacion
+
+
+def test_resumen_y_conversion_incluyen_archivadas(api, tipo):
+    a = api.post("/api/clientes", json={"nombre": "Cliente A reportes"}).json()
+    b = api.post("/api/clientes", json={"nombre": "Cliente B reportes"}).json()
+    cotizaciones = [
+        _crear(api, a, tipo),
+        _crear(api, a, tipo, "aprobada", items=[{"alcance": "Tablero", "monto": 10000.1}]),
+        _crear(api, b, tipo, "rechazada"),
+    ]
+
+    def resumen():
+        respuesta = api.get("/api/reportes/resumen", params={"por": "cliente", "tipo_id": tipo["id"]})
+        assert respuesta.status_code == 200, respuesta.text
+        return respuesta.json()["filas"]
+
+    filas = resumen()
+    assert [f["clave"] for f in filas] == sorted([a["id"], b["id"]])
+    por_cliente = {f["clave"]: f for f in filas}
+    assert por_cliente[a["id"]]["nombre"] == "Cliente A reportes"
+    assert por_cliente[a["id"]]["cotizaciones"] == 2
+    assert por_cliente[a["id"]]["items"] == 3
+    assert por_cliente[a["id"]]["total"] == pytest.approx(cotizaciones[0]["total"] + cotizaciones[1]["total"])
+    assert por_cliente[b["id"]]["total"] == pytest.approx(cotizaciones[2]["total"])
+
+    conversion = {f["clave"]: f for f in api.get("/api/reportes/conversion", params={"por": "tipo"}).json()["filas"]}
+    fila = conversion[tipo["id"]]
+    assert (fila["pendiente"], fila["aprobada"], fila["rechazada"]) == (1, 1, 1)
+    assert fila["tasa_aprobacion"] == 0.5
+
+    top = api.get("/api/reportes/top-clientes", params={"n": 1000}).json()["filas"]
+    ids = [f["cliente_id"] for f in top]
+    assert ids.index(a["id"]) < ids.index(b["id"])
+
+    # Las archivadas siguen contando
+    assert api.post("/api/mantenimiento/archivar", params={"dias": 0}).json()["archivadas"] >= 2
+    assert resumen() == filas
+
+
+def test_filtros_invalidos(api):
+    assert api.get("/api/reportes/resumen", params={"desde": "2025/03"}).status_code == 400
+    assert api.get("/api/reportes/resumen", params={"estado": "borrador"}).status_code == 400
+    assert api.get("/api/reportes/conversion", params={"por": "estado"}).status_code == 400
+
+
+def test_agrupacion_vectorizada_igual_a_recorrido():
+    generador = np.random.default_rng(7)
+    filas = [
+        (int(generador.integers(1, 5)), int(generador.integers(1, 40)), int(generador.integers(0, len(ESTADOS))),
+         int(generador.choice([202501, 202502, 202503])), 0, 0,
+         # Totales grandes: bincount con weights (float64) ya no sumaría exacto
+         2 ** 53 + int(generador.integers(0, 1000)), 1, 0, 0)
+        for _ in range(500)
+    ]
+    inst = Instantanea(capacidad=16)
+    inst.cargar(list(range(1, len(filas) + 1)), filas)
+    inst.quitar(3)
+    assert len(inst.columna("estado")) == 500
+
+    mascara = ReportesService._mascara(inst, desde="2025-02", estado="pendiente")
+    claves, grupo, cantidades = ReportesService._agrupar(inst, "cliente_id", mascara)
+    totales = ReportesService._sumar(inst, "total", mascara, grupo, len(claves))
+
+    esperado = {}
+    pendiente = ESTADOS.index("pendiente")
+    for pos, fila in enumerate(filas):
+        if pos == 2 or fila[2] != pendiente or fila[3] < 202502:
+            continue
+        cantidad, total = esperado.get(fila[1], (0, 0))
+        esperado[fila[1]] = (cantidad + 1, total + fila[6])
+    assert dict(zip(claves.tolist(), zip(cantidades.tolist(), totales.tolist()))) == esperado
+
+
+def test_instantanea_crece_y_actualiza():
+    inst = Instantanea(capacidad=1)
+    ceros = (0,) * len(COLUMNAS)
+    for cotizacion_id in range(1, 6):
+        inst.poner(cotizacion_id, ceros)
+    inst.poner(2, (7,) + ceros[1:])
+    assert len(inst) == 5
+    assert inst.columna("tipo_id").tolist() == [0, 7, 0, 0, 0]
+    assert len(inst.estado) >= 5
+
+
+def test_compactar_libera_las_posiciones():
+    ceros = (0,) * len(COLUMNAS)
+    inst = Instantanea(capacidad=1)
+    for cotizacion_id in range(1, 11):
+        inst.poner(cotizacion_id, (cotizacion_id,) + ceros[1:])
+    for cotizacion_id in (2, 5, 9):
+        inst.quitar(cotizacion_id)
+    assert (len(inst), inst.libres()) == (7, 3)
+
+    inst.compactar()
+    assert (len(inst), inst.libres(), inst.usadas) == (7, 0, 7)
+    assert inst.columna("tipo_id").tolist() == [1, 3, 4, 6, 7, 8, 10]
+    assert inst.columna("tipo_id")[inst.posicion[8]] == 8
+    inst.poner(11, (11,) + ceros[1:])
+    assert inst.columna("tipo_id").tolist()[-1] == 11
+
+
+def test_lock_por_empresa_e_instantaneas_inactivas(api, cliente, tipo, monkeypatch):
+    _crear(api, cliente, tipo)
+    # Otra empresa cargando su instantánea no detiene los reportes de esta
+    with ReportesService._lock_de("sqlite:///otra-empresa.db"):
+        assert api.get("/api/reportes/resumen", params={"por": "tipo"}).status_code == 200
+
+    vieja = Instantanea()
+    vieja.usada -= 10
+    ReportesService._instantaneas["sqlite:///otra-empresa.db"] = vieja
+    ReportesService._resultados["sqlite:///otra-empresa.db"] = (0, {})
+    monkeypatch.setattr(reportes_service, "REPORTES_INACTIVA_SEGUNDOS", 5)
+    assert api.get("/api/reportes/resumen", params={"por": "mes"}).status_code == 200
+    assert "sqlite:///otra-empresa.db" not in ReportesService._instantaneas
+    assert "sqlite:///otra-empresa.db" not in ReportesService._resultados
+    assert api.get("/api/metricas/reportes").json()["cargada"] is True
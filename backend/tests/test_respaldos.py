@@ -0,0 +1,66 @@
+import gzip
+import sqlite3
+
+import pytest
+
+from middleware import grupo_de
+from services import respaldo_service
+from tenants import TENANTS, TENANT_POR_DEFECTO
+
+TOKEN = {"X-Respaldos-Token": "secreto"}
+
+
+@pytest.fixture
+def respaldos(monkeypatch, tmp_path):
+    monkeypatch.setattr(respaldo_service, "RESPALDOS_TOKEN", "secreto")
+    monkeypatch.setattr(respaldo_service, "RESPALDOS_DIR", tmp_path)
+    monkeypatch.setattr(respaldo_service, "RESPALDOS_MAXIMO", 2)
+    return tmp_path / TENANTS[TENANT_POR_DEFECTO].codigo
+
+
+def test_sin_token_no_hay_respaldos(api, monkeypatch):
+    monkeypatch.setattr(respaldo_service, "RESPALDOS_TOKEN", "")
+    assert api.post("/api/respaldos").status_code == 404
+    assert api.get("/api/respaldos").status_code == 404
+
+
+def test_token_invalido(api, respaldos):
+    assert api.post("/api/respaldos", headers={"X-Respaldos-Token": "otro"}).status_code == 403
+    assert api.get("/api/respaldos").status_code == 403
+    assert not respaldos.exists()
+
+
+def test_crear_y_rotar(api, respaldos, cliente):
+    # Dos juegos anteriores: con RESPALDOS_MAXIMO = 2 el más viejo sobra al crear uno nuevo
+    respaldos.mkdir(parents=True)
+    for marca in ("20200101-000000", "20200102-000000"):
+        for base in ("shizzo", "shizzo_archivo"):
+            (respaldos / f"{base}-{marca}.db.gz").write_bytes(b"")
+
+    respuesta = api.post("/api/respaldos", headers=TOKEN)
+    assert respuesta.status_code == 200, respuesta.text
+    resultado = respuesta.json()
+    assert len(resultado["archivos"]) == 2
+    assert resultado["bytes"] > 0
+
+    archivos = {p.name for p in respaldos.iterdir()}
+    assert archivos == set(resultado["archivos"]) | {"shizzo-20200102-000000.db.gz", "shizzo_archivo-20200102-000000.db.gz"}
+
+    # La copia es una base SQLite válida con los datos de la empresa
+    principal = respaldos / next(a for a in resultado["archivos"] if a.startswith("shizzo-"))
+    copia = respaldos / "copia.db"
+    copia.write_bytes(gzip.decompress(principal.read_bytes()))
+    conn = sqlite3.connect(copia)
+    try:
+        assert conn.execute("SELECT nombre FROM clientes WHERE id = ?", (cliente["id"],)).fetchone() == (cliente["nombre"],)
+    finally:
+        conn.close()
+
+    listado = api.get("/api/respaldos", headers=TOKEN).json()
+    assert listado["ultimo"]["nombre"] == resultado["nombre"]
+    assert listado["en_curso"] is False
+
+
+def test_respaldo_tiene_su_grupo_de_admision():
+    assert grupo_de("POST", "/api/respaldos") == "respaldo"
+    assert grupo_de("GET", "/api/respaldos") == "crud"
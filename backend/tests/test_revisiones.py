@@ -0,0 +1,74 @@
+import hashlib
+
+from sqlalchemy import text
+
+from conftest import datos_cotizacion
+from database import engine
+from services import revision_service
+from services.revision_service import RevisionService
+from tenants import TENANTS, TENANT_POR_DEFECTO, sesiones
+
+
+def _items(n, cambiado=None):
+    return [
+        # Textos distintos por item: una copia completa no se reduce a casi nada con zlib
+        {"alcance": f"Item {i}: luminaria modelo {hashlib.sha1(str(i).encode()).hexdigest()[:16]}",
+         "monto": 1000.0 + i + (0.5 if i == cambiado else 0)}
+        for i in range(n)
+    ]
+
+
+def test_deltas_ocupan_menos_y_reconstruyen_exacto(api, cliente, tipo):
+    cotizacion = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, _items(40))).json()
+    estados = {1: cotizacion["items"]}
+    for edicion in range(1, 12):
+        respuesta = api.put(
+            f"/api/cotizaciones/{cotizacion['id']}",
+            json=datos_cotizacion(cliente, tipo, _items(40, cambiado=edicion)),
+        )
+        assert respuesta.status_code == 200, respuesta.text
+        estados[edicion + 1] = respuesta.json()["items"]
+
+    revisiones = api.get(f"/api/cotizaciones/{cotizacion['id']}/revisiones").json()
+    assert [r["revision"] for r in revisiones] == list(range(1, 13))
+    completas = [r for r in revisiones if r["completa"]]
+    deltas = [r for r in revisiones if not r["completa"]]
+    # Revisión 1 y una de cada REVISION_COMPLETA_CADA
+    assert [r["revision"] for r in completas] == [1, 1 + revision_service.REVISION_COMPLETA_CADA]
+    # Un delta de un item cambiado es una fracción de la copia completa
+    assert max(r["bytes"] for r in deltas) * 4 < min(r["bytes"] for r in completas)
+    assert sum(r["bytes"] for r in revisiones) < 0.35 * completas[0]["bytes"] * len(revisiones)
+
+    for numero, items in estados.items():
+        revision = api.get(f"/api/cotizaciones/{cotizacion['id']}/revisiones/{numero}").json()
+        assert [(i["alcance"], i["monto"], i["descuento"]) for i in revision["items"]] == [
+            (i["alcance"], i["monto"], i["descuento"]) for i in items
+        ]
+
+    cambios = api.get(f"/api/cotizaciones/{cotizacion['id']}/revisiones/5/cambios").json()
+    # La revisión 5 deshace el cambio del item 3 y cambia el 4: un solo bloque contiguo
+    assert [
+        (b["posicion"], [i["monto"] for i in b["antes"]], [i["monto"] for i in b["despues"]])
+        for b in cambios["items"]
+    ] == [(3, [1003.5, 1004.0], [1003.0, 1004.5])]
+
+
+def test_revision_inexistente(api, cotizacion):
+    assert api.get(f"/api/cotizaciones/{cotizacion['id']}/revisiones/99").status_code == 404
+
+
+def test_base_repetida_no_choca(api, cotizacion):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM revisiones_cotizacion WHERE cotizacion_id = :id"), {"id": cotizacion["id"]})
+
+    # Como dos primeras ediciones a la vez: las dos intentan guardar la revisión 1
+    db = sesiones(TENANTS[TENANT_POR_DEFECTO])()
+    try:
+        assert RevisionService.guardar_base(db, cotizacion["id"], cotizacion["version"]) == 1
+        assert RevisionService.guardar_base(db, cotizacion["id"], cotizacion["version"]) == 1
+        db.commit()
+    finally:
+        db.close()
+
+    revisiones = api.get(f"/api/cotizaciones/{cotizacion['id']}/revisiones").json()
+    assert [(r["revision"], r["version"], r["completa"]) for r in revisiones] == [(1, cotizacion["version"], True)]
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+import tareas
+from database import engine
+from tareas import TareaPeriodica
+
+
+def _tarea(nombre):
+    return next(t for t in tareas.TAREAS if t.nombre == nombre)
+
+
+def test_barrido_marca_vencidas_y_anota_metricas(api, cotizacion):
+    ayer = datetime.now(timezone.utc) - timedelta(days=1)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cotizaciones SET fecha_vencimiento = :ayer WHERE id = :id"),
+                     {"ayer": ayer, "id": cotizacion["id"]})
+
+    vencimientos = _tarea("vencimientos")
+    antes = vencimientos.metricas.ejecuciones
+    filas = vencimientos.ejecutar()
+
+    actual = api.get(f"/api/cotizaciones/{cotizacion['id']}").json()
+    assert actual["estado"] == "vencida"
+    assert actual["version"] == cotizacion["version"] + 1
+    assert filas >= 1
+
+    metricas = api.get("/api/metricas/tareas").json()["vencimientos"]
+    assert metricas["ejecuciones"] == antes + 1
+    assert metricas["ultimas_filas"] == filas
+    assert metricas["ultima_ejecucion"] is not None
+    # Ya no queda nada por vencer
+    assert vencimientos.ejecutar() == 0
+
+
+def test_error_queda_en_las_metricas():
+    def fallar():
+        raise RuntimeError("base bloqueada")
+
+    tarea = TareaPeriodica("prueba", 60, fallar)
+    assert tarea.ejecutar() == 0
+    assert (tarea.metricas.ejecuciones, tarea.metricas.errores) == (1, 1)
+    assert tarea.metricas.ultimo_error == "base bloqueada"
+
+
+def test_ciclo_repite_hasta_cancelarse():
+    tarea = TareaPeriodica("prueba", 0.01, lambda: 2)
+
+    async def correr():
+        tareas_corriendo = [asyncio.create_task(tarea.ciclo())]
+        while tarea.metricas.filas_total < 6:
+            await asyncio.sleep(0.01)
+        await tareas.detener_tareas(tareas_corriendo)
+
+    asyncio.run(correr())
+    assert tarea.metricas.ejecuciones >= 3
+    assert tarea.metricas.filas_total >= 6
+
+
+def test_archivo_y_respaldo_solo_si_se_programan():
+    assert _tarea("archivo").intervalo_segundos == 0
+    assert _tarea("respaldo").intervalo_segundos == 0
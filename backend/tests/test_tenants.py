@@ -0,0 +1,124 @@
+import json
+import threading
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import tenants
+from database import DB_PATH, DB_DIR
+from tenants import Tenant, resolver_tenant, sesiones
+
+
+@pytest.fixture
+def empresas(monkeypatch, tmp_path):
+    norte, sur, este = (Tenant(c, tmp_path / f"{c}.db", tmp_path / f"{c}_archivo.db") for c in ("norte", "sur", "este"))
+    monkeypatch.setattr(tenants, "TENANTS", {**tenants.TENANTS, "norte": norte, "sur": sur, "este": este})
+    yield norte, sur, este
+    # No dejar engines abiertos hacia bases temporales
+    for tenant in (norte, sur, este):
+        abierto = tenants._motores.pop(tenant.codigo, None)
+        if abierto is not None:
+            abierto[0].dispose()
+        tenants._preparados.discard(tenant.codigo)
+        tenants._preparando.pop(tenant.codigo, None)
+
+
+def test_resolver_por_encabezado_y_subdominio(empresas):
+    norte, sur, _ = empresas
+    por_defecto = tenants.TENANTS[tenants.TENANT_POR_DEFECTO]
+
+    assert resolver_tenant("Norte ", None) is norte
+    assert resolver_tenant("norte", "sur.ejemplo.com") is norte  # El encabezado manda
+    assert resolver_tenant(None, "sur.ejemplo.com:8000") is sur
+    assert resolver_tenant(None, "www.ejemplo.com") is por_defecto
+    assert resolver_tenant(None, None) is por_defecto
+
+    with pytest.raises(HTTPException) as error:
+        resolver_tenant("oeste", None)
+    assert error.value.status_code == 404
+
+
+def test_empresa_desconocida_responde_404(api):
+    assert api.get("/api/clientes", headers={"X-Tenant": "oeste"}).status_code == 404
+
+
+def test_cargar_tenants_json(monkeypatch, tmp_path):
+    config = tmp_path / "tenants.json"
+    config.write_text(json.dumps({
+        "por_defecto": "shizzo",
+        "empresas": {
+            "shizzo": {},
+            "norte": {"db": "norte.db", "marca": {"direccion": "Santiago", "pago": ["Efectivo"]}},
+        },
+    }), encoding="utf-8")
+    monkeypatch.setattr(tenants, "TENANTS_CONFIG", config)
+
+    por_defecto, cargados = tenants._cargar_tenants()
+    assert por_defecto == "shizzo"
+    assert cargados["shizzo"].db_path == DB_PATH
+    norte = cargados["norte"]
+    assert (norte.db_path, norte.archivo_path) == (DB_DIR / "norte.db", DB_DIR / "norte_archivo.db")
+    assert norte.marca.codigo == "norte"
+    assert norte.marca.direccion == "Santiago"
+    assert norte.marca.pago == ("Efectivo",)
+    assert norte.marca.carpeta_pdf.endswith("norte")
+
+    config.write_text(json.dumps({"por_defecto": "oeste", "empresas": {"norte": {}}}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        tenants._cargar_tenants()
+
+    monkeypatch.setattr(tenants, "TENANTS_CONFIG", tmp_path / "no-existe.json")
+    por_defecto, cargados = tenants._cargar_tenants()
+    assert list(cargados) == [por_defecto]
+
+
+def test_preparar_una_empresa_no_detiene_a_las_demas(empresas, monkeypatch):
+    norte, sur, _ = empresas
+    en_migracion, seguir = threading.Event(), threading.Event()
+    migrar = tenants.aplicar_migraciones
+
+    def migracion_lenta(motor):
+        if str(norte.db_path) in str(motor.url):
+            en_migracion.set()
+            seguir.wait(5)
+        migrar(motor)
+
+    monkeypatch.setattr(tenants, "aplicar_migraciones", migracion_lenta)
+    hilo = threading.Thread(target=sesiones, args=(norte,))
+    hilo.start()
+    try:
+        assert en_migracion.wait(5)
+        # Mientras norte migra, sur y la empresa por defecto abren sin esperar
+        db = sesiones(sur)()
+        try:
+            assert db.execute(text("SELECT COUNT(*) FROM clientes")).scalar() == 0
+        finally:
+            db.close()
+        sesiones(tenants.TENANTS[tenants.TENANT_POR_DEFECTO])
+    finally:
+        seguir.set()
+        hilo.join(5)
+    assert "norte" in tenants._motores
+
+
+def test_no_se_cierra_un_engine_en_uso(empresas, monkeypatch):
+    norte, sur, este = empresas
+    # La empresa por defecto ocupa uno de los dos
+    monkeypatch.setattr(tenants, "TENANTS_MAX_MOTORES", 2)
+
+    db = sesiones(norte)()
+    try:
+        db.execute(text("SELECT 1"))  # Conexión tomada del pool
+        sesiones(sur)
+        # Norte tiene una sesión en curso: sigue abierto aunque sobre
+        assert "norte" in tenants._motores
+        assert db.execute(text("SELECT COUNT(*) FROM clientes")).scalar() == 0
+    finally:
+        db.close()
+
+    # Ya libre, norte se cierra al abrir la siguiente empresa
+    sesiones(este)
+    assert "norte" not in tenants._motores
+    assert list(tenants._motores)[-1] == "este"
+    assert len(tenants._motores) == 2
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, literal, select
+
+from conftest import datos_cotizacion
+from services.totales import a_centavos, calcular_itbis, calcular_totales, linea_en_centavos, sql_calcular_itbis
+
+
+def test_totales_exactos_en_centavos():
+    lineas = [linea_en_centavos(0.1), linea_en_centavos(0.2), linea_en_centavos("1000.005", "0.01")]
+    totales = calcular_totales(lineas, 1800)
+
+    assert (totales.subtotal, totales.descuento) == (100031, 1)
+    assert totales.itbis == 18005                     # 18% de 1000.30 = 180.054
+    assert totales.total == 100030 + 18005
+
+
+@pytest.mark.parametrize("modo, esperado", [("half_up", 1), ("half_even", 0)])
+def test_redondeo_del_medio_centavo(modo, esperado):
+    # 5 centavos al 10% = 0.5 centavos
+    assert calcular_itbis(5, 1000, modo) == esperado
+    assert a_centavos("0.125", modo) == (13 if modo == "half_up" else 12)
+
+
+def test_linea_invalida():
+    with pytest.raises(ValueError):
+        linea_en_centavos(10, 11)
+    with pytest.raises(ValueError):
+        linea_en_centavos("abc")
+
+
+@pytest.mark.parametrize("modo", ["half_up", "half_even"])
+def test_itbis_en_sql_igual_que_en_python(modo):
+    azar = random.Random(28)
+    casos = [(azar.randrange(0, 10**9), azar.choice([0, 1, 1000, 1650, 1800, 2500, 9999])) for _ in range(500)]
+    casos += [(5, 1000), (15, 1000), (25, 1000), (50000, 1)]
+    motor = create_engine("sqlite://")
+    with motor.connect() as conexion:
+        for base, tasa in casos:
+            en_sql = conexion.execute(select(sql_calcular_itbis(literal(base), literal(tasa), modo))).scalar()
+            assert en_sql == calcular_itbis(base, tasa, modo), (base, tasa)
+
+
+def test_cambio_de_tasa_retotaliza_solo_las_pendientes(api, cliente, tipo):
+    items = [{"alcance": f"Item {i}", "monto": 1234.56 + i, "descuento": 0.33 * i} for i in range(7)]
+    pendiente = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, items=items)).json()
+    aprobada = api.post("/api/cotizaciones", json=datos_cotizacion(cliente, tipo, items=items)).json()
+    assert api.patch(f"/api/cotizaciones/{aprobada['id']}/estado", json={"estado": "aprobada"}).status_code == 200
+    aprobada = api.get(f"/api/cotizaciones/{aprobada['id']}").json()
+
+    respuesta = api.put(f"/api/tipos-cotizacion/{tipo['id']}/tasa-itbis", json={"tasa_itbis_bp": 1650})
+    assert respuesta.json()["cotizaciones_recalculadas"] == 1
+
+    esperados = calcular_totales([linea_en_centavos(i["monto"], i["descuento"]) for i in items], 1650)
+    actual = api.get(f"/api/cotizaciones/{pendiente['id']}").json()
+    assert actual["tasa_itbis_bp"] == 1650
+    assert a_centavos(actual["itbis"]) == esperados.itbis
+    assert a_centavos(actual["total"]) == esperados.total
+    assert actual["version"] == pendiente["version"] + 1
+    sin_tocar = api.get(f"/api/cotizaciones/{aprobada['id']}").json()
+    campos = ("tasa_itbis_bp", "subtotal", "itbis", "total", "version")
+    assert {c: sin_tocar[c] for c in campos} == {c: aprobada[c] for c in campos}
+
+    # La misma tasa otra vez no cambia ningún total: nada que re-totalizar
+    respuesta = api.put(f"/api/tipos-cotizacion/{tipo['id']}/tasa-itbis", json={"tasa_itbis_bp": 1650})
+    assert respuesta.json()["cotizaciones_recalculadas"] == 0
@@ -46,7 +46,7 @@ export default function ClienteForm() {
   const mutation = useMutation({
     mutationFn: (data) => {
       if (isEditMode) {
-        return clienteService.update(id, data);
+        return clienteService.update(id, data, clienteData?.version);
       }
       return clienteService.create(data);
     },
@@ -59,9 +59,15 @@ export default function ClienteForm() {
       setTimeout(() => navigate('/clientes'), 1500);
     },
     onError: (error) => {
+      const conflicto = error.response?.status === 409;
+      if (conflicto) {
+        queryClient.invalidateQueries({ queryKey: ['cliente', id] });
+      }
       setToast({
         type: 'error',
-        message: 'Error al guardar el cliente'
+        message: conflicto
+          ? 'Otro usuario modificó este cliente. Se recargaron los datos, revisa y guarda de nuevo.'
+          : 'Error al guardar el cliente'
       });
       console.error('Error:', error);
     }
@@ -12,6 +12,11 @@ const api = axios.create({
 // Interceptor para logging (desarrollo)
 api.interceptors.request.use(
   (config) => {
+    // Cada POST lleva su Idempotency-Key; un reintento reutiliza la misma configuración
+    // (y la misma clave), así el backend no crea la cotización o el cliente dos veces
+    if (config.method === 'post' && !config.headers['Idempotency-Key']) {
+      config.headers['Idempotency-Key'] = crypto.randomUUID();
+    }
     console.log('📤 Request:', config.method.toUpperCase(), config.url);
     return config;
   },
@@ -26,7 +31,14 @@ api.interceptors.response.use(
     console.log('📥 Response:', response.status, response.config.url);
     return response;
   },
-  (error) => {
+  async (error) => {
+    // 503 del control de admisión: un GET se reintenta una vez tras Retry-After
+    const { config, response } = error;
+    if (response?.status === 503 && config?.method === 'get' && !config._reintentado) {
+      const segundos = Math.min(Number(response.headers['retry-after']) || 1, 10);
+      await new Promise((resolver) => setTimeout(resolver, segundos * 1000));
+      return api({ ...config, _reintentado: true });
+    }
     console.error('❌ API Error:', error.response?.data || error.message);
     return Promise.reject(error);
   }
@@ -0,0 +1,49 @@
+// Caché en memoria para los servicios
+// - Una sola petición en vuelo por clave: llamadas simultáneas comparten la promesa.
+// - Stale-while-revalidate: si hay un valor guardado se devuelve de inmediato y, si
+//   ya pasó `maxAge`, se vuelve a pedir en segundo plano (onRefresh recibe el nuevo).
+
+const entradas = new Map(); // clave -> { valor, guardado, promesa }
+
+const pedir = (clave, cargar) => {
+  const entrada = entradas.get(clave) || {};
+  if (!entrada.promesa) {
+    entrada.promesa = cargar()
+      .then((valor) => {
+        entradas.set(clave, { valor, guardado: Date.now(), promesa: null });
+        return valor;
+      })
+      .catch((error) => {
+        entrada.promesa = null;
+        throw error;
+      });
+    entradas.set(clave, entrada);
+  }
+  return entrada.promesa;
+};
+
+export const cache = {
+  obtener: (clave, cargar, { maxAge = 30000, onRefresh } = {}) => {
+    const entrada = entradas.get(clave);
+    if (!entrada || entrada.guardado === undefined) {
+      return pedir(clave, cargar);
+    }
+    if (Date.now() - entrada.guardado > maxAge) {
+      pedir(clave, cargar).then((valor) => onRefresh?.(valor)).catch(() => {});
+    }
+    return Promise.resolve(entrada.valor);
+  },
+
+  leer: (clave) => entradas.get(clave)?.valor,
+
+  guardar: (clave, valor) => {
+    entradas.set(clave, { valor, guardado: Date.now(), promesa: null });
+  },
+
+  // Borra las claves que empiezan con `prefijo` (todas si no se indica)
+  invalidar: (prefijo = '') => {
+    for (const clave of entradas.keys()) {
+      if (clave.startsWith(prefijo)) entradas.delete(clave);
+    }
+  },
+};
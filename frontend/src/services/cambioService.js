@@ -0,0 +1,32 @@
+import api from './api';
+
+export const cambioService = {
+  // Obtener solo lo que cambió después del token (0 = carga completa).
+  // entidades: opcional, p. ej. ['cliente', 'tipo']. Si la API no reconoce el token
+  // (410, p. ej. tras restaurar un respaldo) se hace la carga completa y la
+  // respuesta trae completa: true (reemplazar la caché)
+  getSince: async (token = 0, entidades = null) => {
+    const params = { since: token };
+    if (entidades) params.entidades = entidades.join(',');
+    try {
+      const response = await api.get('/changes', { params });
+      return response.data;
+    } catch (error) {
+      if (token && error.response?.status === 410) {
+        const response = await api.get('/changes', { params: { ...params, since: 0 } });
+        return { ...response.data, completa: true };
+      }
+      throw error;
+    }
+  },
+
+  // Suscribirse a avisos de nuevos cambios (Server-Sent Events)
+  // onToken recibe el token más reciente; devuelve una función para cerrar la conexión
+  subscribe: (token, onToken) => {
+    const source = new EventSource(`${api.defaults.baseURL}/changes/stream?since=${token}`);
+    source.addEventListener('cambios', (event) => {
+      onToken(JSON.parse(event.data).token);
+    });
+    return () => source.close();
+  },
+};
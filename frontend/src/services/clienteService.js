@@ -19,9 +19,10 @@ export const clienteService = {
     return response.data;
   },
   
-  // Actualizar cliente
-  update: async (id, clienteData) => {
-    const response = await api.put(`/clientes/${id}`, clienteData);
+  // Actualizar cliente (con version envía If-Match; el backend responde 409 si cambió)
+  update: async (id, clienteData, version) => {
+    const headers = version ? { 'If-Match': `"${version}"` } : {};
+    const response = await api.put(`/clientes/${id}`, clienteData, { headers });
     return response.data;
   },
   
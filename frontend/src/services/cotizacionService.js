@@ -1,4 +1,25 @@
 import api from './api';
+import { cache } from './cache';
+
+// Catálogos del editor guardados con su versión: el backend solo los reenvía si cambiaron
+const CATALOGOS = ['clientes', 'tipos', 'clausulas'];
+
+const cargarEditor = async (id) => {
+  const params = { cotizacion_id: id ?? undefined };
+  for (const nombre of CATALOGOS) {
+    const guardado = cache.leer(`catalogo:${nombre}`);
+    if (guardado) params[`${nombre}_version`] = guardado.version;
+  }
+  const response = await api.get('/editor-cotizacion', { params });
+  const datos = { cotizacion: response.data.cotizacion };
+  for (const nombre of CATALOGOS) {
+    if (response.data[nombre] !== null) {
+      cache.guardar(`catalogo:${nombre}`, { version: response.data.versiones[nombre], datos: response.data[nombre] });
+    }
+    datos[nombre] = cache.leer(`catalogo:${nombre}`).datos;
+  }
+  return datos;
+};
 
 export const cotizacionService = {
   // Obtener todas las cotizaciones
@@ -12,6 +33,12 @@ export const cotizacionService = {
     const response = await api.get(`/cotizaciones/${id}`);
     return response.data;
   },
+
+  // Datos del editor en una sola petición: { cotizacion, clientes, tipos, clausulas }
+  // (id vacío = cotización nueva). Se deduplica y, si está en caché, se devuelve al
+  // instante y se revalida; onRefresh recibe la versión nueva.
+  getEditor: (id, { onRefresh } = {}) =>
+    cache.obtener(`editor:${id ?? 'nueva'}`, () => cargarEditor(id), { maxAge: 10000, onRefresh }),
   
   // Crear cotización (sin PDF)
   create: async (cotizacionData) => {
@@ -19,8 +46,11 @@ export const cotizacionService = {
     return response.data;
   },
   
-    update: async (id, cotizacionData) => {
-    const response = await api.put(`/cotizaciones/${id}`, cotizacionData);
+  // Actualizar cotización (con version envía If-Match; el backend responde 409 si cambió)
+  update: async (id, cotizacionData, version) => {
+    const headers = version ? { 'If-Match': `"${version}"` } : {};
+    const response = await api.put(`/cotizaciones/${id}`, cotizacionData, { headers });
+    cache.invalidar(`editor:${id}`);
     return response.data;
   },
   // Generar PDF de cotización
@@ -30,11 +60,33 @@ export const cotizacionService = {
   },
   
   // Cambiar estado
-  cambiarEstado: async (id, estado) => {
-    const response = await api.patch(`/cotizaciones/${id}/estado`, { estado });
+  cambiarEstado: async (id, estado, version) => {
+    const headers = version ? { 'If-Match': `"${version}"` } : {};
+    const response = await api.patch(`/cotizaciones/${id}/estado`, { estado }, { headers });
+    cache.invalidar(`editor:${id}`);
+    return response.data;
+  },
+
+  // Cambiar el estado de varias cotizaciones: [{ cotizacion_id, estado, version? }]
+  cambiarEstados: async (cambios) => {
+    const response = await api.patch('/cotizaciones/estado', { cambios });
+    cache.invalidar('editor:');
     return response.data;
   },
   
+  // Historial de ediciones: [{ revision, version, completa, bytes, fecha }]
+  getRevisiones: async (id) => {
+    const response = await api.get(`/cotizaciones/${id}/revisiones`);
+    return response.data;
+  },
+
+  // Qué cambió en una revisión (contra la anterior, o contra `contra`)
+  getCambiosRevision: async (id, revision, contra) => {
+    const params = contra !== undefined ? { contra } : {};
+    const response = await api.get(`/cotizaciones/${id}/revisiones/${revision}/cambios`, { params });
+    return response.data;
+  },
+
   // Descargar PDF
   downloadPDF: (id) => {
     window.open(`${api.defaults.baseURL}/cotizaciones/${id}/pdf`, '_blank');